@@ -10,12 +10,13 @@ from pathlib import Path
 from langchain_community.chat_message_histories import RedisChatMessageHistory 
 import redis
 
-# str转换为dict 
-import ast
-
 # redis    
 from app.server.redis_service import redis_service , chat_message_history
+from app.utils.log_util import get_logger
+from app.utils.serialization import InstanceRecord
 from config.settings import settings
+
+logger = get_logger("chat")
   
 
 from langchain_core.messages import BaseMessage
@@ -87,6 +88,18 @@ class ChatInstance:
         # self.messages: List[ChatMessage] = []
         self.messages: List[BaseMessage] = []
         self.files: List[ChatFile] = []
+        # 实例索引信息（历史消息按需加载，只记录条数与最后活动时间）
+        self.message_count = 0
+        self.last_activity: Optional[str] = None
+
+    @classmethod
+    def from_index(cls, item: Dict) -> "ChatInstance":
+        """根据实例索引（redis_service.list_instance_index 的一项）创建实例对象，不加载历史消息"""
+        instance = cls(item.get("id"), item.get("name") or "新聊天")
+        instance.created_at = item.get("created_at") or instance.created_at
+        instance.message_count = item.get("message_count", 0)
+        instance.last_activity = item.get("last_activity")
+        return instance
 
     # 获取聊天消息
     def get_message(self,instance):
@@ -120,12 +133,9 @@ class ChatInstance:
                                                  message_type,
                                                  message_time
                                                  )
-        
-        mes = chat_message_history_client.messages
-        # print(f'app/models/chat.py: add_message1: 添加消息完成:',mes,'\n\n\n\n\n======================\n\n\n')
-        self.messages.append(mes) 
-        # print(f'app/models/chat.py: add_message2: 添加消息完成:{self.messages}')
-        return mes
+        # 不再读取完整历史消息，只更新索引信息（历史消息由页面按需加载）
+        self.message_count += 2
+        self.last_activity = message_time
 
     # # 添加聊天消息
     # def add_message(self, user_message: str, ai_response: str, message_type: str = "text", 
@@ -185,9 +195,11 @@ class ChatInstance:
 class ChatInstanceManager:
     """聊天实例管理器"""
     
-    def __init__(self, data_dir: str = "redis_data"):
+    def __init__(self, data_dir: str = "redis_data", doc_service=None):
         # 存储所有聊天实例的字典，键为实例ID，值为ChatInstance对象
         self.instances: Dict[str, ChatInstance] = {} 
+        # 文档服务：删除/重命名实例时同步处理实例的Chroma集合（为None时不处理）
+        self.doc_service = doc_service
         # self.data_dir = Path(data_dir)
         # self.data_file = self.data_dir / "chat_instances.json"
         
@@ -220,58 +232,62 @@ class ChatInstanceManager:
     def get_instance(self, instance_id: str) -> Optional[ChatInstance]:
         """根据ID获取聊天实例""" 
         try:
-            instance_json = ast.literal_eval(redis_service.get_instance(instance_id).decode('utf-8')) 
-            
-            chatinstance = ChatInstance(
-                        instance_json.get('id'),
-                        instance_json.get('name')
-                        )
-            chatinstance.created_at = instance_json.get("created_at")
+            record = redis_service.get_instance(instance_id)
+            if record is None:
+                return None
+            chatinstance = ChatInstance.from_index(record.to_dict())
             # 存储到实例字典中 
-            self.instances[instance_json.get('id')] = chatinstance 
+            self.instances[chatinstance.id] = chatinstance 
             return chatinstance  
         except Exception as e:  
-            print('获取id聊天实例异常')
+            logger.warning("获取聊天实例 %s 异常: %s", instance_id, e)
 
  
 
     # 获取所有聊天实例
-    def get_all_instances(self) -> List[Dict]:
+    def get_all_instances(self, refresh: bool = True) -> List[ChatInstance]:
         """
-        获取所有聊天实例的字典形式\n
-        return : 所有聊天实例的字典列表
+        获取所有聊天实例（只包含索引信息，不加载历史消息）\n
+        refresh : 是否先从redis重新读取实例索引；为False时直接返回已加载的实例
+        return : 聊天实例列表
         """  
-        #从redis中获取所有实例
-        instances = redis_service.get_all_instances()
-        # print('获取所有实例：',instances) 
-        instances_list = []
-        for i in instances:
-            instances_list.append(i) 
-        return instances_list
+        if refresh:
+            self.load_instances()
+        return list(self.instances.values())
 
 
     
     # 删除一个聊天实例
     def delete_instance(self, instance_id: str) -> bool:
-        """删除聊天实例"""
-        instance = ast.literal_eval(redis_service.get_instance(instance_id).decode('utf-8'))
-        if instance and len(instance) > 1:
+        """删除聊天实例（实例记录、历史消息、论文数据与Chroma集合）"""
+        instance = redis_service.get_instance(instance_id)
+        if instance is not None:
             redis_service.remove_instance(instance_id)  
+            if self.doc_service is not None:
+                self.doc_service.delete_collection(instance_id)
             # 删除实例字典中
-            del self.instances[instance_id]
+            self.instances.pop(instance_id, None)
             return True
         return False 
 
     # 重命名一个聊天实例
     def rename_instance(self, instance_id: str, new_name: str) -> bool:
-        """重命名聊天实例"""
-        instance = ast.literal_eval(redis_service.get_instance(instance_id).decode('utf-8'))
+        """重命名聊天实例（存储中的数据与Chroma集合一起改名，集合改名失败时回滚）"""
+        instance = redis_service.get_instance(instance_id)
 
-        if instance and len(instance) > 1:
+        if instance is not None:
             redis_service.rename_instance(instance_id, new_name)
-            instance_new =ast.literal_eval(redis_service.get_instance(new_name).decode('utf-8'))
+            if self.doc_service is not None:
+                try:
+                    self.doc_service.rename_collection(instance_id, new_name)
+                except Exception:
+                    # 集合改名失败时把存储中的数据改回原实例id，避免实例与它的向量数据分离
+                    logger.exception("Chroma集合改名失败，回滚实例id %s -> %s", new_name, instance_id)
+                    redis_service.rename_instance(new_name, instance_id)
+                    raise
+            instance_new = ChatInstance.from_index(redis_service.get_instance(new_name).to_dict())
             # 删除实例字典中
-            del self.instances[instance_id]
+            self.instances.pop(instance_id, None)
             # 新增实例字典中
             self.instances[new_name] = instance_new
             return True
@@ -284,109 +300,36 @@ class ChatInstanceManager:
     def save_instances(self, instance: ChatInstance) -> None:
         """保存聊天实例数据到Redis"""
         try:     
-            instance_dict = instance.to_dict()  
-            # 存储到redis中，使用json字符串格式
-            import json
-            redis_service.add_instance(instance.id , json.dumps(instance_dict)) 
-            print(f"chat/save_instances 成功保存实例 {instance.id} 到Redis")
+            # 历史消息单独保存在消息列表中，实例记录只保存元数据
+            record = InstanceRecord(
+                id=instance.id,
+                name=instance.name,
+                created_at=instance.created_at,
+                files=[file.to_dict() for file in instance.files],
+            )
+            redis_service.add_instance(instance.id, record)
+            logger.info("成功保存实例 %s 到Redis", instance.id)
         except Exception as e:  
-            print(f"chat/save_instances 保存实例数据到redis失败: {e}")
+            logger.error("保存实例数据到redis失败: %s", e)
  
  
 
  
     def load_instances(self) -> None:
         """
-        从redis中初始化所有聊天实例数据，将所有实例数据加载到全局chat_service.py/chat_manager对象中\n
+        从redis中加载轻量的实例索引（id、名称、创建时间、消息数、最后活动时间）\n
+        只需两次管道请求，不读取任何实例的历史消息；历史消息在选中实例时按需加载\n
         return : None 
         """
-        
         try:
-            # 获取所有实例ID
-            instances_list =redis_service.get_all_instances_list()
-
-            # print(f'redis获取所有实例{instances_list}')
-
-            # 清空当前实例
-            self.instances.clear()
-
-            # 从redis中解析实例对象
-            for instance_id in instances_list:
-                instance_id = instance_id
-                # 通过用户id创建一个聊天实例类对象
-                instance = ChatInstance(instance_id)   
-                # 从redis中获取该实例数据
-                instance_str = redis_service.get_instance(instance_id)
-                
-                # 判断该实例是否存在
-                if instance_str:
-                    try:
-                        # 尝试使用JSON解析
-                        import json
-                        redis_instance_data = json.loads(instance_str)
-                        # print('app/models/chat.py/load_instances: 使用JSON进行解析实例数据',redis_instance_data)
-                    except json.JSONDecodeError:
-                        # 如果JSON解析失败，尝试使用ast.literal_eval
-                        redis_instance_data = ast.literal_eval(instance_str)
-                        # print('chat/models/chat.py/load_instances: 使用ast.literal_eval进行解析实例数据',redis_instance_data)
-                else:
-                    # 如果redis中不存在该实例数据，则返回None
-                    redis_instance_data = None
-  
-                #判断解析出来的实例数据是否为空
-                if redis_instance_data:
-                    try:
-                        # 将解析的实例数据赋值给 ChatInstance 对象
-                        instance_dict = redis_instance_data 
-                        instance.name = instance_dict.get('name', instance.name)
-                        instance.created_at = instance_dict.get('created_at', instance.created_at)
-                        instance.messages = instance_dict.get('message',instance.messages)
-                        instance.files = instance_dict.get('fiels',instance.files) 
-                    except (ValueError, SyntaxError) as e:
-                        print(f'解析实例数据失败: {e}')
- 
-                # 从Redis恢复历史消息客户端 
-                chat_message_history_client: RedisChatMessageHistory = chat_message_history.get_chat_message_history_client(str(instance_id))
-                # 通过历史消息客户端获取历史消息
-                mess = chat_message_history_client.messages 
-                #将实例对象中添加历史消息
-                instance.messages.append(mess)
-
-
-                # 将历史消息转换为ChatMessage对象
-                # for msg in chat_message_history.messages:
-                #     if msg.type == 'human':
-                #         # 找到配对的AI消息
-                #         ai_msg = None
-                #         for next_msg in chat_message_history.messages:
-                #             if next_msg.type == 'ai' and next_msg.id > msg.id:
-                #                 ai_msg = next_msg
-                #                 break
-
-                #         chat_message = ChatMessage(
-                #             user_message=msg.content,
-                #             ai_response=ai_msg.content if ai_msg else '',
-                #             message_type='text'
-                #         )
-                #         instance.messages.append(chat_message)
-
-                # # 恢复文件
-                # for file_data in instance_data.get("files", []):
-                #     file = ChatFile(
-                #         file_data["filename"],
-                #         file_data["saved_name"],
-                #         file_data["size"],
-                #         file_data["type"]
-                #     )
-                #     file.id = file_data["id"]
-                #     file.upload_time = file_data["upload_time"]
-                #     instance.files.append(file) 
-                #将实例对象添加到实例字典中
-                self.instances[instance.id] = instance
-            # 循环完所有的实例后进行打印 个数
-            print(f"成功加载 {len(self.instances)} 个聊天实例")     
+            instances = {}
+            for item in redis_service.list_instance_index():
+                instance = ChatInstance.from_index(item)
+                instances[instance.id] = instance
+            self.instances = instances
+            logger.debug("成功加载 %d 个聊天实例索引", len(self.instances))
         except Exception as e:
-            print(f"chat.py/load_instances 加载实例数据失败: {e}")
+            logger.error("加载实例数据失败: %s", e)
             # 如果加载失败，创建空实例字典
             self.instances = {}
 
@@ -1,17 +1,76 @@
-﻿import os
+﻿import asyncio
+import hashlib
+import json
+import os
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Iterable
+from typing import AsyncIterator, Iterable
 
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from langchain_core.documents import Document
+from langchain_core.messages import HumanMessage, SystemMessage
 
+from app.server.context_packer import ContextPacker
+from app.server.digest_service import DigestService, is_overview_question, load_digests
 from app.server.document_service import DocumentService
+from app.server.followup_cache import ACTION_EXTEND, ACTION_REPLACE, FollowupCache
+from app.server.llm_scheduler import (
+    PRIORITY_AUXILIARY,
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
+)
+from app.server.model_router import (
+    TASK_ANSWER,
+    TASK_AUXILIARY,
+    TASK_BACKGROUND,
+    TASK_DEEP,
+    ModelRouter,
+    is_deep_question,
+    record_usage,
+    usage_collector,
+)
+from app.server.paper_router import PaperRouter
 from app.server.redis_service import chat_message_history, redis_service
-from app.utils.log_util import time_decorator
+from app.server.stream_coalescer import stream_coalescer
+from app.utils.async_runner import async_runner
+from app.utils.chunk_adjacency import (
+    build_adjacency,
+    ends_mid_sentence,
+    leading_context,
+    starts_mid_sentence,
+    trailing_context,
+)
+from app.utils.log_util import debug_payload, get_logger
+from app.utils.paper_structure import extract_structure, parse_structure_query, resolve_chunks
+from app.utils.pdf_metadata import extract_local_metadata
+from app.utils import token_counter
+from app.utils.token_counter import count_message_tokens, count_tokens, fit_to_budget
+from app.utils.trace_util import RequestTrace, tracer
 
 from config.settings import settings
 
+logger = get_logger("ai_service")
+
+# 对比类问题的关键词
+_COMPARISON_PATTERN = re.compile(
+    r"\b(compare|comparison|compared|versus|vs\.?|differences?|differ|similarit(?:y|ies)|contrast)\b|"
+    r"\u5bf9\u6bd4|\u6bd4\u8f83|\u533a\u522b|\u5f02\u540c|\u4e0d\u540c|\u5dee\u5f02",
+    re.IGNORECASE,
+)
+
+
+def is_comparison_question(question: str) -> bool:
+    """
+    判断是否为对比类问题（比较多篇论文的异同）
+        参数:
+            question: 用户问题
+        返回:
+            bool: 是否为对比类问题
+    """
+    return bool(_COMPARISON_PATTERN.search(question or ""))
+
+
 class AIService:
     """ 
     功能：
@@ -24,30 +83,24 @@ class AIService:
         # 历史消息存储key
         self.MEMORY_KEY = "history_memory"
 
-        # api key
-        api_key = os.getenv("DEEPSEEK_API_KEY" ) # 请输入你的api-key
-        url_base = os.getenv("DEEPSEEK_BASE_URL" )
-
-        # 流式回复模型
-        self.chat_llm = ChatOpenAI(
-            model=settings.CHAT_LLM_MODEL,
-            api_key=api_key,
-            base_url=url_base,
-            temperature=0,
-            streaming=True,
-            # extra_body={"thinking": {"type": "enabled"}},
-        )
-
-        # 非流式回复模型
-        self.chat_llm_nostream = ChatOpenAI(
-            model=settings.CHAT_LLM_MODEL,
-            api_key=api_key,
-            base_url=url_base,
-            temperature=0,
-            streaming=False,
-        )
+        # 模型路由：按任务类型与近期耗时/错误率选择对话模型、推理模型或本地Ollama
+        self.router = ModelRouter()
 
         self.doc_service = DocumentService()
+        # 论文导入线程池：向量化存储在后台执行，与元数据解析并行
+        self.ingest_executor = ThreadPoolExecutor(max_workers=settings.INGEST_WORKERS, thread_name_prefix="ingest")
+        # 检索片段打包器：按token预算裁剪与选择片段
+        self.context_packer = ContextPacker()
+        # 论文分层摘要：导入完成后在后台生成
+        self.digest_service = DigestService(self.router)
+        # 论文路由：论文较多时先选出相关论文，再在这些论文中检索片段
+        self.paper_router = PaperRouter(self.doc_service)
+        # 追问上下文缓存：追问时复用上一轮的检索片段，减少精简问题与检索的调用
+        self.followup_cache = FollowupCache()
+        # 多论文检索线程池：各论文的向量检索并行执行
+        self.retrieval_executor = ThreadPoolExecutor(max_workers=settings.RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+        # 在后台线程中预加载tokenizer词表，避免首次计数时在事件循环中下载
+        token_counter.warm_up()
 
     def _is_chinese(self, text: str) -> bool:
         """
@@ -64,13 +117,14 @@ class AIService:
             返回：
                 List 历史消息列表
         """
-        # 1.获取该聊天实例的历史消息客户端
-        history_client = chat_message_history.get_chat_message_history_client(instance_id)
-        # 2. 从历史消息客户端中获取消息
-        messages = history_client.messages
-        if not messages:
-            return []
-        return messages[-limit:]
+        # 只读取最近的 limit 条消息（范围读取，不读取全部历史与归档）
+        return chat_message_history.get_recent_messages(instance_id, limit)
+
+    async def _aget_history_messages(self, instance_id: str, limit: int = 8):
+        """
+        异步获取该聊天实例的历史消息（Redis读取放到线程池中执行，不阻塞事件循环）
+        """
+        return await asyncio.to_thread(self._get_history_messages, instance_id, limit)
 
     def _needs_condense(self, question: str) -> bool:
         """
@@ -108,12 +162,13 @@ class AIService:
         # 2. 检查是否包含触发词 或 消息长度小于40 
         return any(t in q for t in triggers) #or len(question) < 40
 
-    def _condense_question(self, question: str, history_messages):
+    async def _acondense_question(self, question: str, history_messages, instance_id: str = ""):
         """
-        根据历史消息进行精简问题 ,构建系统提示词，通过非流式模型进行推理，返回合并后的问题
+        根据历史消息进行精简问题 ,构建系统提示词，通过非流式模型进行异步推理，返回合并后的问题
             参数:
                 question: 用户输入的问题
                 history_messages: 历史消息列表
+                instance_id: 聊天实例id，用于LLM调度的公平排队
             返回:
                 string 合并后的问题
         """
@@ -132,11 +187,14 @@ class AIService:
         ]
         # 使用非流式模型进行推理
         try:
-            result = self.chat_llm_nostream.invoke(messages)
+            # 经过模型路由，辅助调用使用独立的调度配额，优先级低于用户问答
+            result = await self.router.ainvoke(TASK_AUXILIARY, messages, instance_id, PRIORITY_AUXILIARY, 100)
             # 4. 从结果中提取精简后的问题 并进行前后空格处理
             condensed = getattr(result, "content", "")
             return condensed.strip() or question
-        except Exception:
+        except Exception as exc:
+            # 降级：使用原问题进行检索
+            logger.warning("精简问题失败，使用原问题检索：%s", exc)
             return question
 
     def _retrieve(self, query: str, instance_id: str):
@@ -316,135 +374,712 @@ class AIService:
             )
         return system_prompt, user_prompt
 
-    def _stream_with_sources(self, prompt_messages, use_chinese: bool, header: str) -> Iterable[str]:
+    async def _astream_with_sources(self, prompt_messages, use_chinese: bool, header: str, instance_id: str = "",
+                                    trace: RequestTrace | None = None, task: str = TASK_ANSWER) -> AsyncIterator[str]:
         """
-        流式返回AI响应内容，支持头部信息 
+        异步流式返回AI响应内容，支持头部信息 
             参数:
                 prompt_messages: 发送给AI模型的提示消息列表
                 use_chinese: 是否使用中文模式（当前未使用，保留参数）
                 header: 响应头部信息，如加载提示等
+                instance_id: 聊天实例id，用于LLM调度的公平排队
+                trace: 链路追踪对象，记录排队、首token、生成速率与流式总耗时
+                task: 路由任务类型，普通问答或需要推理的复杂问题
                 
             返回:
-                Iterable[str]: 生成器，逐个产生响应文本片段
+                AsyncIterator[str]: 异步生成器，逐个产生响应文本片段
         """
         # 如果存在头部信息，首先返回头部
         if header:
             yield header
-            
-        # 遍历语言模型流式返回的数据块
-        for chunk in self.chat_llm.stream(prompt_messages):
-            # 获取数据块中的内容，如果不存在则返回None
-            content = getattr(chunk, "content", None)
-            # 只有当内容不为空时才返回
-            if content:
-                yield content
-
-    @time_decorator
-    def get_response_stream(self, message: str, instance_id: str, paper_id: str | None = None):
-        """
-        获取流式响应
-        1.进行问题处理判断回复的语言 
-        2.获取该用户的历史聊天记录 
-        3.根据问题进行判断是否需要与历史聊天记录进行精简用户的问题
-        4.将问题进行向量化检索文档
-        5.获取文档的元数据，目的：ai输出时表明引用的是哪篇论文
-        6.将问题、向量化文档、历史聊天记录 进行提示词格式化
-        7.进行流式回复
+
+        # 模型路由选择后端并经过该后端的调度器准入（整个流式过程占用一个槽位）
+        route: dict = {}
+        first_token_at = None
+        parts = []
+        try:
+            # 首个数据块前失败会自动重试或切换后端，首块/块间超时避免会话无限等待
+            async for chunk in self.router.astream(
+                task, prompt_messages, instance_id, PRIORITY_INTERACTIVE, settings.ANSWER_MAX_OUTPUT_TOKENS,
+                route=route, trace=trace,
+            ):
+                # 获取数据块中的内容，如果不存在则返回None
+                content = getattr(chunk, "content", None)
+                # 只有当内容不为空时才返回
+                if content:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    parts.append(content)
+                    yield content
+        except Exception as exc:
+            logger.error("流式回复失败：%s", exc)
+            if use_chinese:
+                yield "\n\n（模型服务暂时不可用或响应超时，请稍后重试）" if parts else "模型服务暂时不可用或响应超时，请稍后重试。"
+            else:
+                yield "\n\n(The model service is unavailable or timed out, please retry later.)" if parts else "The model service is unavailable or timed out, please retry later."
+        finished = time.perf_counter()
+        # 记录首token、生成速率与流式总耗时（排队耗时由模型路由按后端记录）
+        started = route.get("admitted_at")
+        if trace is not None and started is not None:
+            backend = route.get("backend")
+            trace.record("stream_total", (finished - started) * 1000, backend=backend)
+            if first_token_at is not None:
+                trace.record("ttft", (first_token_at - started) * 1000, backend=backend)
+                generate_seconds = finished - first_token_at
+                if generate_seconds > 0:
+                    usage = route.get("usage") or {}
+                    completion_tokens = usage.get("output_tokens") or count_tokens("".join(parts))
+                    trace.record("tokens_per_s", completion_tokens / generate_seconds, unit="tokens/s", backend=backend)
+
+    def get_response_stream(self, message: str, instance_id: str, paper_id: str | None = None,
+                            paper_ids: list[str] | None = None) -> Iterable[str]:
+        """
+        获取流式响应的同步适配器（供 st.write_stream 使用）
+        在后台事件循环中执行 aget_response_stream，并将异步生成器转换为同步生成器
+            参数:
+                message: 用户输入的问题
+                instance_id: 聊天实例id
+                paper_id: 论文id
+                paper_ids: 多论文模式下选中的论文id列表
+            返回：
+                Iterable[str]: 流式响应内容
+        """
+        return async_runner.iterate(self.aget_response_stream(message, instance_id, paper_id, paper_ids))
+
+    async def aget_response_stream(self, message: str, instance_id: str, paper_id: str | None = None,
+                                   paper_ids: list[str] | None = None) -> AsyncIterator[str]:
+        """
+        异步获取流式响应
+        不需要精简的问题，会与进行中的相同请求（同一实例、论文范围、论文集版本、历史消息、归一化问题、语言）合并，
+        只由第一个请求驱动LLM生成，其余请求订阅并重放同一份流式输出，结束后按驱动请求的用量补记token用量
             参数:
                 message: 用户输入的问题
                 instance_id: 聊天实例id
                 paper_id: 论文id
+                paper_ids: 多论文模式下选中的论文id列表（两篇及以上时生效）
             返回：
                 流式响应内容
         """
-        # 1. 去除前后空格
         question = message.strip()
-        print(f'\n\n\n question: {question}')
-        # 2. 检查是否有中文
         use_chinese = self._is_chinese(question)
-        # 3. 获取该聊天实例的历史消息
-        history_messages = self._get_history_messages(instance_id)
-
-        print(f'history_messages: {history_messages}')
-        # 4. 检查是否需要精简问题
-        if self._needs_condense(question):
-            # 4.1 根据历史消息精简问题
-            print('\n\n\n ==============1================= \n\n\n ')
-            retrieval_query = self._condense_question(question, history_messages)
+        # 只选中一篇论文时等同于单论文模式
+        paper_ids = list(dict.fromkeys(paper_ids or []))
+        if len(paper_ids) == 1:
+            paper_id, paper_ids = paper_ids[0], []
+        if paper_ids:
+            paper_id = None
+        # 检查该实例当天的token用量是否超过上限（合并进已有生成的请求同样检查）
+        limit_message = await self._adaily_limit_message(instance_id, use_chinese)
+        if limit_message:
+            yield limit_message
+            return
+        # 需要结合历史消息精简的问题，还会复用上一轮的检索片段，不参与合并
+        if not settings.COALESCE_ENABLED or self._needs_condense(question):
+            async for part in self._agenerate_answer(question, use_chinese, instance_id, paper_id, paper_ids):
+                yield part
+            return
+        # 提示词包含历史消息：先读取历史，驱动请求使用同一份历史，历史消息摘要作为合并key的一部分
+        history_messages = await self._aget_history_messages(instance_id)
+        # 论文导入或删除后论文集版本号递增，进行中的旧版本生成不再被合并
+        version = await asyncio.to_thread(redis_service.get_paper_set_version, instance_id)
+        scope = tuple(sorted(paper_ids)) if paper_ids else paper_id
+        key = (
+            instance_id, scope, version, self._history_digest(history_messages),
+            stream_coalescer.normalize_question(question), use_chinese,
+        )
+
+        async def _record_shared_usage(meta: dict) -> None:
+            # 合并进来的请求同样计入token用量
+            for backend, usage in meta.get("usage", []):
+                await asyncio.to_thread(record_usage, instance_id, backend, usage)
+
+        async for part in stream_coalescer.stream(
+            key,
+            lambda meta: self._agenerate_shared(
+                meta, question, use_chinese, instance_id, paper_id, paper_ids, history_messages
+            ),
+            on_shared=_record_shared_usage,
+        ):
+            yield part
+
+    async def _adaily_limit_message(self, instance_id: str, use_chinese: bool) -> str | None:
+        """该实例当天的token用量达到上限时返回提示信息，否则返回None"""
+        if not settings.USAGE_DAILY_TOKEN_LIMIT:
+            return None
+        used = await asyncio.to_thread(redis_service.get_today_usage_tokens, instance_id)
+        if used < settings.USAGE_DAILY_TOKEN_LIMIT:
+            return None
+        logger.info("实例 %s 当天token用量 %d 已达上限", instance_id, used)
+        return (
+            f"今日token用量已达上限（{settings.USAGE_DAILY_TOKEN_LIMIT}），请明天再试。"
+            if use_chinese
+            else f"The daily token limit ({settings.USAGE_DAILY_TOKEN_LIMIT}) has been reached, please try again tomorrow."
+        )
+
+    @staticmethod
+    def _history_digest(history_messages: list) -> str:
+        """历史消息摘要（消息类型 + 内容），相同摘要的请求提示词中的历史消息相同"""
+        digest = hashlib.sha1()
+        for msg in history_messages:
+            digest.update(f"{msg.type}\x00{msg.content}\x00".encode("utf-8"))
+        return digest.hexdigest()
+
+    async def _agenerate_shared(self, meta: dict, question: str, use_chinese: bool, instance_id: str,
+                                paper_id: str | None, paper_ids: list[str], history_messages: list) -> AsyncIterator[str]:
+        """合并生成的驱动请求：收集本次生成记录的token用量，供合并进来的请求补记"""
+        meta["usage"] = []
+        # 驱动任务有独立的上下文，设置收集器不影响其他请求
+        usage_collector.set(meta["usage"])
+        async for part in self._agenerate_answer(question, use_chinese, instance_id, paper_id, paper_ids,
+                                                 history_messages):
+            yield part
+
+    async def _agenerate_answer(self, question: str, use_chinese: bool, instance_id: str, paper_id: str | None = None,
+                                paper_ids: list[str] | None = None,
+                                history_messages: list | None = None) -> AsyncIterator[str]:
+        """
+        生成一次流式回复
+        1.获取该用户的历史聊天记录 
+        2.根据问题进行判断是否需要与历史聊天记录进行精简用户的问题
+        3.将问题进行向量化检索文档
+        4.获取文档的元数据，目的：ai输出时表明引用的是哪篇论文
+        5.将问题、向量化文档、历史聊天记录 进行提示词格式化
+        6.进行流式回复
+            参数:
+                question: 去除前后空格的用户问题
+                use_chinese: 是否使用中文回复
+                instance_id: 聊天实例id
+                paper_id: 论文id
+                paper_ids: 多论文模式下选中的论文id列表
+                history_messages: 已读取的历史消息，为None时在生成前读取
+            返回：
+                流式响应内容
+        """
+        # 开始链路追踪，所有阶段耗时都带有 instance_id 与 paper_id 标签
+        trace = tracer.start("question", instance_id=instance_id, paper_id=paper_id or (",".join(paper_ids) if paper_ids else None))
+        try:
+            async for part in self._agenerate_traced(question, use_chinese, instance_id, paper_id, trace, paper_ids,
+                                                     history_messages):
+                yield part
+        finally:
+            trace.finish()
+
+    async def _agenerate_traced(self, question: str, use_chinese: bool, instance_id: str, paper_id: str | None,
+                                trace: RequestTrace, paper_ids: list[str] | None = None,
+                                history_messages: list | None = None) -> AsyncIterator[str]:
+        """
+        按阶段执行问答流程，并记录每个阶段的耗时
+        """
+        logger.info("收到问题 instance_id=%s paper_id=%s paper_ids=%s 长度=%d",
+                    instance_id, paper_id, paper_ids, len(question))
+        # 1. 获取该聊天实例的历史消息（合并生成时已提前读取）
+        if history_messages is None:
+            with trace.span("history"):
+                history_messages = await self._aget_history_messages(instance_id)
+
+        debug_payload(logger, "问题：%s 历史消息：%s", question, history_messages)
+        # 2. 追问时先检查上一轮的检索片段能否复用（本地词项比对，不调用模型）
+        scope = tuple(sorted(paper_ids)) if paper_ids else paper_id
+        followup_action, turn, version = ACTION_REPLACE, None, None
+        if settings.FOLLOWUP_CACHE_ENABLED and self._needs_condense(question):
+            version = await asyncio.to_thread(redis_service.get_paper_set_version, instance_id)
+            followup_action, turn = self.followup_cache.lookup(instance_id, scope, version, question)
+            if followup_action == ACTION_REPLACE:
+                turn = None
+        if turn is not None:
+            # 复用上一轮的检索问题，不再精简问题
+            retrieval_query = f"{turn.query} {question}"
+            trace.record("followup_cache", 1, unit="hit", action=followup_action)
+        elif self._needs_condense(question):
+            # 2.1 根据历史消息精简问题
+            with trace.span("condense"):
+                retrieval_query = await self._acondense_question(question, history_messages, instance_id)
         else:
-            print('\n\n\n ==============2================= \n\n\n ')
             retrieval_query = question
-        print(f'\n\n\n\n retrieval_query: {retrieval_query}')
+        logger.debug("检索问题：%s", retrieval_query)
 
-        # 5. 根据问题进行向量化检索 并根据paper_id 进行筛选向量化的论文
-        docs = self._retrieve_with_paper(retrieval_query, instance_id, paper_id)
-        # docs = self._retrieve_with_paper(question, instance_id, paper_id)
-        print(f'\n\n\n docs: {docs}')
+        # 2.2 多论文对比类问题：逐篇并行回答（map），再流式汇总对比（reduce）
+        if paper_ids and settings.COMPARE_MAP_REDUCE and is_comparison_question(retrieval_query):
+            async for part in self._acompare_papers(question, retrieval_query, use_chinese, instance_id, paper_ids,
+                                                    history_messages, trace):
+                yield part
+            return
 
-        # 6. 将检索到的文档进行格式化 
-        context_text = self._format_context(docs, use_chinese)
-        print(f'\n\n\n context_text: {context_text}')
+        docs = []
+        context_text = ""
+        # 3. 明确引用页码/章节/图表的问题：按论文结构直接读取片段，跳过向量化检索
+        structure_ref = None
+        if settings.STRUCTURE_LOOKUP_ENABLED and not paper_ids:
+            structure_ref = parse_structure_query(retrieval_query)
+        if structure_ref:
+            with trace.span("structure_lookup"):
+                docs = await asyncio.to_thread(self._lookup_structure, structure_ref, instance_id, paper_id)
+            logger.debug("结构直查 %s 读取到 %d 个文档片段", structure_ref, len(docs))
+        # 3.1 追问复用上一轮的片段，必要时补充相邻片段
+        if not docs and turn is not None:
+            docs = list(turn.docs)
+            if followup_action == ACTION_EXTEND:
+                with trace.span("followup_extend"):
+                    docs += await asyncio.to_thread(self._neighbour_chunks, instance_id, turn)
+            logger.debug("追问复用上一轮片段 处理方式=%s 片段数=%d", followup_action, len(docs))
+        # 3.2 概述类问题优先使用预生成的分层摘要，不再检索零散片段
+        if not docs and is_overview_question(retrieval_query):
+            with trace.span("digest"):
+                digests = await asyncio.to_thread(load_digests, instance_id, paper_id, paper_ids)
+            if digests:
+                context_text = self.digest_service.format_context(digests, use_chinese, with_sections=bool(paper_id))
+                logger.debug("使用分层摘要回答 篇数=%d", len(digests))
+        if not docs and not context_text:
+            # 3.3 根据问题进行向量化检索 并根据paper_id 进行筛选向量化的论文（多论文时各论文并行检索）
+            if paper_ids:
+                per_paper = await asyncio.to_thread(self._retrieve_multi, retrieval_query, instance_id, paper_ids, trace)
+                docs = self._interleave(per_paper)
+            else:
+                docs = await self._aretrieve_with_paper(retrieval_query, instance_id, paper_id, trace)
+            logger.debug("检索到 %d 个文档片段", len(docs))
+            debug_payload(logger, "检索文档：%s", docs)
+            # 3.3.1 命中的片段在句子中间被切开时，用前后片段补全
+            if docs and settings.NEIGHBOUR_EXPANSION_ENABLED:
+                with trace.span("neighbour_expansion"):
+                    docs = await asyncio.to_thread(self._expand_neighbours, instance_id, docs)
+        if docs:
+            # 保存本轮的检索片段，供下一轮追问复用
+            if settings.FOLLOWUP_CACHE_ENABLED:
+                if version is None:
+                    version = await asyncio.to_thread(redis_service.get_paper_set_version, instance_id)
+                self.followup_cache.store(instance_id, scope, version, turn.query if turn else retrieval_query, docs)
+            # 3.4 按token预算打包：片段只保留与问题最相关的句子，按边际价值选择片段（多论文时每篇至少保留一个片段）
+            with trace.span("context_pack"):
+                docs = self.context_packer.pack(retrieval_query, docs, group_key="paper_id" if paper_ids else None)
+            logger.debug("打包后保留 %d 个文档片段", len(docs))
+        # 4. 按token预算裁剪：先去掉排名最低的片段，再去掉最早的历史消息
+        with trace.span("token_budget"):
+            docs, history_messages, prompt_tokens = self._fit_token_budget(
+                question, docs, context_text, history_messages, use_chinese
+            )
+        trace.record("prompt_tokens_estimate", prompt_tokens, unit="tokens")
+        # 4.1 将检索到的文档进行格式化
+        if docs:
+            context_text = self._format_context(docs, use_chinese)
+        debug_payload(logger, "上下文：%s", context_text)
         # 获取该论文的元数据
         selected_meta = None
         if paper_id:
             # 根据论文id + 用户实例id 获取该论文的元数据
-            selected_meta = redis_service.get_paper_metadata(instance_id, paper_id)
-        # 7. 构建 元数据或文档中获取 源标头信息
+            with trace.span("metadata"):
+                selected_meta = await asyncio.to_thread(redis_service.get_paper_metadata, instance_id, paper_id)
+        # 5. 构建 元数据或文档中获取 源标头信息
         header = self._build_source_header(docs, use_chinese, selected_meta)
-        print(f'\n\n\n selected_meta: {selected_meta}')
-        print(f'\n\n\n selected_meta-summary: {selected_meta.get("summary")}, selected_meta-title: {selected_meta.get("paper_title")}')
-        # 8. 构建提示词
+        debug_payload(logger, "选中论文元数据：%s", selected_meta)
+        # 6. 构建提示词
+        with trace.span("prompt_build"):
+            system_prompt, user_prompt = self._build_prompt(question, context_text, use_chinese)
+            prompt_messages = [SystemMessage(content=system_prompt)] + history_messages + [
+                HumanMessage(content=user_prompt)
+            ]
+        debug_payload(logger, "提示词：%s", prompt_messages)
+        # 7. 调用语言模型流式返回响应内容，复杂问题路由到推理模型
+        task = TASK_DEEP if settings.REASONER_ENABLED and is_deep_question(question) else TASK_ANSWER
+        async for part in self._astream_with_sources(prompt_messages, use_chinese, header, instance_id, trace, task):
+            yield part
+
+    def _fit_token_budget(self, question: str, docs: list, context_text: str, history_messages: list,
+                          use_chinese: bool) -> tuple[list, list, int]:
+        """
+        将提示词控制在 settings.CONTEXT_TOKEN_BUDGET 以内（提示词越长，首token延迟越高）
+            1. 系统提示词、问题与已确定的上下文（分层摘要）不可裁剪
+            2. 检索片段按相关性排序，先裁剪排名最低的片段，至少保留 CONTEXT_MIN_CHUNKS 个
+            3. 再从最早的历史消息开始裁剪
+            参数:
+                question: 用户问题
+                docs: 按相关性排序的检索片段
+                context_text: 已确定的上下文（使用分层摘要时），检索片段时为空
+                history_messages: 按时间排序的历史消息
+                use_chinese: 是否使用中文
+            返回:
+                tuple[list, list, int]: 保留的片段、保留的历史消息、裁剪后的提示词token数
+        """
         system_prompt, user_prompt = self._build_prompt(question, context_text, use_chinese)
-        prompt_messages = [SystemMessage(content=system_prompt)] + history_messages + [
-            HumanMessage(content=user_prompt)
-        ]
-        print(f'\n\n\n prompt_messages: {prompt_messages}')
-        # 9. 调用语言模型流式返回响应内容
-        return self._stream_with_sources(prompt_messages, use_chinese, header)
+        fixed_tokens = count_message_tokens([system_prompt, user_prompt])
+        # 每个片段额外计入引用标记与分隔符
+        chunk_tokens = [count_tokens(doc.page_content) + 8 for doc in docs]
+        history_tokens = [count_message_tokens([msg]) for msg in history_messages]
+        keep_chunks, history_start = fit_to_budget(
+            settings.CONTEXT_TOKEN_BUDGET,
+            fixed_tokens,
+            chunk_tokens,
+            history_tokens,
+            settings.CONTEXT_MIN_CHUNKS,
+        )
+        if keep_chunks < len(docs) or history_start:
+            logger.info(
+                "提示词超出预算，裁剪片段 %d→%d，历史消息 %d→%d",
+                len(docs), keep_chunks, len(history_messages), len(history_messages) - history_start,
+            )
+        prompt_tokens = fixed_tokens + sum(chunk_tokens[:keep_chunks]) + sum(history_tokens[history_start:])
+        return docs[:keep_chunks], history_messages[history_start:], prompt_tokens
 
-    def get_response(self, message: str, instance_id: str, paper_id: str | None = None) -> str:
+    def get_response(self, message: str, instance_id: str, paper_id: str | None = None,
+                     paper_ids: list[str] | None = None) -> str:
         """
         非流式输出时，将流式响应内容拼接成一个字符串
             参数：
                 message: 用户输入的问题
                 instance_id: 聊天实例id
                 paper_id: 论文id
+                paper_ids: 多论文模式下选中的论文id列表
             返回：
                 str: 拼接后的响应字符串
         """
         # 初始化空列表
         chunks = []
         # 循环将流式响应内容添加到列表中
-        for part in self.get_response_stream(message, instance_id, paper_id):
+        for part in self.get_response_stream(message, instance_id, paper_id, paper_ids):
             chunks.append(part)
         # 将列表中的内容拼接成一个字符串
         return "".join(chunks)
 
-    def _retrieve_with_paper(self, query: str, instance_id: str, paper_id: str | None):
+    def _retrieve_with_paper(self, query: str, instance_id: str, paper_id: str | None, trace: RequestTrace | None = None):
         """
         根据查询字符串进行向量化检索 并根据paper_id 进行筛选向量化的论文
         参数:
             query: 查询字符串
             instance_id: 聊天实例id
             paper_id: 论文id
+            trace: 链路追踪对象，分别记录查询向量化、论文路由与向量检索耗时
         返回：
             List:检索到的文档列表
         """
-        # 1. 获取检索器
-        retriever = self.doc_service.get_retriever(instance_id, paper_id)
-        
-        print(f'\n ===== \n instance_id:{instance_id} , paper_id:{paper_id}')
-        print(f'\n\n\n retriever: {retriever}')
-        # 2. 进行向量化检索
+        logger.debug("向量检索 instance_id=%s paper_id=%s", instance_id, paper_id)
         try:
-            return retriever.invoke(query)
-        except Exception:
+            # 1. 查询向量化
+            started = time.perf_counter()
+            embedding = self.doc_service.embed_query(query)
+            embedded = time.perf_counter()
+            # 2. 未指定论文时先进行论文路由，只在最相关的论文中检索
+            routed_ids = None
+            if not paper_id and settings.PAPER_ROUTING_ENABLED:
+                routed_ids = self._route_papers(instance_id, embedding)
+            routed = time.perf_counter()
+            # 3. 进行向量检索
+            docs = self.doc_service.search_by_vector(
+                instance_id, embedding, paper_id, settings.RETRIEVAL_CANDIDATE_K, paper_ids=routed_ids
+            )
+            searched = time.perf_counter()
+        except Exception as exc:
+            # 降级：没有检索片段，仅根据历史消息回答
+            logger.warning("向量检索失败：%s", exc)
             return []
+        if trace is not None:
+            trace.record("query_embedding", (embedded - started) * 1000)
+            if routed_ids is not None:
+                trace.record("paper_routing", (routed - embedded) * 1000, papers=len(routed_ids))
+            trace.record("vector_search", (searched - routed) * 1000)
+        return docs
+
+    def _route_papers(self, instance_id: str, embedding: list[float]) -> list[str] | None:
+        """
+        论文路由（两阶段检索的第一阶段），失败时降级为检索全部论文
+            返回:
+                list[str] | None: 选中的论文id，None表示检索全部论文
+        """
+        try:
+            paper_ids = redis_service.list_paper_ids(instance_id)
+            routed_ids = self.paper_router.route(instance_id, embedding, paper_ids)
+        except Exception as exc:
+            logger.warning("论文路由失败，检索全部论文：%s", exc)
+            return None
+        if routed_ids is not None:
+            logger.debug("论文路由 %d→%d 篇", len(paper_ids), len(routed_ids))
+        return routed_ids
+
+    async def _aretrieve_with_paper(self, query: str, instance_id: str, paper_id: str | None, trace: RequestTrace | None = None):
+        """
+        异步向量化检索（向量化与Chroma检索为同步调用，放到线程池中执行，不阻塞事件循环）
+        """
+        return await asyncio.to_thread(self._retrieve_with_paper, query, instance_id, paper_id, trace)
+
+    def _lookup_structure(self, ref: dict, instance_id: str, paper_id: str | None) -> list:
+        """
+        结构直查：根据论文结构把页码/章节/图表引用解析为分块号，再按片段id直接读取
+        未指定论文时只有该实例只有一篇论文才能确定引用的是哪篇论文
+            参数:
+                ref: parse_structure_query 的结果
+                instance_id: 聊天实例id
+                paper_id: 论文id
+            返回:
+                list: 片段列表，无法解析时为空列表（回退到向量检索）
+        """
+        try:
+            if not paper_id:
+                paper_ids = redis_service.list_paper_ids(instance_id)
+                if len(paper_ids) != 1:
+                    return []
+                paper_id = paper_ids[0]
+            structure = redis_service.get_paper_structure(instance_id, paper_id)
+            if not structure:
+                return []
+            chunks = resolve_chunks(structure, ref, settings.STRUCTURE_LOOKUP_MAX_CHUNKS)
+            return self.doc_service.get_chunks(instance_id, paper_id, chunks)
+        except Exception as exc:
+            logger.warning("结构直查失败，回退到向量检索：%s", exc)
+            return []
+
+    def _neighbour_chunks(self, instance_id: str, turn) -> list:
+        """
+        读取上一轮排名靠前的片段的前后相邻片段（按邻接索引得到片段id，一次批量读取，不需要向量化）
+            参数:
+                instance_id: 聊天实例id
+                turn: 上一轮的检索结果
+            返回:
+                list: 相邻片段，相关性分数略低于来源片段
+        """
+        existing = turn.chunk_ids
+        sources = [
+            doc for doc in turn.docs[:settings.FOLLOWUP_NEIGHBOUR_SOURCES]
+            if doc.metadata.get("paper_id") and isinstance(doc.metadata.get("chunk"), int)
+        ]
+        try:
+            adjacency = redis_service.get_chunk_adjacency(
+                instance_id, list({doc.metadata["paper_id"] for doc in sources})
+            )
+            wanted: dict[str, float] = {}
+            for doc in sources:
+                paper_id, chunk = doc.metadata["paper_id"], doc.metadata["chunk"]
+                entry = adjacency.get(paper_id, {}).get(str(chunk))
+                # 没有邻接索引的论文不扩展（重新导入后生成邻接索引）
+                if not entry:
+                    continue
+                relevance = float(doc.metadata.get("relevance", 1.0)) * 0.9
+                for neighbour_id in (entry["prev"], entry["next"]):
+                    if neighbour_id and neighbour_id not in existing:
+                        wanted.setdefault(neighbour_id, relevance)
+            found = self.doc_service.get_chunks_by_ids(instance_id, list(wanted))
+        except Exception as exc:
+            logger.warning("读取相邻片段失败：%s", exc)
+            return []
+        neighbours = []
+        for neighbour_id, doc in found.items():
+            doc.metadata["relevance"] = wanted.get(neighbour_id, 0.5)
+            neighbours.append(doc)
+        return neighbours
+
+    def _expand_neighbours(self, instance_id: str, docs: list) -> list:
+        """
+        相邻片段扩展：排名靠前的片段在句子中间被切开时，用前后片段补全被截断的句子
+            1. 从邻接索引中取得前后片段id（一次HMGET读取所有相关论文的邻接索引）
+            2. 所有需要的相邻片段一次批量读取，不需要额外的相似度检索
+            3. 按字符偏移去掉片段之间的重叠部分，只补充到句子边界
+            参数:
+                instance_id: 聊天实例id
+                docs: 按相关性排序的检索片段
+            返回:
+                list: 扩展后的片段（顺序不变，元数据中 expanded=True 表示已扩展）
+        """
+        sources = docs[:settings.NEIGHBOUR_EXPANSION_SOURCES]
+        paper_ids = list({doc.metadata.get("paper_id") for doc in sources if doc.metadata.get("paper_id")})
+        try:
+            adjacency = redis_service.get_chunk_adjacency(instance_id, paper_ids)
+            plans = {}
+            for index, doc in enumerate(sources):
+                entry = adjacency.get(doc.metadata.get("paper_id"), {}).get(str(doc.metadata.get("chunk")))
+                if not entry:
+                    continue
+                prev_id = entry["prev"] if starts_mid_sentence(doc.page_content) else None
+                next_id = entry["next"] if ends_mid_sentence(doc.page_content) else None
+                if prev_id or next_id:
+                    plans[index] = (entry, prev_id, next_id)
+            if not plans:
+                return docs
+            neighbours = self.doc_service.get_chunks_by_ids(
+                instance_id, [i for _, prev_id, next_id in plans.values() for i in (prev_id, next_id) if i]
+            )
+        except Exception as exc:
+            logger.warning("相邻片段扩展失败：%s", exc)
+            return docs
+
+        max_chars = settings.NEIGHBOUR_EXPANSION_MAX_CHARS
+        expanded = list(docs)
+        for index, (entry, prev_id, next_id) in plans.items():
+            doc = docs[index]
+            paper_adjacency = adjacency[doc.metadata["paper_id"]]
+            text = doc.page_content
+            if prev_id in neighbours:
+                prev = neighbours[prev_id]
+                prev_entry = paper_adjacency.get(str(prev.metadata.get("chunk")), {})
+                lead = leading_context(prev.page_content, prev_entry, entry, max_chars)
+                if lead.strip():
+                    text = f"{lead.rstrip()} {text.lstrip()}"
+            if next_id in neighbours:
+                nxt = neighbours[next_id]
+                next_entry = paper_adjacency.get(str(nxt.metadata.get("chunk")), {})
+                tail = trailing_context(nxt.page_content, next_entry, entry, max_chars)
+                if tail.strip():
+                    text = f"{text.rstrip()} {tail.lstrip()}"
+            if text != doc.page_content:
+                expanded[index] = Document(page_content=text, metadata={**doc.metadata, "expanded": True})
+        logger.debug("相邻片段扩展 %d 个片段", sum(1 for d in expanded if d.metadata.get("expanded")))
+        return expanded
+
+    def _retrieve_multi(self, query: str, instance_id: str, paper_ids: list[str],
+                        trace: RequestTrace | None = None) -> dict[str, list]:
+        """
+        多论文并行检索：查询只向量化一次，各论文的向量检索在线程池中并行执行，每篇论文有独立的召回配额
+            参数:
+                query: 查询字符串
+                instance_id: 聊天实例id
+                paper_ids: 论文id列表
+                trace: 链路追踪对象，记录查询向量化与并行检索总耗时
+            返回:
+                dict[str, list]: 论文id -> 按相关性排序的文档列表（检索失败的论文为空列表）
+        """
+        logger.debug("多论文向量检索 instance_id=%s paper_ids=%s", instance_id, paper_ids)
+        started = time.perf_counter()
+        try:
+            embedding = self.doc_service.embed_query(query)
+        except Exception as exc:
+            logger.warning("查询向量化失败：%s", exc)
+            return {paper_id: [] for paper_id in paper_ids}
+        embedded = time.perf_counter()
+        # 每篇论文的召回配额：候选总数平均分配，且不少于 MULTI_PAPER_MIN_QUOTA
+        quota = max(settings.MULTI_PAPER_MIN_QUOTA, settings.RETRIEVAL_CANDIDATE_K // len(paper_ids))
+        futures = {
+            paper_id: self.retrieval_executor.submit(
+                self.doc_service.search_by_vector, instance_id, embedding, paper_id, quota
+            )
+            for paper_id in paper_ids
+        }
+        results = {}
+        for paper_id, future in futures.items():
+            try:
+                results[paper_id] = future.result()
+            except Exception as exc:
+                logger.warning("论文 %s 向量检索失败：%s", paper_id, exc)
+                results[paper_id] = []
+        searched = time.perf_counter()
+        if trace is not None:
+            trace.record("query_embedding", (embedded - started) * 1000)
+            trace.record("vector_search", (searched - embedded) * 1000, papers=len(paper_ids))
+        return results
+
+    @staticmethod
+    def _interleave(per_paper: dict[str, list]) -> list:
+        """按排名交错合并各论文的检索结果（第1名们、第2名们……），避免某一篇论文占满候选"""
+        ranked = list(per_paper.values())
+        depth = max((len(docs) for docs in ranked), default=0)
+        return [docs[rank] for rank in range(depth) for docs in ranked if rank < len(docs)]
+
+    async def _acompare_papers(self, question: str, retrieval_query: str, use_chinese: bool, instance_id: str,
+                               paper_ids: list[str], history_messages: list,
+                               trace: RequestTrace) -> AsyncIterator[str]:
+        """
+        多论文对比问答（map-reduce）
+            1. map：各论文并行检索，再并行向模型提问，哪篇先完成就先输出哪篇的回答
+            2. reduce：根据各论文的回答流式生成对比总结
+            参数:
+                question: 用户问题
+                retrieval_query: 检索问题（精简后的问题）
+                use_chinese: 是否使用中文
+                instance_id: 聊天实例id
+                paper_ids: 论文id列表
+                history_messages: 历史消息
+                trace: 链路追踪对象
+            返回:
+                AsyncIterator[str]: 流式响应内容
+        """
+        with trace.span("metadata"):
+            metas = await asyncio.to_thread(redis_service.list_paper_metadata, instance_id)
+        titles = {}
+        for meta in metas or []:
+            if meta.get("paper_id") in paper_ids:
+                titles[meta["paper_id"]] = meta.get("paper_title") or meta.get("source_name") or meta["paper_id"]
+        per_paper = await asyncio.to_thread(self._retrieve_multi, retrieval_query, instance_id, paper_ids, trace)
+
+        names = "；".join(titles.get(paper_id, paper_id) for paper_id in paper_ids)
+        yield f"正在对比的论文：{names}\n\n" if use_chinese else f"Papers being compared: {names}\n\n"
+
+        # map：各论文的回答并行生成，按完成顺序输出
+        started = time.perf_counter()
+        tasks = [
+            asyncio.ensure_future(self._aanswer_single_paper(
+                question, retrieval_query, use_chinese, instance_id, titles.get(paper_id, paper_id), per_paper[paper_id]
+            ))
+            for paper_id in paper_ids
+        ]
+        answers = []
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                title, answer = await next_done
+                answers.append((title, answer))
+                yield f"### {title}\n{answer}\n\n"
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+        trace.record("compare_map", (time.perf_counter() - started) * 1000, papers=len(paper_ids))
+
+        # reduce：根据各论文的回答生成对比总结
+        findings = "\n\n".join(f"[{title}]\n{answer}" for title, answer in answers)
+        if use_chinese:
+            system_prompt = (
+                "你是一名论文问答助手。下面是针对同一问题，分别根据每篇论文得到的回答。"
+                "请对比这些论文：列出相同点与不同点（方法、数据集、实验结论、局限性），"
+                "只使用给出的回答中的信息，不要编造。使用与用户问题相同的语言作答。"
+            )
+            user_prompt = f"用户问题：{question}\n\n各论文的回答：\n{findings}"
+            header = "---\n**对比总结**\n\n"
+        else:
+            system_prompt = (
+                "You are a paper QA assistant. Below are answers to the same question, one per paper. "
+                "Compare the papers: list similarities and differences (methods, datasets, results, limitations). "
+                "Use only the information in the given answers and do not invent anything. "
+                "Respond in the same language as the user."
+            )
+            user_prompt = f"User question: {question}\n\nPer-paper answers:\n{findings}"
+            header = "---\n**Comparison**\n\n"
+        prompt_messages = [SystemMessage(content=system_prompt)] + history_messages + [HumanMessage(content=user_prompt)]
+        async for part in self._astream_with_sources(prompt_messages, use_chinese, header, instance_id, trace):
+            yield part
+
+    async def _aanswer_single_paper(self, question: str, retrieval_query: str, use_chinese: bool, instance_id: str,
+                                    title: str, docs: list) -> tuple[str, str]:
+        """
+        对比问答的map阶段：只根据一篇论文的检索片段简要回答
+            返回:
+                tuple[str, str]: 论文标题、回答内容（失败时为提示信息）
+        """
+        docs = self.context_packer.pack(retrieval_query, docs)
+        context_text = self._format_context(docs, use_chinese)
+        if use_chinese:
+            system_prompt = (
+                f"你是一名论文问答助手。只根据论文《{title}》的片段简要回答问题中与这篇论文相关的部分，"
+                "关键结论后用片段的引用标记引用，片段中没有答案时直接说明未找到。"
+            )
+            user_prompt = f"用户问题：{question}\n\n论文片段：\n{context_text or '（未找到相关片段）'}"
+        else:
+            system_prompt = (
+                f"You are a paper QA assistant. Using only the snippets from the paper \"{title}\", briefly answer "
+                "the part of the question that concerns this paper, citing snippet tags. Say so if the answer is not there."
+            )
+            user_prompt = f"User question: {question}\n\nPaper snippets:\n{context_text or '(no relevant snippets found)'}"
+        messages = [SystemMessage(content=system_prompt), HumanMessage(content=user_prompt)]
+        try:
+            result = await self.router.ainvoke(
+                TASK_ANSWER, messages, instance_id, PRIORITY_INTERACTIVE, settings.COMPARE_MAP_MAX_TOKENS
+            )
+            answer = (getattr(result, "content", "") or "").strip()
+        except Exception as exc:
+            logger.warning("论文 %s 的回答生成失败：%s", title, exc)
+            answer = ""
+        if not answer:
+            answer = "（该论文的回答生成失败）" if use_chinese else "(Failed to answer for this paper.)"
+        return title, answer
 
     def _summarize_paper(self, 
                          first_page_text: str,
                            fallback_title: str,
-                             use_chinese: bool) -> tuple[str, str]:
+                             use_chinese: bool,
+                               instance_id: str = "") -> tuple[str, str]:
         """
         解析获取出论文的元数据 包含标题 与 摘要
             1.根据参数 use_chinese 生成使用中文/英文 系统提示词
@@ -455,6 +1090,7 @@ class AIService:
                     first_page_text: 首页文本
                     fallback_title: 标题
                     use_chinese: 是否中文
+                    instance_id: 聊天实例id，用于LLM调度的公平排队
                 输出：
                     title: 标题
                     summary: 摘要
@@ -476,25 +1112,136 @@ class AIService:
         messages = [SystemMessage(content=system_prompt), HumanMessage(content=text[:2000])]
         # 5.调用非流式输出LLM 进行解析 
         try:
-            result = self.chat_llm_nostream.invoke(messages)
+            # 经过模型路由，后台解析任务优先级最低
+            result = self.router.invoke(TASK_BACKGROUND, messages, instance_id, PRIORITY_BACKGROUND, 200)
             content = getattr(result, "content", "")
-            import json
-
             data = json.loads(content)
             title = data.get("title") or fallback_title
             summary = data.get("summary") or ""
             return title, summary
-        except Exception:
+        except Exception as exc:
+            # 降级：使用文件名作为标题
+            logger.warning("LLM解析论文标题失败，使用文件名：%s", exc)
             return fallback_title, ""
 
+    def _ingest_paper(self,
+                      file_path: str,
+                      instance_id: str,
+                      source_name: str | None = None,
+                      source_file: str | None = None,
+                      source_url: str | None = None) -> tuple[int, dict]:
+        """
+        导入论文：向量化与元数据解析并行执行
+            1.加载并切割文档（速度快），提取论文结构（章节、图表标题、参考文献范围）
+            2.向量化存储提交到导入线程池，在后台执行（耗时最长）
+            3.同时从PDF本身解析标题与一句话摘要（/Info、XMP、首页排版、摘要首句），不调用LLM
+            4.本地解析不到标题或摘要时，才调用LLM兜底解析
+            5.标题确定后立即写入 status=indexing 的元数据，界面可以先显示论文
+            6.等待向量化完成：失败时删除预写入的元数据并抛出异常，成功时写入 status=ready 的元数据
+            7.提交后台任务生成论文路由向量与分层摘要（章节摘要 + 全文摘要）
+                输入：
+                    file_path: 文件路径
+                    instance_id: 实例ID
+                    source_name: 来源名称
+                    source_file: 来源文件
+                    source_url: 来源URL
+                输出：
+                    tuple[int, dict]: 片段数量与论文元数据
+        """
+        # 1.加载并切割文档
+        documents, meta = self.doc_service.load_paper(
+            file_path,
+            source_name=source_name,
+            source_url=source_url,
+            source_file=source_file,
+        )
+        splits = self.doc_service.split_documents(documents)
+        # 提取论文结构（章节、图表标题、参考文献范围），同时在片段元数据中写入所属章节
+        structure = extract_structure(splits)
+        # 构建片段邻接索引（前后片段id、页码、字符偏移）
+        adjacency = build_adjacency(splits)
+        # 2.向量化存储在后台线程执行
+        index_future = self.ingest_executor.submit(self.doc_service.index_documents, splits, instance_id)
+
+        # 3.本地解析标题与摘要
+        first_page_text = meta.get("first_page_text", "")
+        fallback_title = meta.get("source_name") or source_name or ""
+        local_meta = extract_local_metadata(file_path, first_page_text)
+        title = local_meta["title"]
+        summary = local_meta["summary"]
+        title_source = local_meta["title_source"]
+        # 4.本地解析不完整时调用LLM兜底
+        if not title or not summary:
+            use_chinese = self._is_chinese(first_page_text or fallback_title)
+            llm_title, llm_summary = self._summarize_paper(first_page_text, fallback_title, use_chinese, instance_id)
+            if not title:
+                title = llm_title
+                title_source = "llm" if llm_title != fallback_title else "filename"
+            summary = summary or llm_summary
+        logger.info("解析出的标题：%s（来源：%s）", title, title_source)
+
+        # 5.预写入元数据
+        paper_meta = {
+            "paper_id": meta.get("paper_id"),
+            "instance_id": instance_id,
+            "file_id": meta.get("source_file"),
+            "file_name": meta.get("source_name"),
+            "paper_title": title,
+            "page_count": meta.get("page_count"),
+            "summary": summary,
+            "source_url": meta.get("source_url"),
+            "path": meta.get("source_path"),
+            "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "title_source": title_source,
+            "status": "indexing",
+        }
+        redis_service.add_paper_metadata(instance_id, paper_meta["paper_id"], paper_meta)
+
+        # 6.等待向量化完成
+        try:
+            chunk_count = index_future.result()
+        except Exception:
+            redis_service.remove_paper_metadata(instance_id, paper_meta["paper_id"])
+            raise
+        paper_meta["status"] = "ready"
+        debug_payload(logger, "构建的论文元数据：%s", paper_meta)
+        # 论文结构、邻接索引与就绪状态在一个事务中写入
+        redis_service.complete_paper_ingest(instance_id, paper_meta["paper_id"], paper_meta, structure, adjacency)
+        logger.info("论文元数据已存储 paper_id=%s", paper_meta["paper_id"])
+        # 7.在后台生成论文路由向量与分层摘要，不阻塞导入
+        if settings.PAPER_ROUTING_ENABLED:
+            self.ingest_executor.submit(self.paper_router.build_routes, instance_id, paper_meta["paper_id"], [title, summary])
+        if settings.DIGEST_ENABLED:
+            self.ingest_executor.submit(
+                self._build_digest,
+                instance_id,
+                paper_meta,
+                documents,
+                self._is_chinese(first_page_text or fallback_title),
+            )
+        return chunk_count, paper_meta
+
+    def _build_digest(self, instance_id: str, paper_meta: dict, documents: list, use_chinese: bool) -> None:
+        """
+        生成分层摘要，成功后把全文摘要加入论文路由向量
+            参数:
+                instance_id: 聊天实例id
+                paper_meta: 论文元数据
+                documents: 按页加载的文档列表
+                use_chinese: 是否使用中文
+        """
+        title = paper_meta.get("paper_title") or ""
+        digest = self.digest_service.build_digest(instance_id, paper_meta["paper_id"], title, documents, use_chinese)
+        if digest and settings.PAPER_ROUTING_ENABLED:
+            self.paper_router.build_routes(
+                instance_id,
+                paper_meta["paper_id"],
+                [title, paper_meta.get("summary") or "", digest.get("paper_summary") or ""],
+            )
+
     def process_file_upload(self, filename: str, file_path: str, instance_id: str) -> dict:
         """
-        处理文件上传 并解析出论文的元数据
-        1.使用文本解析器解析pdf文件
-        2.获取pdf首页的数据
-        3.调用LLM解析论文首页 的title 与 summary
-        4.构建论文元数据
-        5.将元数据存储在redis中
+        处理文件上传 并解析出论文的元数据（向量化与元数据解析并行，见 _ingest_paper）
             输入：
                 filename: 文件名
                 file_path: 文件路径
@@ -502,45 +1249,14 @@ class AIService:
             输出：
                 dict: 论文元数据
         """
-        print(f'\n ===== \n 开始处理文件上传: {filename} , 路径: {file_path} , 实例ID: {instance_id}')
+        logger.info("开始处理文件上传：%s 路径：%s 实例ID：%s", filename, file_path, instance_id)
         try:
-            print('\n ===== \n 开始解析pdf')
-            # 调用pdf解析
-            chunk_count, meta = self.doc_service.process_pdf(
+            chunk_count, paper_meta = self._ingest_paper(
                 file_path,
                 instance_id,
                 source_name=filename,
                 source_file=os.path.basename(file_path),
-                reset_collection=False,
-            )
-            # print(f'\n ===== \n 解析出的元数据: {chunk_count} , {meta}')
-            # 获取 文本内容，并判断是否包含中文字符
-            use_chinese = self._is_chinese(meta.get("first_page_text", "") or filename)
-            # print(f'\n ===== \n 是否包含中文字符: {use_chinese}')
-            # 调用LLM解析论文首页 的title 与 summary
-            title, summary = self._summarize_paper(
-                meta.get("first_page_text", ""),
-                meta.get("source_name") or filename,
-                use_chinese,
             )
-            print(f'\n ===== \n 解析出的标题: {title} , 摘要: {summary}')
-            # 构建论文元数据
-            paper_meta = {
-                "paper_id": meta.get("paper_id"),
-                "instance_id": instance_id,
-                "file_id": meta.get("source_file"),
-                "file_name": meta.get("source_name"),
-                "paper_title": title,
-                "page_count": meta.get("page_count"),
-                "summary": summary,
-                "source_url": meta.get("source_url"),
-                "path": meta.get("source_path"),
-                "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            }
-            print(f'\n ===== \n 构建的论文元数据: {paper_meta}')
-            # 将论文元数据存储在reidis中
-            redis_service.add_paper_metadata(instance_id, paper_meta["paper_id"], paper_meta)
-            print('\n======\n 论文元数据已存储在redis中')
             # 返回解析后的信息
             return {
                 "message": f"文件 '{filename}' 上传成功，已解析 {chunk_count} 个片段。现在可以开始提问。",
@@ -574,31 +1290,16 @@ class AIService:
                 dict: 包含文件名、保存文件名、路径、url、类型的字典
         """ 
         try:
-            # 调用文档服务处理来源文件进行下载与向量化存储
-            file_info, chunk_count, meta = self.doc_service.process_source(source, instance_id)
-            # 进行判断是否包含中文字符
-            use_chinese = self._is_chinese(meta.get("first_page_text", "") or file_info.get("filename", ""))
-            # 调用LLM解析论文首页 的title 与 summary
-            title, summary = self._summarize_paper(
-                meta.get("first_page_text", ""),
-                meta.get("source_name") or file_info.get("filename", ""),
-                use_chinese,
+            # 下载来源文件
+            file_info = self.doc_service.download_source(source, instance_id)
+            # 向量化与元数据解析并行执行
+            chunk_count, paper_meta = self._ingest_paper(
+                file_info["path"],
+                instance_id,
+                source_name=file_info["filename"],
+                source_file=file_info.get("saved_name"),
+                source_url=file_info.get("url"),
             )
-            # 构建论文元数据
-            paper_meta = {
-                "paper_id": meta.get("paper_id"),
-                "instance_id": instance_id,
-                "file_id": meta.get("source_file"),
-                "file_name": meta.get("source_name"),
-                "paper_title": title,
-                "page_count": meta.get("page_count"),
-                "summary": summary,
-                "source_url": meta.get("source_url"),
-                "path": meta.get("source_path"),
-                "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            }
-            # 将论文元数据存储在reidis中
-            redis_service.add_paper_metadata(instance_id, paper_meta["paper_id"], paper_meta)
             # 返回解析后的信息
             return {
                 "file_info": file_info,
@@ -610,4 +1311,5 @@ class AIService:
                 ),
             }
         except Exception as exc:
-            return {"error": f"论文来源处理失败: {exc}"}
\ No newline at end of file
+            return {"error": f"论文来源处理失败: {exc}"}
+
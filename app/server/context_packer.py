@@ -0,0 +1,188 @@
+import re
+import zlib
+
+import numpy as np
+from langchain_core.documents import Document
+
+from app.utils.token_counter import count_tokens
+from config.settings import settings
+
+# 英文按单词、数字切分，中文按单字切分（再组成二元组）
+_TERM_PATTERN = re.compile(r"[a-z0-9]+|[\u4e00-\u9fff]")
+# 句子切分：中英文句末标点或换行
+_SENTENCE_PATTERN = re.compile(r"(?<=[.!?;。！？；])\s+|(?<=[。！？；])|\n+")
+# 每个片段额外计入的引用标记与分隔符token数
+_CITATION_OVERHEAD_TOKENS = 8
+
+
+def extract_terms(text: str) -> list[str]:
+    """提取词项：英文单词/数字，中文相邻二字组（单字作为兜底）"""
+    tokens = _TERM_PATTERN.findall(text.lower())
+    terms = []
+    for i, token in enumerate(tokens):
+        if "\u4e00" <= token <= "\u9fff":
+            if i + 1 < len(tokens) and "\u4e00" <= tokens[i + 1] <= "\u9fff":
+                terms.append(token + tokens[i + 1])
+            else:
+                terms.append(token)
+        else:
+            terms.append(token)
+    return terms
+
+
+def hash_vectors(texts: list[str], dim: int) -> np.ndarray:
+    """
+    将文本批量转换为归一化的哈希词项向量（对数词频），用于本地向量化相似度计算
+        参数:
+            texts: 文本列表
+            dim: 向量维度
+        返回:
+            np.ndarray: (len(texts), dim) 的float32矩阵，每行L2归一化
+    """
+    matrix = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for term in extract_terms(text):
+            matrix[row, zlib.crc32(term.encode("utf-8")) % dim] += 1.0
+    np.log1p(matrix, out=matrix)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def split_sentences(text: str) -> list[str]:
+    """将片段切分为句子（去掉空句）"""
+    return [s.strip() for s in _SENTENCE_PATTERN.split(text or "") if s and s.strip()]
+
+
+class ContextPacker:
+    """
+    按token预算打包检索片段
+        1. 片段相关性：向量检索返回的相关性分数（由查询向量计算）
+        2. 句子相关性：所有候选片段的句子一次性转换为哈希词项向量，与问题做矩阵乘法得到分数
+        3. 每个片段只保留与问题最相关的句子（不超过 chunk_max_tokens），保持原文顺序，省略处用"…"连接
+        4. 按边际价值贪心打包：价值 = 片段相关性 × 句子相关性，并扣除与已选片段的重复度
+        5. 输出的片段保留原元数据（页码、分块号），引用标记不变
+    """
+
+    def __init__(self,
+                 budget_tokens: int | None = None,
+                 chunk_max_tokens: int | None = None,
+                 dim: int = 4096,
+                 redundancy_penalty: float = 0.6):
+        self.budget_tokens = budget_tokens or settings.CONTEXT_PACK_TOKENS
+        self.chunk_max_tokens = chunk_max_tokens or settings.CONTEXT_CHUNK_MAX_TOKENS
+        self.dim = dim
+        self.redundancy_penalty = redundancy_penalty
+
+    @staticmethod
+    def _chunk_scores(docs: list[Document]) -> np.ndarray:
+        """片段相关性，归一化到(0, 1]；没有分数时按排名递减"""
+        raw = np.array(
+            [doc.metadata.get("relevance", 1.0 / (rank + 1)) for rank, doc in enumerate(docs)],
+            dtype=np.float32,
+        )
+        top = raw.max() if raw.size else 1.0
+        return raw / top if top > 0 else np.ones_like(raw)
+
+    def _trim(self, sentences: list[str], scores: np.ndarray) -> tuple[str, list[int]]:
+        """
+        保留最相关的句子直到达到单片段token上限（片段本身未超过上限时原样保留）
+            返回:
+                tuple[str, list[int]]: 裁剪后的文本、保留的句子下标
+        """
+        lengths = [count_tokens(s) for s in sentences]
+        if sum(lengths) <= self.chunk_max_tokens:
+            return " ".join(sentences), list(range(len(sentences)))
+        keep: list[int] = []
+        used = 0
+        for index in np.argsort(-scores, kind="stable"):
+            index = int(index)
+            # 第一句总是保留，其余只保留与问题有词项重合的句子
+            if keep and (scores[index] <= 0 or used + lengths[index] > self.chunk_max_tokens):
+                continue
+            keep.append(index)
+            used += lengths[index]
+        keep.sort()
+        parts = []
+        for position, index in enumerate(keep):
+            if position and index != keep[position - 1] + 1:
+                parts.append("…")
+            parts.append(sentences[index])
+        return " ".join(parts), keep
+
+    def pack(self, query: str, docs: list[Document], group_key: str | None = None) -> list[Document]:
+        """
+        按token预算打包检索片段
+            参数:
+                query: 检索问题
+                docs: 按相关性排序的候选片段（metadata 中可带 relevance 分数）
+                group_key: 分组的元数据字段（例如 paper_id），传入时先保证每组至少选中一个片段
+            返回:
+                list[Document]: 打包后的片段，保持原有排名顺序
+        """
+        if not docs:
+            return []
+        query_vector = hash_vectors([query], self.dim)[0]
+        sentences_per_doc = [split_sentences(doc.page_content) or [doc.page_content] for doc in docs]
+        all_sentences = [s for sentences in sentences_per_doc for s in sentences]
+        # 所有句子一次性向量化并与问题计算相似度
+        sentence_matrix = hash_vectors(all_sentences, self.dim)
+        sentence_scores = sentence_matrix @ query_vector
+        chunk_scores = self._chunk_scores(docs)
+
+        candidates = []
+        offset = 0
+        for rank, (doc, sentences) in enumerate(zip(docs, sentences_per_doc)):
+            scores = sentence_scores[offset:offset + len(sentences)]
+            rows = sentence_matrix[offset:offset + len(sentences)]
+            offset += len(sentences)
+            text, keep = self._trim(sentences, scores)
+            vector = rows[keep].sum(axis=0)
+            norm = np.linalg.norm(vector)
+            candidates.append({
+                "rank": rank,
+                "doc": doc,
+                "text": text,
+                "trimmed": len(keep) < len(sentences),
+                "tokens": count_tokens(text) + _CITATION_OVERHEAD_TOKENS,
+                "vector": vector / norm if norm > 0 else vector,
+                # 语义相关性为主，句子词项相关性为辅
+                "value": float(chunk_scores[rank]) * (0.5 + 0.5 * float(scores[keep].max())),
+            })
+
+        # 按边际价值贪心打包；分组时第一轮每组只选一个（每组配额），之后不再限制
+        selected = []
+        remaining = self.budget_tokens
+        pending_groups = (
+            {c["doc"].metadata.get(group_key) for c in candidates} if group_key else set()
+        )
+        while candidates:
+            best, best_value = None, 0.0
+            for candidate in candidates:
+                if pending_groups and candidate["doc"].metadata.get(group_key) not in pending_groups:
+                    continue
+                if candidate["tokens"] > remaining:
+                    continue
+                overlap = max((float(candidate["vector"] @ s["vector"]) for s in selected), default=0.0)
+                # 与已选片段几乎相同（例如切分重叠区域）时不再选择
+                if overlap >= 0.95:
+                    continue
+                marginal = candidate["value"] * (1 - self.redundancy_penalty * overlap)
+                if marginal > best_value:
+                    best, best_value = candidate, marginal
+            if best is None:
+                if pending_groups:
+                    # 剩余分组已无法放入预算，进入不限分组的阶段
+                    pending_groups = set()
+                    continue
+                break
+            pending_groups.discard(best["doc"].metadata.get(group_key) if group_key else None)
+            selected.append(best)
+            candidates.remove(best)
+            remaining -= best["tokens"]
+
+        selected.sort(key=lambda c: c["rank"])
+        return [
+            Document(page_content=c["text"], metadata={**c["doc"].metadata, "trimmed": c["trimmed"]})
+            for c in selected
+        ]
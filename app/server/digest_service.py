@@ -0,0 +1,267 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from app.server.llm_scheduler import PRIORITY_BACKGROUND
+from app.server.model_router import TASK_BACKGROUND
+from app.server.redis_service import redis_service
+from app.utils.log_util import get_logger
+from config.settings import settings
+
+logger = get_logger("digest_service")
+
+# 常见的论文一级标题（英文）
+_SECTION_NAMES = (
+    r"abstract|introduction|background|related work|preliminaries|method(?:s|ology)?|approach|model|"
+    r"experiments?|experimental setup|evaluation|results?|discussion|analysis|limitations?|"
+    r"conclusions?(?: and future work)?|future work|references|bibliography|acknowledg(?:e)?ments?|appendix"
+)
+# 一级标题：可选的编号 + 常见标题名，或 "1 Xxx" / "II. XXX" / "一、xxx" / "1 中文标题"
+_HEADING_PATTERNS = [
+    re.compile(rf"^(?:(?:\d+|[IVX]+)\.?\s+)?(?:{_SECTION_NAMES})\s*$", re.IGNORECASE),
+    re.compile(r"^(?:\d+\.?|[IVX]+\.)\s+[A-Z][A-Za-z\-\s:]{2,60}$"),
+    re.compile(r"^[一二三四五六七八九十]+[、.]\s*\S{2,20}$"),
+    re.compile(r"^\d+\s*[\u4e00-\u9fff]{2,20}$"),
+]
+# 不参与摘要的章节
+_SKIPPED_SECTIONS = re.compile(
+    r"references|bibliography|acknowledg|参考文献|致谢", re.IGNORECASE
+)
+# 概述类问题的关键词：总结全文、贡献、主要内容等
+_OVERVIEW_PATTERN = re.compile(
+    r"\b(summari[sz]e|summary|overview|tl;?dr|main (idea|point|contribution|finding)s?|contributions?|"
+    r"what is (this|the) paper about|key (idea|finding|takeaway)s?|in a nutshell)\b|"
+    r"总结|概括|概述|摘要|贡献|主要内容|"
+    r"主要观点|核心思想|讲了什么|说了什么|"
+    r"创新点",
+    re.IGNORECASE,
+)
+
+
+def is_overview_question(question: str) -> bool:
+    """
+    判断是否为概述类问题（总结全文、主要贡献等），这类问题使用预生成的分层摘要回答
+        参数:
+            question: 用户问题
+        返回:
+            bool: 是否为概述类问题
+    """
+    return bool(_OVERVIEW_PATTERN.search(question or ""))
+
+
+def _is_heading(line: str) -> bool:
+    text = line.strip()
+    if not 3 <= len(text) <= 80:
+        return False
+    return any(pattern.match(text) for pattern in _HEADING_PATTERNS)
+
+
+class DigestService:
+    """
+    论文分层摘要（map-reduce）
+        1. 按一级标题把论文切分为章节，识别不到标题时按固定长度分段
+        2. map：各章节摘要在线程池中并行生成，每次调用都经过模型路由与其调度器（后台优先级）
+        3. reduce：根据章节摘要归纳全文摘要
+        4. 结果存储在redis中，概述类问题直接使用，不再走向量检索
+    """
+
+    def __init__(self, router):
+        self.router = router
+        self.executor = ThreadPoolExecutor(max_workers=settings.DIGEST_WORKERS, thread_name_prefix="digest")
+
+    def split_sections(self, documents: list) -> list[dict]:
+        """
+        将按页加载的文档切分为章节
+            参数:
+                documents: 按页加载的文档列表
+            返回:
+                list[dict]: [{"title", "text", "page_start", "page_end"}]，页码从1开始
+        """
+        sections: list[dict] = []
+        current = {"title": "", "lines": [], "page_start": 1, "page_end": 1}
+        for page_index, doc in enumerate(documents):
+            page = doc.metadata.get("page", page_index)
+            page_num = page + 1 if isinstance(page, int) else page_index + 1
+            for line in doc.page_content.splitlines():
+                if _is_heading(line):
+                    if current["lines"]:
+                        sections.append(current)
+                    current = {"title": line.strip(), "lines": [], "page_start": page_num, "page_end": page_num}
+                    continue
+                if line.strip():
+                    current["lines"].append(line.strip())
+                    current["page_end"] = page_num
+        if current["lines"]:
+            sections.append(current)
+
+        # 识别不到章节结构时按固定长度分段
+        if len(sections) < 2:
+            sections = self._split_fixed(documents)
+        sections = [
+            {
+                "title": s["title"],
+                "text": " ".join(s["lines"]),
+                "page_start": s["page_start"],
+                "page_end": s["page_end"],
+            }
+            for s in sections
+            if not _SKIPPED_SECTIONS.search(s["title"])
+        ]
+        return self._merge_sections(sections)
+
+    @staticmethod
+    def _split_fixed(documents: list) -> list[dict]:
+        """按 DIGEST_SECTION_MAX_CHARS 把连续页面合并为分段"""
+        sections: list[dict] = []
+        current = None
+        for page_index, doc in enumerate(documents):
+            text = doc.page_content.strip()
+            if not text:
+                continue
+            size = sum(len(line) for line in current["lines"]) if current else 0
+            if current is None or size + len(text) > settings.DIGEST_SECTION_MAX_CHARS:
+                if current:
+                    sections.append(current)
+                current = {"title": "", "lines": [], "page_start": page_index + 1, "page_end": page_index + 1}
+            current["lines"].append(text)
+            current["page_end"] = page_index + 1
+        if current:
+            sections.append(current)
+        return sections
+
+    @staticmethod
+    def _merge_sections(sections: list[dict]) -> list[dict]:
+        """章节数超过 DIGEST_MAX_SECTIONS 时，反复合并相邻且最短的两个章节"""
+        sections = list(sections)
+        while len(sections) > settings.DIGEST_MAX_SECTIONS:
+            index = min(
+                range(len(sections) - 1),
+                key=lambda i: len(sections[i]["text"]) + len(sections[i + 1]["text"]),
+            )
+            left, right = sections[index], sections[index + 1]
+            sections[index:index + 2] = [{
+                "title": " / ".join(t for t in (left["title"], right["title"]) if t),
+                "text": f"{left['text']} {right['text']}",
+                "page_start": left["page_start"],
+                "page_end": right["page_end"],
+            }]
+        return sections
+
+    def _invoke(self, instance_id: str, system_prompt: str, text: str, max_output_tokens: int) -> str:
+        """通过模型路由（后台任务、后台优先级）调用非流式模型"""
+        messages = [SystemMessage(content=system_prompt), HumanMessage(content=text)]
+        result = self.router.invoke(TASK_BACKGROUND, messages, instance_id, PRIORITY_BACKGROUND, max_output_tokens)
+        return (getattr(result, "content", "") or "").strip()
+
+    def _summarize_section(self, instance_id: str, section: dict, use_chinese: bool) -> str:
+        """map：生成单个章节的摘要"""
+        system_prompt = (
+            "你是论文阅读助手。请用3-5句话概括下面这一章节的内容，保留关键方法、数据集、数字结论，不要编造。"
+            if use_chinese
+            else "You are a paper reading assistant. Summarize the following section in 3-5 sentences. "
+            "Keep key methods, datasets and numeric results. Do not invent anything."
+        )
+        title = section["title"] or ("（未命名章节）" if use_chinese else "(untitled section)")
+        text = f"{title}\n{section['text'][:settings.DIGEST_SECTION_MAX_CHARS]}"
+        return self._invoke(instance_id, system_prompt, text, 300)
+
+    def _summarize_paper(self, instance_id: str, title: str, sections: list[dict], use_chinese: bool) -> str:
+        """reduce：根据章节摘要归纳全文摘要"""
+        system_prompt = (
+            "你是论文阅读助手。根据各章节摘要，写出整篇论文的摘要：研究问题、方法、主要贡献、主要实验结论、局限性。"
+            if use_chinese
+            else "You are a paper reading assistant. From the section summaries, write a summary of the whole paper: "
+            "problem, method, main contributions, key experimental results and limitations."
+        )
+        lines = [f"{title}"]
+        for section in sections:
+            lines.append(f"[{section['title'] or '-'}] {section['summary']}")
+        return self._invoke(instance_id, system_prompt, "\n".join(lines), 600)
+
+    def build_digest(self, instance_id: str, paper_id: str, title: str, documents: list, use_chinese: bool) -> dict | None:
+        """
+        生成并存储论文的分层摘要，完成后在论文元数据中标记 digest=ready
+            参数:
+                instance_id: 聊天实例id
+                paper_id: 论文id
+                title: 论文标题
+                documents: 按页加载的文档列表
+                use_chinese: 是否使用中文
+            返回:
+                dict | None: 分层摘要，失败时返回None
+        """
+        sections = self.split_sections(documents)
+        if not sections:
+            return None
+        try:
+            # map：章节摘要并行生成
+            summaries = list(self.executor.map(
+                lambda section: self._summarize_section(instance_id, section, use_chinese), sections
+            ))
+            for section, summary in zip(sections, summaries):
+                section["summary"] = summary
+                del section["text"]
+            # reduce：全文摘要
+            paper_summary = self._summarize_paper(instance_id, title, sections, use_chinese)
+        except Exception as exc:
+            logger.warning("生成论文分层摘要失败 paper_id=%s: %s", paper_id, exc)
+            return None
+
+        digest = {
+            "paper_id": paper_id,
+            "title": title,
+            "paper_summary": paper_summary,
+            "sections": sections,
+            "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        redis_service.set_paper_digest(instance_id, paper_id, digest)
+        meta = redis_service.get_paper_metadata(instance_id, paper_id)
+        if meta:
+            meta["digest"] = "ready"
+            redis_service.add_paper_metadata(instance_id, paper_id, meta)
+        logger.info("论文分层摘要已生成 paper_id=%s 章节数=%d", paper_id, len(sections))
+        return digest
+
+    @staticmethod
+    def format_context(digests: list[dict], use_chinese: bool, with_sections: bool = True) -> str:
+        """
+        将分层摘要格式化为提示词上下文，章节摘要带页码范围，便于模型引用
+            参数:
+                digests: 分层摘要列表
+                use_chinese: 是否使用中文
+                with_sections: 是否包含章节摘要（多篇论文时只使用全文摘要）
+            返回:
+                str: 格式化后的上下文
+        """
+        blocks = []
+        for digest in digests:
+            label = "全文摘要" if use_chinese else "Paper summary"
+            blocks.append(f"[{digest.get('title', '')} {label}] {digest.get('paper_summary', '')}")
+            if not with_sections:
+                continue
+            for section in digest.get("sections", []):
+                pages = f"{section['page_start']}-{section['page_end']}"
+                page_tag = f"第{pages}页" if use_chinese else f"pages {pages}"
+                blocks.append(f"[{section.get('title') or '-'}, {page_tag}] {section.get('summary', '')}")
+        return "\n\n".join(blocks)
+
+
+def load_digests(instance_id: str, paper_id: str | None, paper_ids: list[str] | None = None) -> list[dict]:
+    """
+    读取分层摘要：指定论文时只读取该论文，指定论文列表时读取列表中的论文，否则读取该实例下所有论文
+        参数:
+            instance_id: 聊天实例id
+            paper_id: 论文id
+            paper_ids: 多论文模式下选中的论文id列表
+        返回:
+            list[dict]: 分层摘要列表，尚未生成时为空列表
+    """
+    if paper_ids:
+        digests = redis_service.list_paper_digests(instance_id)
+        return [digests[pid] for pid in paper_ids if pid in digests]
+    if paper_id:
+        digest = redis_service.get_paper_digest(instance_id, paper_id)
+        return [digest] if digest else []
+    return list(redis_service.list_paper_digests(instance_id).values())
@@ -1,4 +1,5 @@
 ﻿from math import e
+import hashlib
 import os
 from pydoc import doc
 import re
@@ -7,6 +8,7 @@ from urllib.parse import urlparse
 from urllib.request import urlopen
 
 import chromadb
+from chromadb.errors import NotFoundError
 from langchain_chroma import Chroma
 
 
@@ -16,6 +18,8 @@ from langchain_ollama import OllamaEmbeddings
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
 from config.settings import settings,ollamaLLMConfig
+from app.utils.log_util import get_logger
+from app.utils.resilience import get_policy, remaining_timeout
 
 from langchain_community.document_loaders import (
     PyPDFLoader,
@@ -27,6 +31,41 @@ import shutil
  
 from openai import OpenAI
 
+logger = get_logger("document_service")
+
+# Chroma集合名只允许字母、数字与 . _ -，且首尾必须是字母或数字
+_COLLECTION_ID_PATTERN = re.compile(r"[a-zA-Z0-9][a-zA-Z0-9._-]{0,500}")
+
+
+def collection_name(instance_id: str) -> str:
+    """
+    实例对应的Chroma集合名
+        实例id符合集合名规则时为 <实例id>_papers（与已有集合保持一致）；
+        包含中文、空格等字符时使用实例id的哈希，保证任意实例id都能创建与改名
+        参数:
+            instance_id: 聊天实例id
+        返回:
+            str: 集合名
+    """
+    if _COLLECTION_ID_PATTERN.fullmatch(instance_id):
+        return f"{instance_id}_papers"
+    return f"papers_{hashlib.sha1(instance_id.encode('utf-8')).hexdigest()}"
+
+
+class _DeadlineEmbeddingClient:
+    """
+    DashScope 向量化接口的包装：每次请求带上容错策略剩余的时间作为 request_timeout，
+    超过截止时间的请求在SDK内结束，不会在策略放弃等待后继续占用线程池
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+    def call(self, **kwargs):
+        kwargs.setdefault("request_timeout", remaining_timeout(settings.EMBEDDING_INDEX_TIMEOUT))
+        return self._client.call(**kwargs)
+
+
 class DocumentService:
     """
     功能：
@@ -53,10 +92,15 @@ class DocumentService:
             model=settings.EMBEDDINGS_LLM_MODEL,
             dashscope_api_key=api_key
         )
+        self.embeddings.client = _DeadlineEmbeddingClient(self.embeddings.client)
         
         # 定义向量化数据库客户端
         self.chroma_client = chromadb.PersistentClient(path=str(settings.CHROMADB_DIR))
 
+        # 容错策略：查询向量化带对冲请求；片段入库使用确定性id，重试是幂等的
+        self.embed_policy = get_policy("embedding", timeout=settings.EMBEDDING_TIMEOUT, hedge=True)
+        self.index_policy = get_policy("embedding_index", timeout=settings.EMBEDDING_INDEX_TIMEOUT)
+
     def _get_vectorstore(self, instance_id: str) -> Chroma:
         """
             获取或创建一个Chroma向量存储对象
@@ -68,7 +112,7 @@ class DocumentService:
 
         return Chroma(
             client=self.chroma_client,
-            collection_name=f"{instance_id}_papers",
+            collection_name=collection_name(instance_id),
             embedding_function=self.embeddings,
         )
 
@@ -153,7 +197,7 @@ class DocumentService:
             saved_name = f"{saved_name}.pdf"
         # 6.设置保存路径
         file_path = settings.UPLOAD_DIR / saved_name
-        print(f'app/server/document_service.py : _build_source_file_info : 文件名：{safe_name}，保存文件名：{saved_name}，路径：{file_path}，url：{url}，类型：application/pdf')
+        logger.debug("解析来源 文件名：%s，保存文件名：%s，路径：%s，url：%s", safe_name, saved_name, file_path, url)
         # 7.返回包含文件名、保存文件名、路径、url、类型的字典
         return {
             "filename": safe_name,
@@ -194,17 +238,31 @@ class DocumentService:
         file_info["size"] = total
         return file_info
 
-    def _reset_collection(self, instance_id: str) -> None:
+    def delete_collection(self, instance_id: str) -> None:
         """
             将指定实例ID的Chroma集合重置（删除）。
         """
-        name = f"{instance_id}_papers"
+        name = collection_name(instance_id)
         try:
             self.chroma_client.delete_collection(name)
         except Exception:
             # collection may not exist yet
             pass
 
+    def rename_collection(self, instance_id: str, new_id: str) -> None:
+        """
+        实例id变更时把Chroma集合改名为新实例id对应的名称（片段id与元数据不变）
+            参数:
+                instance_id: 原实例id
+                new_id: 新实例id
+        """
+        try:
+            collection = self.chroma_client.get_collection(collection_name(instance_id))
+        except NotFoundError:
+            # 还没有导入过论文的实例没有集合
+            return
+        collection.modify(name=collection_name(new_id))
+
     def _detect_file_format(self, file_path: str) -> str:
         """
         检测文件实际格式（根据文件头判断）
@@ -259,7 +317,7 @@ class DocumentService:
             try:
                 with open(file_path, 'r', encoding=encoding) as f:
                     content = f.read()
-                print(f"成功使用 {encoding} 编码读取文件")
+                logger.debug("成功使用 %s 编码读取文件", encoding)
                 break
             except UnicodeDecodeError:
                 continue
@@ -289,19 +347,9 @@ class DocumentService:
         """
         处理PDF文件，进行向量化存储
             1. 重置集合（如果需要）
-            2. 使用langchain的文档加载器加载PDF文件
-            3. 加载文档
-            4. 生成随机的paper_id
-            5. 生成显示名称和文件标签
-            6. 提取页面号
-            7. 计算页面总数
-            8. 获取第一页的文本内容
-            9. 为每个文档添加元数据
-            10. 创建文本切割器对象
-            11. 进行文本切割
-            12. 添加索引
-            13. 获取向量存储对象
-            14. 将切割后的文档添加到向量存储中
+            2. 加载文档并生成论文元数据（load_paper）
+            3. 进行文本切割（split_documents）
+            4. 将切割后的文档添加到向量存储中（index_documents）
                 参数：
                     file_path: str,  # PDF文件路径
                     instance_id: str,  # 实例ID
@@ -314,13 +362,38 @@ class DocumentService:
         """
         # 判断是否需要重置集合
         if reset_collection:
-            self._reset_collection(instance_id)
+            self.delete_collection(instance_id)
+        documents, meta = self.load_paper(file_path, source_name, source_url, source_file)
+        splits = self.split_documents(documents)
+        chunk_count = self.index_documents(splits, instance_id)
+        return chunk_count, meta
 
+    def load_paper(
+                        self,
+                        file_path: str,
+                        source_name: str | None = None,
+                        source_url: str | None = None,
+                        source_file: str | None = None,
+                    ) -> tuple[list, dict]:
+        """
+        加载论文文件，并生成论文元数据（不进行向量化，速度快）
+            1. 检测文件格式并选择加载器
+            2. 生成随机的paper_id
+            3. 生成显示名称和文件标签
+            4. 提取页面号，计算页面总数
+            5. 获取第一页的文本内容
+            6. 为每个文档添加元数据
+                参数：
+                    file_path: str,  # 文件路径
+                    source_name: str | None = None,  # 来源名称
+                    source_url: str | None = None,  # 来源URL
+                    source_file: str | None = None,  # 来源文件
+                返回：
+                    tuple[list, dict]: 按页加载的文档列表与论文元数据
+        """
         # ========== 检测文件格式并选择加载器 ==========
-        
-        print('开始解析PDF文件')
         file_format = self._detect_file_format(file_path)
-        print(f'检测到文件格式: {file_format}')
+        logger.info("开始解析文件：%s 格式：%s", file_path, file_format)
 
         if file_format == 'pdf':
             loader = PyPDFLoader(file_path)
@@ -335,18 +408,6 @@ class DocumentService:
             )
         # ==================================================================================================================
 
-        # try: 
-        #     # 使用langchain的文档加载器加载PDF文件
-        #     loader = PyPDFLoader(file_path)
-        # except Exception as e:
-        #     raise ValueError(f"无法解析PDF文件：{e}")
-        # print('开始加载PDF文件进行解析')
-        # try: 
-        #     #  加载文档
-        #     documents = loader.load()
-        # except Exception as e:
-        #     raise ValueError(f"无法加载PDF文件：{e}")
-        # print(f'app/server/document_service.py : process_pdf :加载PDF文件进行解析：{documents}')
         # 生成随机的paper_id
         paper_id = uuid.uuid4().hex
         # 生成显示名称和文件标签
@@ -362,9 +423,6 @@ class DocumentService:
         page_count = (max(page_numbers) + 1) if page_numbers else len(documents)
         # 获取第一页的文本内容
         first_page_text = documents[0].page_content if documents else ""
-        # print(f'app/server/document_service.py : process_pdf :加载PDF文件进行解析：{documents}')
-        print('\n\n\n=====获取第一页信息====')
-        # print(f'app/server/document_service.py : process_pdf :获取第一页的文本内容：{documents[0].page_content}')
         # 为每个文档添加元数据
         for doc in documents:
             doc.metadata["paper_id"] = paper_id
@@ -374,41 +432,60 @@ class DocumentService:
             doc.metadata["page_count"] = page_count
             if source_url:
                 doc.metadata["source_url"] = source_url
-        print('===== 加载元数据====')
+        return documents, {
+            "paper_id": paper_id, # 文档的唯一标识符
+            "source_name": display_name,# 文档的显示名称
+            "source_file": file_label,# 文档的文件标签
+            "source_path": file_path,# 文档的文件路径
+            "source_url": source_url,# 文档的URL
+            "page_count": page_count,# 文档的总页数
+            "first_page_text": first_page_text,# 文档的第一页文本内容
+        }
+
+    def split_documents(self, documents: list) -> list:
+        """
+        对按页加载的文档进行文本切割，并为每个片段添加分块号
+            参数：
+                documents: 按页加载的文档列表
+            返回：
+                list: 切割后的文档片段列表
+        """
         # 创建文本切割器对象
         text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=1000,
             chunk_overlap=200,
             length_function=len,
+            # 记录片段在所在页中的起始偏移，用于构建片段邻接索引
+            add_start_index=True,
         )
-        print('===== 文本切割====')
         # 进行文本切割
         splits = text_splitter.split_documents(documents)
-         
-
         # 添加索引
         for idx, doc in enumerate(splits):
             doc.metadata["chunk"] = idx
-        print('=== 开始向量存储')
+        return splits
+
+    def index_documents(self, splits: list, instance_id: str) -> int:
+        """
+        将切割后的文档片段向量化并存储到该实例的向量集合中（耗时操作）
+            参数：
+                splits: 切割后的文档片段列表
+                instance_id: 聊天实例id
+            返回：
+                int: 存储的片段数量
+        """
         # 获取向量存储对象
         vectorstore = self._get_vectorstore(instance_id)
-        print('存储对象：vectorstore')
+        # 片段id由 paper_id + 分块号 确定，重试时覆盖写入而不是重复插入
+        ids = [f"{doc.metadata.get('paper_id')}:{doc.metadata.get('chunk')}" for doc in splits]
         # 将切割后的文档添加到向量存储中
         try: 
-            vectorstore.add_documents(splits)
+            self.index_policy.call(vectorstore.add_documents, splits, ids=ids)
         except Exception as e:
             raise ValueError(f"向量化存储处理失败：{e}")
-        print(f'===== 向量化存储处理：{len(splits)} 个文档====')
-        # 返回处理结果
-        return len(splits), {
-            "paper_id": paper_id, # 文档的唯一标识符
-            "source_name": display_name,# 文档的显示名称
-            "source_file": file_label,# 文档的文件标签
-            "source_path": file_path,# 文档的文件路径
-            "source_url": source_url,# 文档的URL
-            "page_count": page_count,# 文档的总页数
-            "first_page_text": first_page_text,# 文档的第一页文本内容
-        }
+        source_name = splits[0].metadata.get("source_name") if splits else ""
+        logger.info("向量化存储完成：%s 共 %d 个片段", source_name, len(splits))
+        return len(splits)
 
     def process_source(self, source: str, instance_id: str):
         """
@@ -430,9 +507,93 @@ class DocumentService:
             source_file=file_info.get("saved_name"),
             reset_collection=False,
         )
-        print(f'app/server/document_service.py : process_source : 向量化存储处理：{chunk_count}')
         return file_info, chunk_count, meta
 
+    def embed_query(self, query: str) -> list[float]:
+        """
+        将查询字符串向量化
+            参数:
+                query: 查询字符串
+            返回:
+                list[float]: 查询向量
+        """
+        return self.embed_policy.call(self.embeddings.embed_query, query)
+
+    def embed_texts(self, texts: list[str]) -> list[list[float]]:
+        """
+        批量将文本向量化（论文路由向量等）
+            参数:
+                texts: 文本列表
+            返回:
+                list[list[float]]: 向量列表
+        """
+        return self.index_policy.call(self.embeddings.embed_documents, texts)
+
+    def search_by_vector(self, instance_id: str, embedding: list[float], paper_id: str | None = None, k: int | None = None,
+                         paper_ids: list[str] | None = None):
+        """
+        使用已向量化的查询进行相似度检索（向量化与检索分开执行，便于分别统计耗时）
+            参数:
+                instance_id: 聊天实例id
+                embedding: 查询向量
+                paper_id: 论文id，传入时只检索该论文
+                k: 检索返回的文档数量，默认 settings.RETRIEVAL_K
+                paper_ids: 论文id列表，传入时只在这些论文中检索（论文路由的第二阶段）
+            返回:
+                List[Document]: 检索到的文档列表（按相关性排序，metadata["relevance"] 为相关性分数）
+        """
+        vectorstore = self._get_vectorstore(instance_id)
+        # 参考文献片段不参与普通检索；过滤在检索时执行，参考文献多的论文也能返回k个片段
+        # （旧片段没有 section_kind，$ne 照常匹配）
+        search_filter = {"section_kind": {"$ne": "references"}}
+        if paper_id:
+            search_filter = {"$and": [{"paper_id": paper_id}, search_filter]}
+        elif paper_ids:
+            search_filter = {"$and": [{"paper_id": {"$in": list(paper_ids)}}, search_filter]}
+        results = vectorstore.similarity_search_by_vector_with_relevance_scores(
+            embedding, k=k or settings.RETRIEVAL_K, filter=search_filter
+        )
+        docs = []
+        for doc, distance in results:
+            # 距离越小越相关，转换为越大越相关的分数，供上下文打包器使用
+            doc.metadata["relevance"] = 1.0 / (1.0 + float(distance))
+            docs.append(doc)
+        return docs
+
+    def get_chunks(self, instance_id: str, paper_id: str, chunks: list[int]) -> list[Document]:
+        """
+        按分块号直接读取片段（不需要向量化与相似度检索）
+            参数:
+                instance_id: 聊天实例id
+                paper_id: 论文id
+                chunks: 分块号列表
+            返回:
+                List[Document]: 按分块号排序的片段
+        """
+        docs = list(self.get_chunks_by_ids(instance_id, [f"{paper_id}:{chunk}" for chunk in chunks]).values())
+        docs.sort(key=lambda doc: doc.metadata.get("chunk", 0))
+        return docs
+
+    def get_chunks_by_ids(self, instance_id: str, ids: list[str]) -> dict[str, Document]:
+        """
+        按片段id批量读取片段（一次请求，可跨论文）
+            参数:
+                instance_id: 聊天实例id
+                ids: 片段id列表（paper_id:分块号）
+            返回:
+                dict[str, Document]: {片段id: 片段}，不存在的id不包含在结果中
+        """
+        if not ids:
+            return {}
+        vectorstore = self._get_vectorstore(instance_id)
+        result = vectorstore.get(ids=list(dict.fromkeys(ids)), include=["documents", "metadatas"])
+        return {
+            doc_id: Document(page_content=text or "", metadata=dict(metadata or {}))
+            for doc_id, text, metadata in zip(
+                result.get("ids") or [], result.get("documents") or [], result.get("metadatas") or []
+            )
+        }
+
     def get_retriever(self, instance_id: str, paper_id: str | None = None):
         """
         获取向量检索器
@@ -446,7 +607,7 @@ class DocumentService:
         vectorstore = self._get_vectorstore(instance_id)
         # 设置检索参数 
         # k: 检索返回的文档数量
-        search_kwargs = {"k": 5}
+        search_kwargs = {"k": settings.RETRIEVAL_K}
         if paper_id:
             search_kwargs["filter"] = {"paper_id": paper_id}
         # 返回一个基于向量存储的相似度检索器对象 ,检索文档数量为5
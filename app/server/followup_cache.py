@@ -0,0 +1,136 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Hashable
+
+from app.server.context_packer import extract_terms
+from app.utils.chunk_adjacency import chunk_id
+from app.utils.log_util import get_logger
+from config.settings import settings
+
+logger = get_logger("followup_cache")
+
+# 追问的处理方式
+ACTION_REUSE = "reuse"  # 直接复用上一轮的片段
+ACTION_EXTEND = "extend"  # 复用上一轮的片段，并补充相邻片段
+ACTION_REPLACE = "replace"  # 重新检索
+
+# 不表达具体内容的英文词（追问中的指代、请求类词语）
+_GENERIC_WORDS = frozenset(
+    "a an the of in on at for to and or with by from as is are was were be been do does did can could would "
+    "should will please me you we i my our your this that it its these those they them their above previous "
+    "what why how which when where who whom explain explained elaborate detail details detailed more further "
+    "tell describe mean means meaning again also part said mentioned give example examples about say says "
+    "here there some any much many very just".split()
+)
+# 不表达具体内容的中文字（指代、语气、请求类），含这些字的二字组不作为内容词
+_GENERIC_CHARS = frozenset(
+    "的了是在这那它其该个一下吗呢吧么"
+    "什怎如何为请详细解释说明再多讲具"
+    "体点些意思和与及把被就都也还能可"
+    "以要我你们他她有没不上面前之提到"
+    "谈所对"
+)
+
+
+def content_terms(text: str) -> set[str]:
+    """提取问题中表达具体内容的词项（去掉指代、语气、请求类词语）"""
+    terms = set()
+    for term in extract_terms(text):
+        if "\u4e00" <= term[0] <= "\u9fff":
+            if not any(ch in _GENERIC_CHARS for ch in term):
+                terms.add(term)
+        elif len(term) > 1 and term not in _GENERIC_WORDS:
+            terms.add(term)
+    return terms
+
+
+@dataclass
+class TurnContext:
+    """上一轮问答使用的检索结果"""
+    scope: Hashable
+    version: int
+    query: str
+    docs: list
+    vocabulary: set[str] = field(default_factory=set)
+    created_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def chunk_ids(self) -> set[str]:
+        """片段id集合（paper_id:分块号）"""
+        return {chunk_id(doc.metadata.get("paper_id"), doc.metadata.get("chunk")) for doc in self.docs}
+
+
+class FollowupCache:
+    """
+    追问上下文缓存（按聊天实例保存上一轮的检索片段）
+        1. 每轮检索后保存检索问题、片段与片段的词项集合
+        2. 追问时用问题中的内容词与上一轮片段的词项做本地比对（不调用向量化模型）：
+            覆盖率高 -> 直接复用；覆盖率中等 -> 复用并补充相邻片段；覆盖率低 -> 重新检索
+        3. 论文范围或论文集版本变化、超过有效期时缓存失效
+        4. 按最近使用顺序最多保存 FOLLOWUP_CACHE_MAX_INSTANCES 个实例
+    """
+
+    def __init__(self, max_instances: int | None = None, ttl: float | None = None):
+        self.max_instances = max_instances or settings.FOLLOWUP_CACHE_MAX_INSTANCES
+        self.ttl = ttl or settings.FOLLOWUP_CACHE_TTL
+        self._entries: OrderedDict[str, TurnContext] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def store(self, instance_id: str, scope: Hashable, version: int, query: str, docs: list) -> None:
+        """
+        保存本轮的检索结果
+            参数:
+                instance_id: 聊天实例id
+                scope: 论文范围（论文id、论文id元组或None）
+                version: 论文集版本号
+                query: 检索问题
+                docs: 检索到的片段（打包之前）
+        """
+        if not docs:
+            return
+        docs = list(docs)[:settings.FOLLOWUP_CACHE_MAX_CHUNKS]
+        vocabulary = set(extract_terms(query))
+        for doc in docs:
+            vocabulary.update(extract_terms(doc.page_content))
+        entry = TurnContext(scope=scope, version=version, query=query, docs=docs, vocabulary=vocabulary)
+        with self._lock:
+            self._entries[instance_id] = entry
+            self._entries.move_to_end(instance_id)
+            while len(self._entries) > self.max_instances:
+                self._entries.popitem(last=False)
+
+    def lookup(self, instance_id: str, scope: Hashable, version: int, question: str) -> tuple[str, TurnContext | None]:
+        """
+        判断追问如何使用上一轮的检索结果
+            参数:
+                instance_id: 聊天实例id
+                scope: 论文范围
+                version: 论文集版本号
+                question: 追问
+            返回:
+                tuple[str, TurnContext | None]: 处理方式（reuse/extend/replace）与上一轮的检索结果
+        """
+        with self._lock:
+            entry = self._entries.get(instance_id)
+            if entry is not None:
+                self._entries.move_to_end(instance_id)
+        if entry is None:
+            return ACTION_REPLACE, None
+        if entry.scope != scope or entry.version != version or time.monotonic() - entry.created_at > self.ttl:
+            with self._lock:
+                if self._entries.get(instance_id) is entry:
+                    del self._entries[instance_id]
+            return ACTION_REPLACE, None
+        terms = content_terms(question)
+        # 只有指代、请求类词语（例如"详细解释一下"）时，问的就是上一轮的内容
+        coverage = sum(term in entry.vocabulary for term in terms) / len(terms) if terms else 1.0
+        if coverage >= settings.FOLLOWUP_REUSE_COVERAGE:
+            action = ACTION_REUSE
+        elif coverage >= settings.FOLLOWUP_EXTEND_COVERAGE:
+            action = ACTION_EXTEND
+        else:
+            action = ACTION_REPLACE
+        logger.debug("追问缓存 instance_id=%s 覆盖率=%.2f 处理方式=%s", instance_id, coverage, action)
+        return action, entry
@@ -0,0 +1,111 @@
+import os
+import uuid
+import zlib
+from pathlib import Path
+
+from langchain_core.messages import BaseMessage, message_to_dict
+
+from app.utils.log_util import get_logger
+from app.utils.serialization import dumps, loads
+from config.settings import settings
+
+logger = get_logger("history_store")
+
+# 压缩后的消息以该前缀开头；没有前缀的是未压缩的JSON（旧数据或压缩后没有变小的短消息）
+COMPRESSED_PREFIX = b"z:"
+
+
+def pack(raw: bytes) -> bytes:
+    """压缩消息数据，压缩后没有变小时保留原始JSON"""
+    if raw.startswith(COMPRESSED_PREFIX):
+        return raw
+    packed = COMPRESSED_PREFIX + zlib.compress(raw, settings.HISTORY_COMPRESS_LEVEL)
+    return packed if len(packed) < len(raw) else raw
+
+
+def encode_message(message: BaseMessage) -> tuple[bytes, int]:
+    """
+    编码一条历史消息
+        参数:
+            message: 消息
+        返回:
+            tuple[bytes, int]: 存储的数据与未压缩的JSON字节数
+    """
+    raw = dumps(message_to_dict(message))
+    return pack(raw), len(raw)
+
+
+def decode_payload(payload: bytes | str) -> dict:
+    """解码一条历史消息（兼容未压缩的旧数据），返回 message_to_dict 格式的字典"""
+    if isinstance(payload, str):
+        payload = payload.encode("utf-8")
+    if payload.startswith(COMPRESSED_PREFIX):
+        return loads(zlib.decompress(payload[len(COMPRESSED_PREFIX):]))
+    return loads(payload)
+
+
+class HistoryArchive:
+    """
+    历史消息归档（共享数据卷上的压缩分段文件）
+        1. 热数据窗口之外的消息按批写入一个分段文件（整批消息一起压缩），redis中只保留分段索引与已归档条数，
+           redis内存不再随聊天总量线性增长
+        2. 分段名为 起始位置-条数-随机串，与实例id无关，修改实例id时不需要移动文件
+        3. 多主机部署时 HISTORY_ARCHIVE_DIR 必须位于所有主机共享的数据卷上
+        4. 分段写入后不再修改；先写临时文件再改名，读取方不会读到写了一半的文件
+    """
+
+    def __init__(self, root: str | Path | None = None):
+        self.root = Path(root or settings.HISTORY_ARCHIVE_DIR)
+
+    @staticmethod
+    def new_segment(start: int, count: int) -> str:
+        """生成一个新的分段名"""
+        return f"{start}-{count}-{uuid.uuid4().hex}"
+
+    @staticmethod
+    def segment_range(name: str | bytes) -> tuple[int, int]:
+        """解析分段名，返回 (起始位置, 条数)"""
+        if isinstance(name, bytes):
+            name = name.decode("utf-8")
+        start, count, _ = name.split("-", 2)
+        return int(start), int(count)
+
+    def _path(self, name: str | bytes) -> Path:
+        if isinstance(name, bytes):
+            name = name.decode("utf-8")
+        # 按随机串的末两位分目录，避免单个目录中文件过多
+        return self.root / name[-2:] / f"{name}.z"
+
+    def write(self, name: str, payloads: list[bytes]) -> int:
+        """
+        写入一个分段
+            参数:
+                name: 分段名
+                payloads: 按时间顺序排列的消息数据（redis列表中的格式）
+            返回:
+                int: 分段文件的字节数
+        """
+        data = zlib.compress(dumps([decode_payload(payload) for payload in payloads]), settings.HISTORY_COMPRESS_LEVEL)
+        path = self._path(name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".tmp{os.getpid()}")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+        return len(data)
+
+    def read(self, name: str | bytes) -> list[dict]:
+        """读取一个分段，返回 message_to_dict 格式的消息列表"""
+        return loads(zlib.decompress(self._path(name).read_bytes()))
+
+    def delete(self, names: list[str | bytes]) -> None:
+        """删除分段文件（文件不存在时忽略）"""
+        for name in names:
+            try:
+                self._path(name).unlink()
+            except FileNotFoundError:
+                pass
+            except OSError as exc:
+                logger.warning("删除历史消息归档分段失败 %s: %s", name, exc)
+
+
+history_archive = HistoryArchive()
@@ -0,0 +1,68 @@
+import zlib
+
+from config.settings import settings
+
+# 实例索引（实例id -> 实例记录）的key，带hash tag的布局下为分片前缀
+INSTANCES_TABLE = "instances_table"
+# 实例最后活动时间的key：旧布局为一个hash，带hash tag的布局下每个实例一个key
+ACTIVITY_TABLE = "instance_activity"
+
+
+class KeyLayout:
+    """
+    redis key布局
+        旧布局：每个实例的key为 前缀+实例id，所有实例记录与最后活动时间各保存在一个hash中
+        带hash tag的布局（redis集群）：
+            1. 每个实例的key为 前缀+{实例id}，同一实例的所有key位于同一个slot，
+               写入一轮对话、导入论文等多key事务不会跨slot
+            2. 实例索引按实例id的crc32拆分为多个分片hash，分散到不同的slot（节点）上
+            3. 最后活动时间保存在实例自己的key中，与历史消息在同一个事务中写入
+    """
+
+    def __init__(self, hash_tags: bool | None = None, index_shards: int | None = None):
+        self.hash_tags = settings.REDIS_HASH_TAGS if hash_tags is None else hash_tags
+        self.index_shards = index_shards or settings.REDIS_INSTANCE_INDEX_SHARDS
+
+    def instance_key(self, prefix: str, instance_id: str) -> str:
+        """
+        实例数据的key
+            参数:
+                prefix: key前缀（如 "papers:"）
+                instance_id: 聊天实例id
+            返回:
+                str: 旧布局为 "papers:<id>"，带hash tag的布局为 "papers:{<id>}"
+        """
+        return f"{prefix}{{{instance_id}}}" if self.hash_tags else f"{prefix}{instance_id}"
+
+    def index_key(self, instance_id: str) -> str:
+        """实例记录所在的索引key（分片）"""
+        if not self.hash_tags:
+            return INSTANCES_TABLE
+        return f"{INSTANCES_TABLE}:{zlib.crc32(instance_id.encode('utf-8')) % self.index_shards}"
+
+    def index_keys(self) -> list[str]:
+        """所有实例索引key（分片）"""
+        if not self.hash_tags:
+            return [INSTANCES_TABLE]
+        return [f"{INSTANCES_TABLE}:{shard}" for shard in range(self.index_shards)]
+
+    def activity_key(self, instance_id: str) -> str:
+        """最后活动时间的key（旧布局为所有实例共用的hash）"""
+        return self.instance_key(f"{ACTIVITY_TABLE}:", instance_id) if self.hash_tags else ACTIVITY_TABLE
+
+    def set_activity(self, pipe, instance_id: str, activity_time: str) -> None:
+        """在管道（或客户端）上写入最后活动时间"""
+        if self.hash_tags:
+            pipe.set(self.activity_key(instance_id), activity_time)
+        else:
+            pipe.hset(ACTIVITY_TABLE, instance_id, activity_time)
+
+    def delete_activity(self, pipe, instance_id: str) -> None:
+        """在管道（或客户端）上删除最后活动时间"""
+        if self.hash_tags:
+            pipe.delete(self.activity_key(instance_id))
+        else:
+            pipe.hdel(ACTIVITY_TABLE, instance_id)
+
+
+key_layout = KeyLayout()
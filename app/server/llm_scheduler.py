@@ -0,0 +1,263 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+
+from app.utils.token_counter import count_message_tokens
+from config.settings import settings
+
+
+# 调度优先级：数值越小越优先
+PRIORITY_INTERACTIVE = 0  # 用户正在等待的问答回复
+PRIORITY_AUXILIARY = 1  # 问题精简等辅助调用
+PRIORITY_BACKGROUND = 2  # 论文标题/摘要解析等后台任务
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_AUXILIARY: "auxiliary",
+    PRIORITY_BACKGROUND: "background",
+}
+
+
+def estimate_message_tokens(messages, max_output_tokens: int = 0) -> int:
+    """
+    估算一次LLM调用的token数（提示消息token数 + 预留的输出token数）
+        参数:
+            messages: 提示消息列表
+            max_output_tokens: 预留的输出token数
+        返回:
+            int: 估算的token数
+    """
+    return count_message_tokens(messages) + max_output_tokens
+
+
+class _Ticket:
+    """排队中的一次LLM调用请求"""
+
+    __slots__ = ("instance_id", "priority", "tokens", "used_tokens", "enqueued_at", "granted", "_event", "_loop")
+
+    def __init__(self, instance_id: str, priority: int, tokens: int, loop: asyncio.AbstractEventLoop | None = None):
+        self.instance_id = instance_id
+        self.priority = priority
+        self.tokens = tokens
+        # 调用结束后可回填实际消耗的token数，用于修正令牌桶
+        self.used_tokens: int | None = None
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+        self._loop = loop
+        self._event = asyncio.Event() if loop is not None else threading.Event()
+
+    def grant(self) -> None:
+        """放行该请求（可在任意线程中调用）"""
+        self.granted = True
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._event.set)
+        else:
+            self._event.set()
+
+
+class LLMScheduler:
+    """
+    LLM调用准入控制器
+        1. 全局并发上限：同一时刻最多 max_concurrency 个LLM调用在执行
+        2. 每分钟token预算：令牌桶限制，避免触发上游429
+        3. 优先级：用户问答 > 辅助调用 > 后台任务
+        4. 同一优先级内按 instance_id 轮询，单个实例的突发请求不会挤占其他实例
+        5. 统计排队深度、等待时间等指标
+    """
+
+    def __init__(self, max_concurrency: int, tokens_per_minute: int = 0, name: str = "default"):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        # 每分钟token预算，0 表示不限制
+        self.tokens_per_minute = max(0, tokens_per_minute)
+        self._lock = threading.Lock()
+        # 每个优先级一个队列：instance_id -> 该实例排队中的请求
+        self._queues: list[OrderedDict[str, deque]] = [OrderedDict() for _ in PRIORITY_NAMES]
+        self._active = 0
+        self._tokens = float(self.tokens_per_minute)
+        self._last_refill = time.monotonic()
+        # 令牌不足时，距离可放行队首请求的秒数
+        self._retry_after: float | None = None
+        # 统计指标
+        self._granted_total = 0
+        self._waits = deque(maxlen=500)
+
+    # ======================================== 内部调度 ========================================
+
+    def _refill(self, now: float) -> None:
+        """按流逝时间补充令牌桶"""
+        if not self.tokens_per_minute:
+            return
+        elapsed = now - self._last_refill
+        self._tokens = min(
+            float(self.tokens_per_minute),
+            self._tokens + elapsed * self.tokens_per_minute / 60.0,
+        )
+        self._last_refill = now
+
+    def _enqueue(self, ticket: _Ticket) -> None:
+        queue = self._queues[ticket.priority]
+        queue.setdefault(ticket.instance_id, deque()).append(ticket)
+
+    def _remove(self, ticket: _Ticket) -> None:
+        """从队列中移除尚未放行的请求（调用方取消或超时）"""
+        queue = self._queues[ticket.priority]
+        tickets = queue.get(ticket.instance_id)
+        if tickets and ticket in tickets:
+            tickets.remove(ticket)
+            if not tickets:
+                del queue[ticket.instance_id]
+
+    def _dispatch(self) -> None:
+        """
+        在持有锁的情况下尽可能多地放行请求
+            按优先级取队首实例的第一个请求，放行后该实例移到队尾，实现轮询
+        """
+        now = time.monotonic()
+        self._refill(now)
+        self._retry_after = None
+        while self._active < self.max_concurrency:
+            queue = next((q for q in self._queues if q), None)
+            if queue is None:
+                return
+            instance_id, tickets = next(iter(queue.items()))
+            ticket = tickets[0]
+            if self.tokens_per_minute:
+                cost = min(ticket.tokens, self.tokens_per_minute)
+                if self._tokens < cost:
+                    # 令牌不足：队首请求等待补充，避免大请求被持续插队饿死
+                    self._retry_after = (cost - self._tokens) * 60.0 / self.tokens_per_minute
+                    return
+                self._tokens -= cost
+            tickets.popleft()
+            del queue[instance_id]
+            if tickets:
+                queue[instance_id] = tickets
+            self._active += 1
+            self._granted_total += 1
+            self._waits.append(now - ticket.enqueued_at)
+            ticket.grant()
+
+    def _submit(self, ticket: _Ticket) -> None:
+        with self._lock:
+            self._enqueue(ticket)
+            self._dispatch()
+
+    def _poll_timeout(self) -> float | None:
+        """等待放行的超时时间：启用token预算时定期唤醒重新调度，避免令牌补充后无人触发调度"""
+        if not self.tokens_per_minute:
+            return None
+        with self._lock:
+            return min(self._retry_after, 1.0) if self._retry_after is not None else 1.0
+
+    def _redispatch(self) -> None:
+        with self._lock:
+            self._dispatch()
+
+    def release(self, ticket: _Ticket) -> None:
+        """
+        释放一个执行槽位，并按实际消耗的token修正令牌桶
+        """
+        with self._lock:
+            self._active -= 1
+            if self.tokens_per_minute and ticket.used_tokens is not None:
+                self._tokens = min(
+                    float(self.tokens_per_minute),
+                    self._tokens + ticket.tokens - ticket.used_tokens,
+                )
+            self._dispatch()
+
+    def _cancel(self, ticket: _Ticket) -> None:
+        """等待被中断：未放行则出队，已放行则归还槽位"""
+        with self._lock:
+            if not ticket.granted:
+                self._remove(ticket)
+                return
+        self.release(ticket)
+
+    # ======================================== 对外接口 ========================================
+
+    @contextmanager
+    def slot(self, instance_id: str, priority: int = PRIORITY_INTERACTIVE, tokens: int = 0):
+        """
+        同步获取一个LLM调用槽位（用于线程中的同步调用）
+            参数:
+                instance_id: 聊天实例id，用于公平轮询
+                priority: 调度优先级
+                tokens: 预估token数
+        """
+        ticket = _Ticket(instance_id or "", priority, tokens)
+        self._submit(ticket)
+        try:
+            while not ticket._event.wait(self._poll_timeout()):
+                self._redispatch()
+        except BaseException:
+            self._cancel(ticket)
+            raise
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    @asynccontextmanager
+    async def aslot(self, instance_id: str, priority: int = PRIORITY_INTERACTIVE, tokens: int = 0):
+        """
+        异步获取一个LLM调用槽位（用于后台事件循环中的异步调用）
+            参数:
+                instance_id: 聊天实例id，用于公平轮询
+                priority: 调度优先级
+                tokens: 预估token数
+        """
+        ticket = _Ticket(instance_id or "", priority, tokens, asyncio.get_running_loop())
+        self._submit(ticket)
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(ticket._event.wait(), self._poll_timeout())
+                    break
+                except asyncio.TimeoutError:
+                    self._redispatch()
+        except BaseException:
+            self._cancel(ticket)
+            raise
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def stats(self) -> dict:
+        """
+        获取调度器指标
+            返回:
+                dict: 执行中数量、各优先级排队深度、排队实例数、剩余token、等待时间统计
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            waits = sorted(self._waits)
+            queue_depth = {
+                PRIORITY_NAMES[priority]: sum(len(tickets) for tickets in queue.values())
+                for priority, queue in enumerate(self._queues)
+            }
+            queued_instances = len({iid for queue in self._queues for iid in queue})
+            return {
+                "name": self.name,
+                "active": self._active,
+                "max_concurrency": self.max_concurrency,
+                "queue_depth": queue_depth,
+                "queued_total": sum(queue_depth.values()),
+                "queued_instances": queued_instances,
+                "tokens_available": int(self._tokens) if self.tokens_per_minute else None,
+                "tokens_per_minute": self.tokens_per_minute or None,
+                "granted_total": self._granted_total,
+                "wait_p50_ms": round(waits[len(waits) // 2] * 1000, 1) if waits else 0.0,
+                "wait_p95_ms": round(waits[int(len(waits) * 0.95)] * 1000, 1) if waits else 0.0,
+                "wait_max_ms": round(waits[-1] * 1000, 1) if waits else 0.0,
+            }
+
+
+llm_scheduler = LLMScheduler(
+    settings.LLM_MAX_CONCURRENCY,
+    settings.LLM_TOKENS_PER_MINUTE,
+)
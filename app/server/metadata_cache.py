@@ -0,0 +1,168 @@
+import threading
+import time
+import uuid
+from typing import Any, Callable
+
+import redis
+
+from app.utils.log_util import get_logger
+from app.utils.redis_pool import redis_pool
+from config.settings import settings
+
+logger = get_logger("metadata_cache")
+
+# redis 6 客户端缓存的失效消息频道（RESP2 下通过 REDIRECT 转发到订阅了该频道的连接）
+TRACKING_CHANNEL = "__redis__:invalidate"
+
+MODE_TRACKING = "tracking"  # 服务端按key前缀推送失效消息（CLIENT TRACKING BCAST）
+MODE_PUBSUB = "pubsub"  # 服务端不支持客户端缓存时，由写入方发布失效消息
+
+
+class MetadataCache:
+    """
+    元数据的进程内读穿透缓存（实例记录、论文元数据、论文集版本号）
+        1. 读取时先查本地缓存，未命中时从redis加载并缓存解码后的结果
+        2. 后台线程订阅失效消息：优先使用 redis 6 的 CLIENT TRACKING（BCAST + 前缀），
+           任何进程修改了这些前缀下的key，服务端都会推送失效消息；
+           服务端不支持时退化为普通的 pub/sub 频道，由写入方在提交后发布被修改的key
+        3. 本进程写入后立即使本地缓存失效；失效消息连接断开期间不使用缓存，重连后清空缓存
+        4. 缓存项有最长有效期，作为失效消息丢失时的兜底
+    """
+
+    def __init__(self, prefixes: list[str], ttl: float | None = None):
+        self.prefixes = prefixes
+        self.ttl = ttl or settings.METADATA_CACHE_TTL
+        self.mode: str | None = None
+        self._entries: dict[str, tuple[float, Any]] = {}
+        # 每次失效自增，加载期间发生过失效的结果不写入缓存
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._client_name = f"paper_ai_invalidation:{uuid.uuid4().hex[:12]}"
+        self._tracker: redis.Redis | None = None
+
+    def _new_client(self, **kwargs) -> redis.Redis:
+        """失效消息使用的专用连接（不占用共享连接池）"""
+        return redis.Redis(**settings.redis_config, **kwargs)
+
+    def _ensure_started(self) -> bool:
+        """首次使用时启动失效消息线程；返回缓存当前是否可用"""
+        if not settings.METADATA_CACHE_ENABLED:
+            return False
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="metadata-cache", daemon=True)
+                    self._thread.start()
+        return self.mode is not None
+
+    def _subscribe(self):
+        """订阅失效消息，优先开启服务端的客户端缓存跟踪"""
+        listener = self._new_client(client_name=self._client_name)
+        pubsub = listener.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(TRACKING_CHANNEL, settings.METADATA_INVALIDATION_CHANNEL)
+        if settings.REDIS_CLUSTER:
+            # 集群中跟踪需要在每个节点上分别开启；普通 PUBLISH 会广播到所有节点，订阅任意一个节点即可
+            return pubsub, MODE_PUBSUB
+        try:
+            tracker = self._new_client(single_connection_client=True)
+            client_id = next(
+                int(client["id"]) for client in tracker.client_list(_type="pubsub")
+                if client.get("name") == self._client_name
+            )
+            # 跟踪连接需要保持打开，服务端把前缀下所有key的修改推送给订阅连接
+            tracker.client_tracking_on(clientid=client_id, bcast=True, prefix=self.prefixes)
+            self._tracker = tracker
+            mode = MODE_TRACKING
+        except Exception as exc:
+            # redis 6 以下、代理或托管服务禁用了 CLIENT 命令等情况
+            logger.info("redis不支持客户端缓存跟踪，使用pub/sub失效消息：%s", exc)
+            mode = MODE_PUBSUB
+        return pubsub, mode
+
+    def _run(self) -> None:
+        """失效消息线程：断开后清空缓存并重连"""
+        delay = 1.0
+        while True:
+            try:
+                pubsub, mode = self._subscribe()
+                self.clear()
+                self.mode = mode
+                delay = 1.0
+                logger.info("元数据缓存已启用，失效方式=%s", mode)
+                for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        self._handle(message.get("data"))
+            except Exception as exc:
+                logger.warning("元数据缓存失效消息连接断开，暂停使用缓存：%s", exc)
+            self.mode = None
+            self.clear()
+            if self._tracker is not None:
+                self._tracker.close()
+                self._tracker = None
+            time.sleep(delay)
+            delay = min(delay * 2, 30.0)
+
+    def _handle(self, data) -> None:
+        """处理失效消息：数据为key、key列表，或为空（FLUSHALL，清空全部）"""
+        if data is None:
+            self.clear()
+            return
+        keys = data if isinstance(data, list) else [data]
+        self._drop([key.decode("utf-8") if isinstance(key, bytes) else key for key in keys])
+
+    def _drop(self, keys: list[str]) -> None:
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        """清空缓存"""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def get(self, key: str, loader: Callable[[], Any]) -> Any:
+        """
+        读穿透获取缓存值
+            参数:
+                key: redis key（失效消息按key匹配）
+                loader: 未命中时从redis加载的函数
+            返回:
+                加载结果（缓存中的对象为共享对象，调用方不应修改）
+        """
+        if not self._ensure_started():
+            return loader()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] < self.ttl:
+                return entry[1]
+            generation = self._generation
+        value = loader()
+        with self._lock:
+            if self._generation == generation and self.mode is not None:
+                self._entries[key] = (now, value)
+        return value
+
+    def invalidate(self, *keys: str) -> None:
+        """
+        本进程写入后调用（写入提交之后）：立即使本地缓存失效；
+        pub/sub 模式下同时发布失效消息，通知其他进程
+        """
+        self._drop(list(keys))
+        if self.mode == MODE_PUBSUB:
+            try:
+                client = redis_pool.get_client()
+                if settings.REDIS_CLUSTER:
+                    # 集群管道不支持 PUBLISH
+                    for key in keys:
+                        client.publish(settings.METADATA_INVALIDATION_CHANNEL, key)
+                    return
+                pipe = client.pipeline(transaction=False)
+                for key in keys:
+                    pipe.publish(settings.METADATA_INVALIDATION_CHANNEL, key)
+                pipe.execute()
+            except redis.RedisError as exc:
+                logger.warning("发布元数据失效消息失败：%s", exc)
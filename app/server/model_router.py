@@ -0,0 +1,305 @@
+import asyncio
+import contextvars
+import os
+import re
+import time
+from typing import AsyncIterator
+
+from langchain_ollama import ChatOllama
+from langchain_openai import ChatOpenAI
+
+from app.server.llm_scheduler import (
+    PRIORITY_AUXILIARY,
+    PRIORITY_INTERACTIVE,
+    LLMScheduler,
+    estimate_message_tokens,
+    llm_scheduler,
+)
+from app.server.redis_service import redis_service
+from app.utils.http_pool import http_pool
+from app.utils.log_util import get_logger
+from app.utils.resilience import CircuitBreaker, CircuitOpenError, get_policy
+from app.utils.token_counter import usage_from_message
+from app.utils.trace_util import RequestTrace
+from config.settings import ollamaLLMConfig, settings
+
+logger = get_logger("model_router")
+
+# 任务类型
+TASK_ANSWER = "answer"  # 用户问答（流式）
+TASK_DEEP = "deep"  # 需要推理的复杂问题（流式）
+TASK_AUXILIARY = "auxiliary"  # 用户等待中的辅助调用：精简问题
+TASK_BACKGROUND = "background"  # 后台调用：解析标题、分层摘要
+
+# 复杂问题的关键词：推导、证明、原因分析等（对比问题走 map-reduce 对比流程，不按关键词路由到推理模型）
+_DEEP_PATTERN = re.compile(
+    r"\b(derive|derivation|prove|proof|why does|why do|why is|step[- ]by[- ]step|"
+    r"trade-?offs?|critique|weakness(es)?|reason about)\b|"
+    r"推导|证明|为什么|原理|优缺点|局限|"
+    r"一步一步|逐步",
+    re.IGNORECASE,
+)
+
+
+def is_deep_question(question: str) -> bool:
+    """
+    判断是否为需要推理模型回答的复杂问题
+        参数:
+            question: 用户问题
+        返回:
+            bool: 是否为复杂问题
+    """
+    text = question or ""
+    return len(text) > 300 or bool(_DEEP_PATTERN.search(text))
+
+
+# 当前上下文的token用量收集器：设置后，本上下文中每次记录的用量同时追加到列表中
+# （合并的流式回复由驱动请求产生用量，订阅请求结束后按收集到的用量补记）
+usage_collector: contextvars.ContextVar[list | None] = contextvars.ContextVar("usage_collector", default=None)
+
+
+def record_usage(instance_id: str, backend: str, usage: dict) -> None:
+    """记录token用量，redis异常时只记录日志，不影响调用结果"""
+    collected = usage_collector.get()
+    if collected is not None:
+        collected.append((backend, usage))
+    try:
+        redis_service.record_usage(instance_id, usage["input_tokens"], usage["output_tokens"], backend)
+    except Exception as exc:
+        logger.warning("记录token用量失败 instance_id=%s: %s", instance_id, exc)
+
+
+class ModelBackend:
+    """
+    一个模型后端：模型客户端 + 独立的调度器（并发/速率配额）+ 容错策略（耗时、错误率、熔断）
+    """
+
+    def __init__(self, name: str, llm, scheduler: LLMScheduler, remote: bool, cost: float, prior_latency: float):
+        self.name = name
+        self.llm = llm
+        self.scheduler = scheduler
+        self.remote = remote
+        # 相对调用成本（本地模型为0）
+        self.cost = cost
+        # 没有耗时样本时假设的耗时（秒）
+        self.prior_latency = prior_latency
+        self.policy = get_policy(f"llm_{name}", timeout=settings.LLM_TIMEOUT, max_attempts=2)
+
+    def expected_latency(self) -> float:
+        """预期耗时：近期p95，没有样本时使用先验值"""
+        p95 = self.policy.latency_p95()
+        return p95 if p95 is not None else self.prior_latency
+
+    def is_degraded(self) -> bool:
+        """错误率过高，或远程模型变慢"""
+        if self.policy.error_rate() > settings.ROUTER_MAX_ERROR_RATE:
+            return True
+        p95 = self.policy.latency_p95()
+        return self.remote and p95 is not None and p95 > settings.ROUTER_SLOW_THRESHOLD
+
+    def stats(self) -> dict:
+        scheduler_stats = self.scheduler.stats()
+        return {
+            **self.policy.stats(),
+            "backend": self.name,
+            "active": scheduler_stats["active"],
+            "queued": scheduler_stats["queued_total"],
+        }
+
+
+class ModelRouter:
+    """
+    模型路由
+        1. 用户问答使用对话模型，复杂问题使用推理模型
+        2. 辅助/后台调用使用独立调度配额（chat_aux），不再与用户问答争抢同一个速率限制，
+           并按 预期耗时 ×（1 + 成本）选择最快且足够便宜的后端
+        3. 后端熔断、错误率过高或远程模型变慢时，切换到本地Ollama
+    """
+
+    def __init__(self):
+        api_key = os.getenv("DEEPSEEK_API_KEY")
+        url_base = os.getenv("DEEPSEEK_BASE_URL")
+        # 进程级共享的HTTP连接池，所有会话复用同一组保活连接
+        http_client = http_pool.get_client()
+        http_async_client = http_pool.get_async_client()
+
+        def remote_llm(model: str, streaming: bool) -> ChatOpenAI:
+            return ChatOpenAI(
+                model=model,
+                api_key=api_key,
+                base_url=url_base,
+                temperature=0,
+                streaming=streaming,
+                stream_usage=True,  # 流式输出的最后一个数据块携带token用量
+                max_retries=0,  # 重试由容错策略统一处理
+                timeout=settings.LLM_TIMEOUT,  # 请求在客户端内超时结束，不会在容错策略放弃等待后继续占用线程
+                http_client=http_client,
+                http_async_client=http_async_client,
+            )
+
+        self.backends: dict[str, ModelBackend] = {
+            # 用户问答：流式对话模型，使用全局调度器
+            "chat": ModelBackend(
+                "chat", remote_llm(settings.CHAT_LLM_MODEL, True), llm_scheduler,
+                remote=True, cost=1.0, prior_latency=2.0,
+            ),
+            # 辅助调用：同一模型的非流式客户端，使用独立的调度配额
+            "chat_aux": ModelBackend(
+                "chat_aux", remote_llm(settings.CHAT_LLM_MODEL, False),
+                LLMScheduler(settings.LLM_AUX_MAX_CONCURRENCY, settings.LLM_AUX_TOKENS_PER_MINUTE, name="chat_aux"),
+                remote=True, cost=1.0, prior_latency=2.0,
+            ),
+        }
+        if settings.REASONER_ENABLED:
+            self.backends["reasoner"] = ModelBackend(
+                "reasoner", remote_llm(settings.THINKING_LLM_MODEL, True),
+                LLMScheduler(settings.REASONER_MAX_CONCURRENCY, name="reasoner"),
+                remote=True, cost=2.0, prior_latency=10.0,
+            )
+        if settings.LOCAL_LLM_ENABLED:
+            self.backends["local"] = ModelBackend(
+                "local",
+                ChatOllama(
+                    model=ollamaLLMConfig.chatModel,
+                    temperature=ollamaLLMConfig.temperature,
+                    client_kwargs={"timeout": settings.LLM_TIMEOUT},
+                ),
+                LLMScheduler(settings.LOCAL_LLM_MAX_CONCURRENCY, name="local"),
+                remote=False, cost=0.0, prior_latency=5.0,
+            )
+        # 每类任务的默认候选顺序
+        self.routes = {
+            TASK_ANSWER: ["chat", "local"],
+            TASK_DEEP: ["reasoner", "chat", "local"],
+            TASK_AUXILIARY: ["chat_aux", "local"],
+            TASK_BACKGROUND: ["chat_aux", "local"],
+        }
+
+    def candidates(self, task: str) -> list[ModelBackend]:
+        """
+        按近期耗时与错误率对该任务的候选后端排序
+            1. 过滤掉熔断中的后端
+            2. 变慢或错误率过高的后端排到最后
+            3. 问答任务保持默认顺序（质量优先），辅助/后台任务按 预期耗时 ×（1 + 成本）排序
+            参数:
+                task: 任务类型
+            返回:
+                list[ModelBackend]: 按优先顺序排列的后端
+        """
+        backends = [self.backends[name] for name in self.routes[task] if name in self.backends]
+        available = [b for b in backends if b.policy.breaker.state != CircuitBreaker.OPEN]
+
+        def rank(item):
+            index, backend = item
+            if task in (TASK_AUXILIARY, TASK_BACKGROUND):
+                return backend.is_degraded(), backend.expected_latency() * (1 + backend.cost), index
+            return backend.is_degraded(), index
+
+        return [backend for _, backend in sorted(enumerate(available), key=rank)]
+
+    def invoke(self, task: str, messages, instance_id: str = "", priority: int = PRIORITY_AUXILIARY,
+               max_output_tokens: int = 200):
+        """
+        同步调用（用于线程中的后台任务），当前后端失败时依次切换到下一个后端
+            参数:
+                task: 任务类型
+                messages: 提示消息列表
+                instance_id: 聊天实例id，用于公平排队
+                priority: 调度优先级
+                max_output_tokens: 预估输出token数
+            返回:
+                模型返回的消息
+        """
+        tokens = estimate_message_tokens(messages, max_output_tokens)
+        last_exc: BaseException | None = None
+        for backend in self.candidates(task):
+            try:
+                with backend.scheduler.slot(instance_id, priority, tokens) as ticket:
+                    result = backend.policy.call(backend.llm.invoke, messages)
+                    usage = usage_from_message(result, messages)
+                    ticket.used_tokens = usage["input_tokens"] + usage["output_tokens"]
+                record_usage(instance_id, backend.name, usage)
+                return result
+            except Exception as exc:
+                last_exc = exc
+                logger.warning("模型 %s 调用失败，切换下一个后端：%s", backend.name, exc)
+        raise last_exc or CircuitOpenError(f"{task} 没有可用的模型")
+
+    async def ainvoke(self, task: str, messages, instance_id: str = "", priority: int = PRIORITY_AUXILIARY,
+                      max_output_tokens: int = 200):
+        """异步调用，失败切换逻辑与 invoke 相同"""
+        tokens = estimate_message_tokens(messages, max_output_tokens)
+        last_exc: BaseException | None = None
+        for backend in self.candidates(task):
+            try:
+                async with backend.scheduler.aslot(instance_id, priority, tokens) as ticket:
+                    result = await backend.policy.acall(lambda: backend.llm.ainvoke(messages))
+                    usage = usage_from_message(result, messages)
+                    ticket.used_tokens = usage["input_tokens"] + usage["output_tokens"]
+                await asyncio.to_thread(record_usage, instance_id, backend.name, usage)
+                return result
+            except Exception as exc:
+                last_exc = exc
+                logger.warning("模型 %s 调用失败，切换下一个后端：%s", backend.name, exc)
+        raise last_exc or CircuitOpenError(f"{task} 没有可用的模型")
+
+    async def astream(self, task: str, messages, instance_id: str = "", priority: int = PRIORITY_INTERACTIVE,
+                      max_output_tokens: int = 1500, route: dict | None = None,
+                      trace: RequestTrace | None = None) -> AsyncIterator:
+        """
+        流式调用：只有在尚未输出任何数据块之前失败才会切换后端，避免重复输出
+            参数:
+                task: 任务类型
+                messages: 提示消息列表
+                instance_id: 聊天实例id，用于公平排队
+                priority: 调度优先级
+                max_output_tokens: 预估输出token数
+                route: 可选的字典，写入实际使用的后端名称（backend）、获得槽位的时间（admitted_at）与token用量（usage）
+                trace: 链路追踪对象，记录每个后端的排队耗时与token用量
+            返回:
+                AsyncIterator: 模型返回的数据块
+        """
+        tokens = estimate_message_tokens(messages, max_output_tokens)
+        last_exc: BaseException | None = None
+        for backend in self.candidates(task):
+            emitted = False
+            queued_at = time.perf_counter()
+            try:
+                async with backend.scheduler.aslot(instance_id, priority, tokens) as ticket:
+                    admitted_at = time.perf_counter()
+                    if route is not None:
+                        route["backend"] = backend.name
+                        route["admitted_at"] = admitted_at
+                    if trace is not None:
+                        trace.record("llm_queue", (admitted_at - queued_at) * 1000, backend=backend.name)
+                    parts = []
+                    usage_chunk = None
+                    async for chunk in backend.policy.astream(
+                        lambda: backend.llm.astream(messages),
+                        first_chunk_timeout=settings.LLM_STREAM_FIRST_TOKEN_TIMEOUT,
+                        idle_timeout=settings.LLM_STREAM_IDLE_TIMEOUT,
+                    ):
+                        emitted = True
+                        if getattr(chunk, "usage_metadata", None):
+                            usage_chunk = chunk
+                        parts.append(str(getattr(chunk, "content", "") or ""))
+                        yield chunk
+                    usage = usage_from_message(usage_chunk, messages, "".join(parts))
+                    ticket.used_tokens = usage["input_tokens"] + usage["output_tokens"]
+                if route is not None:
+                    route["usage"] = usage
+                if trace is not None:
+                    trace.record("prompt_tokens", usage["input_tokens"], unit="tokens", backend=backend.name)
+                    trace.record("completion_tokens", usage["output_tokens"], unit="tokens", backend=backend.name)
+                await asyncio.to_thread(record_usage, instance_id, backend.name, usage)
+                return
+            except Exception as exc:
+                if emitted:
+                    raise
+                last_exc = exc
+                logger.warning("模型 %s 流式调用失败，切换下一个后端：%s", backend.name, exc)
+        raise last_exc or CircuitOpenError(f"{task} 没有可用的模型")
+
+    def stats(self) -> list[dict]:
+        """获取所有后端的统计：熔断状态、p95耗时、错误率、执行中与排队数量"""
+        return [backend.stats() for backend in self.backends.values()]
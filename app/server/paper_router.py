@@ -0,0 +1,106 @@
+import threading
+
+import numpy as np
+
+from app.server.redis_service import redis_service
+from app.utils.log_util import get_logger
+from config.settings import settings
+
+logger = get_logger("paper_router")
+
+
+class PaperRouter:
+    """
+    两阶段检索的第一阶段：论文级路由
+        1. 每篇论文存储少量路由向量（标题、摘要、全文摘要），与论文元数据一起保存在redis中
+        2. 查询时用查询向量与所有路由向量做一次矩阵乘法，每篇论文取最高分，选出前 top_m 篇
+        3. 第二阶段只在这些论文的片段中检索，论文数量增加时检索耗时与结果质量保持稳定
+        4. 路由矩阵按实例缓存在内存中，论文集版本变化或本进程写入路由向量后重新加载
+    """
+
+    def __init__(self, doc_service):
+        self.doc_service = doc_service
+        self._lock = threading.Lock()
+        # instance_id -> (论文集版本, 路由矩阵, 每行对应的论文id)
+        self._cache: dict[str, tuple[int, np.ndarray, list[str]]] = {}
+
+    def build_routes(self, instance_id: str, paper_id: str, texts: list[str]) -> bool:
+        """
+        生成并存储论文的路由向量（覆盖之前的路由向量）
+            参数:
+                instance_id: 聊天实例id
+                paper_id: 论文id
+                texts: 路由文本（标题、摘要、全文摘要等），空文本会被忽略
+            返回:
+                bool: 是否成功
+        """
+        texts = [text.strip() for text in texts if text and text.strip()]
+        if not texts:
+            return False
+        try:
+            vectors = np.asarray(self.doc_service.embed_texts(texts), dtype=np.float32)
+        except Exception as exc:
+            logger.warning("生成论文路由向量失败 paper_id=%s: %s", paper_id, exc)
+            return False
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        redis_service.set_paper_route_vectors(instance_id, paper_id, (vectors / norms).tobytes())
+        with self._lock:
+            self._cache.pop(instance_id, None)
+        logger.debug("论文路由向量已存储 paper_id=%s 向量数=%d", paper_id, len(texts))
+        return True
+
+    def _load(self, instance_id: str, dim: int) -> tuple[np.ndarray, list[str]]:
+        """读取（或从缓存获取）该实例的路由矩阵"""
+        version = redis_service.get_paper_set_version(instance_id)
+        with self._lock:
+            cached = self._cache.get(instance_id)
+        if cached and cached[0] == version and cached[1].shape[1] == dim:
+            return cached[1], cached[2]
+        rows, owners = [], []
+        for paper_id, value in redis_service.list_paper_route_vectors(instance_id).items():
+            vectors = np.frombuffer(value, dtype=np.float32)
+            if vectors.size % dim:
+                # 向量维度与当前向量化模型不一致（更换过模型），忽略
+                continue
+            vectors = vectors.reshape(-1, dim)
+            rows.append(vectors)
+            owners.extend([paper_id] * len(vectors))
+        matrix = np.vstack(rows) if rows else np.zeros((0, dim), dtype=np.float32)
+        with self._lock:
+            self._cache[instance_id] = (version, matrix, owners)
+        return matrix, owners
+
+    def route(self, instance_id: str, embedding: list[float], paper_ids: list[str], top_m: int | None = None) -> list[str] | None:
+        """
+        选出与查询最相关的论文
+            参数:
+                instance_id: 聊天实例id
+                embedding: 查询向量
+                paper_ids: 该实例下的所有论文id
+                top_m: 选出的论文数，默认 settings.PAPER_ROUTING_TOP_M
+            返回:
+                list[str] | None: 选中的论文id（没有路由向量的论文总是保留）；
+                    论文数不超过 top_m 或没有可用的路由向量时返回None，表示检索全部论文
+        """
+        top_m = top_m or settings.PAPER_ROUTING_TOP_M
+        if len(paper_ids) <= top_m:
+            return None
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return None
+        matrix, owners = self._load(instance_id, query.shape[0])
+        if not owners:
+            return None
+        scores = matrix @ (query / norm)
+        # 每篇论文取路由向量中的最高分
+        best: dict[str, float] = {}
+        for paper_id, score in zip(owners, scores.tolist()):
+            if score > best.get(paper_id, -1.0):
+                best[paper_id] = score
+        known = set(paper_ids)
+        ranked = sorted((pid for pid in best if pid in known), key=best.get, reverse=True)
+        # 尚未生成路由向量的论文（旧数据或仍在导入）无法判断相关性，一并检索
+        unrouted = [pid for pid in paper_ids if pid not in best]
+        return ranked[:top_m] + unrouted
@@ -1,92 +1,300 @@
-﻿from typing import List
-import ast
-import json
+﻿import json
+import threading
+from collections import OrderedDict
+from datetime import datetime
 
 import redis
 from langchain_community.chat_message_histories import RedisChatMessageHistory
-from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.messages import BaseMessage, messages_from_dict
 
 from config.settings import settings
+from app.utils.log_util import get_logger
+from app.server.history_store import decode_payload, encode_message, history_archive
+from app.server.key_layout import ACTIVITY_TABLE, INSTANCES_TABLE, key_layout
+from app.server.metadata_cache import MetadataCache
+from app.server.storage import BACKEND_SQLITE, ChatHistoryStore, StorageService
+from app.utils.redis_pool import UnitOfWork, redis_pool
+from app.utils.serialization import InstanceRecord, PaperRecord, decode_record, dumps, encode_record, loads
 
+logger = get_logger("redis_service")
 
-class RedisService:
+# 历史消息列表的key前缀（与 RedisChatMessageHistory 默认值一致）
+HISTORY_KEY_PREFIX = "message_store:"
+# 已归档的历史消息条数的key前缀
+HISTORY_ARCHIVED_PREFIX = "message_archived:"
+# 历史消息归档分段索引（有序集合：分段名 -> 起始位置）的key前缀，分段文件保存在共享的归档目录中
+HISTORY_SEGMENTS_PREFIX = "message_segments:"
+# 历史消息存储统计（原始字节数、写入redis的字节数、归档移出redis的字节数）的key前缀
+HISTORY_STATS_PREFIX = "message_stats:"
+
+
+class RedisService(StorageService):
     def __init__(self):
-        self.redis_client = redis.Redis(**settings.redis_config)
-        self.instances_table = "instances_table" #实例存储的key
+        # 使用进程级共享的连接池
+        self.redis_client = redis_pool.get_client()
+        self.layout = key_layout # key布局（带hash tag时同一实例的key位于同一个slot）
+        self.instances_table = INSTANCES_TABLE #实例存储的key（带hash tag的布局下为分片前缀）
+        self.activity_table = ACTIVITY_TABLE # 实例最后活动时间的key
         self.paper_prefix = "papers:" # 用户上传文章的key
+        self.paper_version_prefix = "papers_version:" # 论文集版本号的key，论文变更时自增
+        self.digest_prefix = "digests:" # 论文分层摘要的key
+        self.usage_prefix = "usage:" # token用量的key，按实例累计，并按天汇总
+        self.route_prefix = "paper_routes:" # 论文级路由向量的key（float32字节）
+        self.structure_prefix = "structures:" # 论文结构（章节、图表标题与分块范围）的key
+        self.adjacency_prefix = "adjacency:" # 片段邻接索引（前后片段id、页码、字符偏移）的key
+        # 实例记录、论文元数据与论文集版本号的进程内缓存（由redis推送或发布失效消息）
+        self.cache = MetadataCache([self.instances_table, self.paper_prefix, self.paper_version_prefix])
+
+    def _key(self, prefix: str, instance_id: str) -> str:
+        """实例数据的key（按key布局决定是否带hash tag）"""
+        return self.layout.instance_key(prefix, instance_id)
 
-    def add_instance(self, instance_id: str, instance):
+    def add_instance(self, instance_id: str, instance: InstanceRecord | dict):
         """ 
         添加一个聊天实例，并保存到redis中\n
         instance_id : 聊天实例id\n
-        instance : 聊天实例对象
+        instance : 聊天实例记录（或实例字典，写入前校验）
         """
-        self.redis_client.hset(self.instances_table, instance_id, instance)
+        index_key = self.layout.index_key(instance_id)
+        self.redis_client.hset(index_key, instance_id, encode_record(instance, InstanceRecord))
+        self.cache.invalidate(index_key)
+
+    def _load_instance_records(self, index_key: str) -> dict[str, InstanceRecord]:
+        """从redis读取并解码一个索引分片中的实例记录（旧格式的记录回写为当前版本）"""
+        records = {}
+        stale_records = {}
+        for instance_id, value in self.redis_client.hgetall(index_key).items():
+            instance_id = instance_id.decode("utf-8")
+            record, stale = decode_record(value, InstanceRecord)
+            if record is None:
+                logger.warning("解析实例失败 %s", instance_id)
+                continue
+            if stale:
+                stale_records[instance_id] = encode_record(record)
+            records[instance_id] = record
+        # 旧格式的记录回写为当前版本，之后读取只需一次解码
+        if stale_records:
+            self.redis_client.hset(index_key, mapping=stale_records)
+        return records
+
+    def _shard_records(self, index_key: str) -> dict[str, InstanceRecord]:
+        """一个索引分片中的实例记录（读穿透缓存，返回的是共享对象）"""
+        return self.cache.get(index_key, lambda: self._load_instance_records(index_key))
+
+    def _instance_records(self) -> dict[str, InstanceRecord]:
+        """所有实例记录（按分片合并，返回的是共享对象）"""
+        records = {}
+        for index_key in self.layout.index_keys():
+            records.update(self._shard_records(index_key))
+        return records
 
-    def get_instance(self, instance_id: str):
+    def get_instance(self, instance_id: str) -> InstanceRecord | None:
         """获取聊天实例里某实例的信息"""
-        instance = self.redis_client.hget(self.instances_table, instance_id)
-        if instance:
-            return instance.decode("utf-8") # 进行格式转换，从字节转换为字符串
-        return None
+        record = self._shard_records(self.layout.index_key(instance_id)).get(instance_id)
+        return record.model_copy() if record is not None else None
 
     def remove_instance(self, instance_id: str):
-        self.redis_client.hdel(self.instances_table, instance_id)
+        """
+        删除聊天实例：实例记录、最后活动时间与所有依赖的key（历史消息与归档索引、论文元数据、摘要、结构、
+        邻接索引、路由向量、版本号、token用量），事务提交后删除归档分段文件
+            按天汇总的token用量设置了过期时间，到期后自动删除
+            集群中索引分片与实例的key不在同一个slot，先删除实例记录（实例不再可见），再在实例的slot中用一个事务删除数据
+            参数:
+                instance_id: 聊天实例id
+        """
+        index_key = self.layout.index_key(instance_id)
+        paper_key = self._paper_table(instance_id)
+        segments_key = self._key(HISTORY_SEGMENTS_PREFIX, instance_id)
+        data_keys = [paper_key, *self._instance_keys(instance_id)]
+        if settings.REDIS_CLUSTER:
+            self.redis_client.hdel(index_key, instance_id)
+            self.layout.delete_activity(self.redis_client, instance_id)
+            with UnitOfWork(self.redis_client) as uow:
+                uow.zrange(segments_key, 0, -1)
+                uow.delete(*data_keys)
+        else:
+            with UnitOfWork(self.redis_client) as uow:
+                uow.zrange(segments_key, 0, -1)
+                uow.hdel(index_key, instance_id)
+                self.layout.delete_activity(uow, instance_id)
+                uow.delete(*data_keys)
+        history_archive.delete(uow.results[0])
+        self.cache.invalidate(index_key, paper_key, self._key(self.paper_version_prefix, instance_id))
+        logger.info("实例已删除 %s", instance_id)
 
-    def exists_instance(self, instance_id: str) -> bool:
-        return self.redis_client.hexists(self.instances_table, instance_id)
+    def touch_instance(self, instance_id: str, activity_time: str) -> None:
+        """
+        记录实例的最后活动时间（添加消息时调用）
+            参数:
+                instance_id: 聊天实例id
+                activity_time: 活动时间
+        """
+        self.layout.set_activity(self.redis_client, instance_id, activity_time)
 
-    def get_all_instances(self):
-        """ 
-        从redis中获取所有聊天实例，并进行解析为ChatInstance对象\n
-        return :ChatInstance对象列表
-        """
-        # 获取所有实例id列表
-        instances_id_list = self.get_all_instances_list()
-        instances_list = []
-        #遍历历所有实例id
-        for i in instances_id_list:
-            # 获取该实例信息
-            instance_str: str = self.get_instance(i)
-            # 若实例信息存在
-            if instance_str:
-                try:
-                    # 进行格式转换
-                    instance_json = ast.literal_eval(instance_str)
-                    from app.models.chat import ChatInstance
-                    # 创建一个ChatInstance聊天实例对象
-                    chat_instance = ChatInstance(
-                        instance_json.get("id"), instance_json.get("name")
-                    )
-                    # 将 聊天实例的信息获取并赋值给对象
-                    chat_instance.created_at = instance_json.get("created_at")
-                    chat_instance.messages = instance_json.get("messages")
-                    chat_instance.files = instance_json.get("files")
-                    # 将聊天实例追加在列表中
-                    instances_list.append(chat_instance)
-                except json.JSONDecodeError as exc:
-                    print(f"redis_service.py/get_all_instances ,解析实例失败 {i}: {exc}")
-            else:
-                print(f"redis_service.py/get_all_instances ,聊天实例Instance {i} not found")
-        return instances_list
+    def list_instance_index(self) -> list[dict]:
+        """
+        获取轻量的实例索引（不读取历史消息内容）
+            1. 实例记录来自进程内缓存（未命中时每个索引分片一次HGETALL）
+            2. 一次管道请求读取最后活动时间与所有实例的消息数（LLEN），集群中管道按节点拆分
+            耗时只与实例数有关，与历史消息的长度无关
+            返回:
+                list[dict]: [{"id", "name", "created_at", "message_count", "last_activity"}]
+        """
+        records = self._instance_records()
+        instance_ids = list(records)
+        pipe = self.redis_client.pipeline(transaction=False)
+        if not self.layout.hash_tags:
+            pipe.hgetall(self.activity_table)
+        for instance_id in instance_ids:
+            pipe.llen(self._key(HISTORY_KEY_PREFIX, instance_id))
+            pipe.get(self._key(HISTORY_ARCHIVED_PREFIX, instance_id))
+            if self.layout.hash_tags:
+                pipe.get(self.layout.activity_key(instance_id))
+        results = pipe.execute()
+        if self.layout.hash_tags:
+            # 带hash tag的布局下最后活动时间保存在每个实例自己的key中
+            activity = {
+                instance_id: value.decode("utf-8")
+                for instance_id, value in zip(instance_ids, results[2::3]) if value
+            }
+            results = [value for i, value in enumerate(results) if i % 3 != 2]
+        else:
+            raw_activity, *results = results
+            activity = {key.decode("utf-8"): value.decode("utf-8") for key, value in raw_activity.items()}
+        # 消息数 = redis中的消息数 + 已归档的消息数
+        counts = [int(hot) + int(archived or 0) for hot, archived in zip(results[::2], results[1::2])]
+
+        return [
+            {
+                "id": record.id or instance_id,
+                "name": record.name,
+                "created_at": record.created_at,
+                "message_count": count,
+                "last_activity": activity.get(instance_id),
+            }
+            for (instance_id, record), count in zip(records.items(), counts)
+        ]
+
+    def exists_instance(self, instance_id: str) -> bool:
+        return self.redis_client.hexists(self.layout.index_key(instance_id), instance_id)
 
     # 获取redis里存储的实例
     def get_all_instances_list(self):
         """ 
             获取redis里存储的实例id列表
         """
-        instances_list = []
-        for i in self.redis_client.hkeys(self.instances_table):
-            instances_list.append(i.decode("utf-8"))
-        return instances_list
+        return list(self._instance_records())
+
+    def _instance_keys(self, instance_id: str) -> list[str]:
+        """该实例所有依赖的key（历史消息、论文元数据之外的论文数据、token用量累计值，带hash tag时还有最后活动时间）"""
+        prefixes = (
+            HISTORY_KEY_PREFIX, HISTORY_ARCHIVED_PREFIX, HISTORY_SEGMENTS_PREFIX, HISTORY_STATS_PREFIX, self.paper_version_prefix,
+            self.digest_prefix, self.usage_prefix, self.route_prefix, self.structure_prefix, self.adjacency_prefix,
+        )
+        keys = [self._key(prefix, instance_id) for prefix in prefixes]
+        if self.layout.hash_tags:
+            keys.append(self.layout.activity_key(instance_id))
+        return keys
 
     def rename_instance(self, instance_id: str, new_id: str):
-        instance = self.get_instance(instance_id)
-        if instance is not None:
-            self.redis_client.hset(self.instances_table, new_id, instance)
-            self.redis_client.hdel(self.instances_table, instance_id)
+        """
+        修改实例id：实例记录、最后活动时间与所有依赖的key在同一个事务中迁移（WATCH + MULTI，冲突时自动重试）
+            论文元数据逐条改写其中的 instance_id。
+            集群中新旧实例的key位于不同的slot，改为逐步复制（见 _rename_across_slots）
+            参数:
+                instance_id: 原实例id
+                new_id: 新实例id
+        """
+        index_key, new_index_key = self.layout.index_key(instance_id), self.layout.index_key(new_id)
+        old_keys = self._instance_keys(instance_id)
+        new_keys = self._instance_keys(new_id)
+        paper_key, new_paper_key = self._paper_table(instance_id), self._paper_table(new_id)
+
+        if settings.REDIS_CLUSTER:
+            self._rename_across_slots(instance_id, new_id)
         else:
+            def _move(pipe):
+                # WATCH 之后的读取立即执行；新实例id在 WATCH 之后检查，并发创建同名实例时事务放弃并重试
+                if pipe.hexists(new_index_key, new_id):
+                    raise ValueError(f"Instance {new_id} already exists")
+                record, _ = decode_record(pipe.hget(index_key, instance_id), InstanceRecord)
+                if record is None:
+                    raise KeyError(f"Instance {instance_id} not found")
+                # 旧布局的最后活动时间在共用的hash中，带hash tag时随实例的其他key一起改名
+                activity = None if self.layout.hash_tags else pipe.hget(self.activity_table, instance_id)
+                existing = [(old, new) for old, new in zip(old_keys, new_keys) if pipe.exists(old)]
+                papers = pipe.hgetall(paper_key)
+                record.id = new_id
+                pipe.multi()
+                pipe.hdel(index_key, instance_id)
+                pipe.hset(new_index_key, new_id, encode_record(record))
+                if activity:
+                    pipe.hset(self.activity_table, new_id, activity)
+                    pipe.hdel(self.activity_table, instance_id)
+                for old, new in existing:
+                    pipe.rename(old, new)
+                if papers:
+                    pipe.delete(paper_key)
+                    pipe.hset(new_paper_key, mapping=self._moved_papers(papers, new_id))
+
+            self.redis_client.transaction(
+                _move, index_key, new_index_key, self.activity_table, paper_key, *old_keys
+            )
+        self.cache.invalidate(
+            index_key, new_index_key, paper_key, new_paper_key,
+            self._key(self.paper_version_prefix, instance_id), self._key(self.paper_version_prefix, new_id),
+        )
+        logger.info("实例id已修改 %s -> %s", instance_id, new_id)
+
+    @staticmethod
+    def _moved_papers(papers: dict, new_id: str) -> dict:
+        """改写论文元数据中的 instance_id（无法解析的记录原样迁移）"""
+        moved = {}
+        for paper_id, value in papers.items():
+            paper, _ = decode_record(value, PaperRecord)
+            if paper is not None:
+                paper.instance_id = new_id
+                value = encode_record(paper)
+            moved[paper_id] = value
+        return moved
+
+    def _rename_across_slots(self, instance_id: str, new_id: str) -> None:
+        """
+        集群中修改实例id：新旧实例的key位于不同的slot，不能放在同一个事务中
+            1. 在新实例的slot中用一个事务写入所有key的副本（DUMP/RESTORE，保留过期时间）
+            2. 用 HSETNX 写入新的实例记录（并发创建了同名实例时放弃），再删除旧的实例记录，此时新实例才对外可见
+            3. 在旧实例的slot中用一个事务删除旧的key
+            中途失败时旧实例保持完整，残留的新key会在下次修改为同一id时被覆盖
+        """
+        index_key, new_index_key = self.layout.index_key(instance_id), self.layout.index_key(new_id)
+        if self.redis_client.hexists(new_index_key, new_id):
+            raise ValueError(f"Instance {new_id} already exists")
+        record, _ = decode_record(self.redis_client.hget(index_key, instance_id), InstanceRecord)
+        if record is None:
             raise KeyError(f"Instance {instance_id} not found")
+        record.id = new_id
+        old_keys = self._instance_keys(instance_id)
+        new_keys = self._instance_keys(new_id)
+        paper_key, new_paper_key = self._paper_table(instance_id), self._paper_table(new_id)
+
+        with self.redis_client.pipeline(transaction=False) as pipe:
+            for key in old_keys:
+                pipe.dump(key)
+                pipe.pttl(key)
+            results = pipe.execute()
+        papers = self.redis_client.hgetall(paper_key)
+        with UnitOfWork(self.redis_client) as uow:
+            for new, dumped, pttl in zip(new_keys, results[::2], results[1::2]):
+                if dumped is not None:
+                    uow.restore(new, max(pttl, 0), dumped, replace=True)
+            uow.delete(new_paper_key)
+            if papers:
+                uow.hset(new_paper_key, mapping=self._moved_papers(papers, new_id))
+        if not self.redis_client.hsetnx(new_index_key, new_id, encode_record(record)):
+            raise ValueError(f"Instance {new_id} already exists")
+        self.redis_client.hdel(index_key, instance_id)
+        with UnitOfWork(self.redis_client) as uow:
+            uow.delete(paper_key, *old_keys)
 
     def _paper_table(self, instance_id: str) -> str:
         """ 
@@ -96,20 +304,76 @@ class RedisService:
                 返回：
                     str:论文元数据存储的key
         """
-        return f"{self.paper_prefix}{instance_id}"
+        return self._key(self.paper_prefix, instance_id)
 
     def add_paper_metadata(self, instance_id: str, paper_id: str, metadata: dict) -> None:
         """
         添加论文元数据到redis中
+            参数:
+                instance_id: 聊天实例id
+                paper_id: 论文id
+                metadata: 论文元数据（写入前按 PaperRecord 校验）
+            返回: None
+        """
+        with redis_pool.unit_of_work() as uow:
+            uow.hset(self._paper_table(instance_id), paper_id, encode_record(metadata, PaperRecord))
+            # 论文集发生变化，版本号自增
+            uow.incr(self._key(self.paper_version_prefix, instance_id))
+        self._invalidate_papers(instance_id)
+
+    def _invalidate_papers(self, instance_id: str) -> None:
+        """论文元数据写入提交后使缓存失效"""
+        self.cache.invalidate(self._paper_table(instance_id), self._key(self.paper_version_prefix, instance_id))
+
+    def complete_paper_ingest(self, instance_id: str, paper_id: str, metadata: dict, structure: dict, adjacency: dict) -> None:
+        """
+        论文导入完成：论文结构、片段邻接索引与状态为ready的元数据在同一个事务中写入，
+        其他会话不会读到元数据已就绪但结构或邻接索引缺失的状态
             参数:
                 instance_id: 聊天实例id
                 paper_id: 论文id
                 metadata: 论文元数据
+                structure: 论文结构
+                adjacency: 片段邻接索引
             返回: None
         """
-        # 获取该实例存储的key
-        key = self._paper_table(instance_id)
-        self.redis_client.hset(key, paper_id, json.dumps(obj=metadata, ensure_ascii=False))
+        with redis_pool.unit_of_work() as uow:
+            uow.hset(self._key(self.structure_prefix, instance_id), paper_id, dumps(structure))
+            uow.hset(self._key(self.adjacency_prefix, instance_id), paper_id, dumps(adjacency))
+            uow.hset(self._paper_table(instance_id), paper_id, encode_record(metadata, PaperRecord))
+            uow.incr(self._key(self.paper_version_prefix, instance_id))
+        self._invalidate_papers(instance_id)
+
+    def remove_paper_metadata(self, instance_id: str, paper_id: str) -> None:
+        """
+        删除论文元数据（论文导入失败时回滚预写入的元数据）
+            参数:
+                instance_id: 聊天实例id
+                paper_id: 论文id
+            返回: None
+        """
+        with redis_pool.unit_of_work() as uow:
+            uow.hdel(self._paper_table(instance_id), paper_id)
+            uow.incr(self._key(self.paper_version_prefix, instance_id))
+            for prefix in (self.digest_prefix, self.route_prefix, self.structure_prefix, self.adjacency_prefix):
+                uow.hdel(self._key(prefix, instance_id), paper_id)
+        self._invalidate_papers(instance_id)
+
+    def get_paper_set_version(self, instance_id: str) -> int:
+        """
+        获取该实例论文集的版本号，论文集变化后版本号递增
+            参数:
+                instance_id: 聊天实例id
+            返回:
+                int: 版本号，从未添加过论文时为0
+        """
+        key = self._key(self.paper_version_prefix, instance_id)
+
+        def _load() -> int:
+            value = self.redis_client.get(key)
+            return int(value) if value else 0
+
+        return self.cache.get(key, _load)
 
     def get_paper_metadata(self, instance_id: str, paper_id: str):
         """
@@ -120,84 +384,444 @@ class RedisService:
                 返回：
                     json: 论文元数据
         """
-        # 获取该实例存储的key
-        key = self._paper_table(instance_id)
-        # 从redis中获取该论文id的元数据
-        value = self.redis_client.hget(key, paper_id)
-        # 转换为JSON格式
+        # 从缓存的论文元数据中查找，返回副本（调用方可能修改后写回）
+        record = self._paper_records(instance_id).get(paper_id)
+        return dict(record) if record is not None else None
+
+    def set_paper_digest(self, instance_id: str, paper_id: str, digest: dict) -> None:
+        """
+        存储论文的分层摘要（章节摘要 + 全文摘要）
+            参数:
+                instance_id: 聊天实例id
+                paper_id: 论文id
+                digest: 分层摘要
+            返回: None
+        """
+        self.redis_client.hset(
+            self._key(self.digest_prefix, instance_id), paper_id, dumps(digest)
+        )
+
+    def get_paper_digest(self, instance_id: str, paper_id: str) -> dict | None:
+        """
+        获取论文的分层摘要
+            参数:
+                instance_id: 聊天实例id
+                paper_id: 论文id
+            返回:
+                dict | None: 分层摘要，尚未生成时返回None
+        """
+        value = self.redis_client.hget(self._key(self.digest_prefix, instance_id), paper_id)
         if not value:
             return None
         try:
-            return json.loads(value)
+            return loads(value)
         except json.JSONDecodeError:
+            return None
+
+    def list_paper_digests(self, instance_id: str) -> dict:
+        """
+        获取该实例下所有论文的分层摘要
+            参数:
+                instance_id: 聊天实例id
+            返回:
+                dict: {paper_id: 分层摘要}
+        """
+        digests = {}
+        for paper_id, value in self.redis_client.hgetall(self._key(self.digest_prefix, instance_id)).items():
             try:
-                return ast.literal_eval(value.decode("utf-8"))
-            except Exception:
-                return None
+                digests[paper_id.decode("utf-8")] = loads(value)
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                continue
+        return digests
 
-    def list_paper_metadata(self, instance_id: str):
-        key = self._paper_table(instance_id)
-        values = self.redis_client.hvals(key)
-        papers = []
-        for value in values:
+    def set_paper_structure(self, instance_id: str, paper_id: str, structure: dict) -> None:
+        """
+        存储论文结构（章节标题、图表标题、摘要与参考文献的分块范围）
+            参数:
+                instance_id: 聊天实例id
+                paper_id: 论文id
+                structure: 论文结构
+            返回: None
+        """
+        self.redis_client.hset(
+            self._key(self.structure_prefix, instance_id), paper_id, dumps(structure)
+        )
+
+    def get_paper_structure(self, instance_id: str, paper_id: str) -> dict | None:
+        """
+        获取论文结构
+            参数:
+                instance_id: 聊天实例id
+                paper_id: 论文id
+            返回:
+                dict | None: 论文结构，旧论文没有结构时返回None
+        """
+        value = self.redis_client.hget(self._key(self.structure_prefix, instance_id), paper_id)
+        if not value:
+            return None
+        try:
+            return loads(value)
+        except json.JSONDecodeError:
+            return None
+
+    def set_chunk_adjacency(self, instance_id: str, paper_id: str, adjacency: dict) -> None:
+        """
+        存储论文的片段邻接索引
+            参数:
+                instance_id: 聊天实例id
+                paper_id: 论文id
+                adjacency: {分块号: {"prev", "next", "page", "start", "end"}}
+            返回: None
+        """
+        self.redis_client.hset(self._key(self.adjacency_prefix, instance_id), paper_id, dumps(adjacency))
+
+    def get_chunk_adjacency(self, instance_id: str, paper_ids: list[str]) -> dict[str, dict]:
+        """
+        批量获取多篇论文的片段邻接索引（一次HMGET）
+            参数:
+                instance_id: 聊天实例id
+                paper_ids: 论文id列表
+            返回:
+                dict[str, dict]: {paper_id: 邻接索引}，旧论文没有邻接索引时不包含在结果中
+        """
+        if not paper_ids:
+            return {}
+        values = self.redis_client.hmget(self._key(self.adjacency_prefix, instance_id), paper_ids)
+        adjacency = {}
+        for paper_id, value in zip(paper_ids, values):
+            if not value:
+                continue
             try:
-                papers.append(json.loads(value))
+                adjacency[paper_id] = loads(value)
             except json.JSONDecodeError:
-                try:
-                    papers.append(ast.literal_eval(value.decode("utf-8")))
-                except Exception:
+                continue
+        return adjacency
+
+    def set_paper_route_vectors(self, instance_id: str, paper_id: str, vectors: bytes) -> None:
+        """
+        存储论文的路由向量（标题、摘要、全文摘要的向量，float32字节拼接）
+            参数:
+                instance_id: 聊天实例id
+                paper_id: 论文id
+                vectors: float32 向量字节
+            返回: None
+        """
+        self.redis_client.hset(self._key(self.route_prefix, instance_id), paper_id, vectors)
+
+    def list_paper_route_vectors(self, instance_id: str) -> dict[str, bytes]:
+        """
+        获取该实例下所有论文的路由向量
+            参数:
+                instance_id: 聊天实例id
+            返回:
+                dict[str, bytes]: {paper_id: float32 向量字节}
+        """
+        return {
+            paper_id.decode("utf-8"): value
+            for paper_id, value in self.redis_client.hgetall(self._key(self.route_prefix, instance_id)).items()
+        }
+
+    def record_usage(self, instance_id: str, input_tokens: int, output_tokens: int, backend: str = "") -> None:
+        """
+        记录一次LLM调用的token用量（累计值 + 当天汇总，当天汇总设置过期时间）
+            参数:
+                instance_id: 聊天实例id
+                input_tokens: 输入token数
+                output_tokens: 输出token数
+                backend: 模型后端名称
+            返回: None
+        """
+        if not instance_id:
+            return
+        daily_key = f"{self._key(self.usage_prefix, instance_id)}:{datetime.now().strftime('%Y%m%d')}"
+        pipe = self.redis_client.pipeline(transaction=False)
+        for key in (self._key(self.usage_prefix, instance_id), daily_key):
+            pipe.hincrby(key, "input_tokens", input_tokens)
+            pipe.hincrby(key, "output_tokens", output_tokens)
+            pipe.hincrby(key, "requests", 1)
+            if backend:
+                pipe.hincrby(key, f"tokens:{backend}", input_tokens + output_tokens)
+        pipe.expire(daily_key, settings.USAGE_ROLLUP_TTL_DAYS * 86400)
+        pipe.execute()
+
+    def get_usage(self, instance_id: str, day: str | None = None) -> dict:
+        """
+        获取token用量
+            参数:
+                instance_id: 聊天实例id
+                day: 日期（YYYYMMDD），为None时返回累计用量
+            返回:
+                dict: {"input_tokens", "output_tokens", "requests", "tokens:<后端>"...}
+        """
+        key = self._key(self.usage_prefix, instance_id) + (f":{day}" if day else "")
+        usage = {"input_tokens": 0, "output_tokens": 0, "requests": 0}
+        for field, value in self.redis_client.hgetall(key).items():
+            usage[field.decode("utf-8")] = int(value)
+        return usage
+
+    def list_paper_ids(self, instance_id: str) -> list[str]:
+        """获取该实例下所有论文的id"""
+        return list(self._paper_records(instance_id))
+
+    def _paper_records(self, instance_id: str) -> dict[str, dict]:
+        """
+        该实例下所有论文的元数据（读穿透缓存，返回的是共享对象）
+            未命中时一次HGETALL读取并解码，旧格式的记录回写为当前版本
+            返回:
+                dict[str, dict]: {paper_id: 论文元数据}
+        """
+        key = self._paper_table(instance_id)
+
+        def _load() -> dict[str, dict]:
+            papers = {}
+            stale_records = {}
+            for paper_id, value in self.redis_client.hgetall(key).items():
+                record, stale = decode_record(value, PaperRecord)
+                if record is None:
                     continue
-        return papers
+                if stale:
+                    stale_records[paper_id] = encode_record(record)
+                papers[paper_id.decode("utf-8")] = record.to_dict()
+            if stale_records:
+                self.redis_client.hset(key, mapping=stale_records)
+            return papers
+
+        return self.cache.get(key, _load)
+
+    def list_paper_metadata(self, instance_id: str) -> list[dict]:
+        """
+        获取该实例下所有论文的元数据
+            参数:
+                instance_id: 聊天实例id
+            返回:
+                list[dict]: 论文元数据列表（副本）
+        """
+        return [dict(record) for record in self._paper_records(instance_id).values()]
+
+
+def _create_storage() -> tuple[StorageService, ChatHistoryStore]:
+    """按 settings.STORAGE_BACKEND 创建存储后端（模块级单例名称保持不变，调用方无需修改）"""
+    if settings.STORAGE_BACKEND == BACKEND_SQLITE:
+        from app.server.sqlite_storage import SqliteChatHistoryStore, SqliteStorageService
+        storage = SqliteStorageService()
+        return storage, SqliteChatHistoryStore(storage)
+    return RedisService(), ChatMessageHistory()
 
 
-redis_service = RedisService()
+class PooledRedisChatMessageHistory(RedisChatMessageHistory):
+    """
+    使用共享连接池的历史消息客户端
+        父类会根据url为每个客户端单独创建连接，这里直接使用共享的redis客户端
+    """
 
+    def __init__(self, session_id: str, redis_client: redis.Redis, key_prefix: str = HISTORY_KEY_PREFIX, ttl: int | None = None):
+        self.redis_client = redis_client
+        self.session_id = session_id
+        self.key_prefix = key_prefix
+        self.ttl = ttl
 
-class ChatMessageHistory:
-    def __init__(self) -> None:
-        #定义历史消息客户列表
-        self.chat_message_history_client_list: List[RedisChatMessageHistory] = []
+    @property
+    def key(self) -> str:
+        return key_layout.instance_key(self.key_prefix, self.session_id)
+
+    @property
+    def archived_key(self) -> str:
+        return key_layout.instance_key(HISTORY_ARCHIVED_PREFIX, self.session_id)
+
+    @property
+    def segments_key(self) -> str:
+        return key_layout.instance_key(HISTORY_SEGMENTS_PREFIX, self.session_id)
+
+    @property
+    def stats_key(self) -> str:
+        return key_layout.instance_key(HISTORY_STATS_PREFIX, self.session_id)
+
+    @property
+    def messages(self) -> list[BaseMessage]:
+        """全部历史消息（归档 + redis中最近的消息），按时间顺序排列"""
+        return self.get_range(0, self.count())
+
+    def add_message(self, message: BaseMessage) -> None:
+        """添加一条消息"""
+        self.add_messages([message])
+
+    def add_messages(self, messages: list[BaseMessage], activity_time: str | None = None) -> None:
+        """
+        添加一组消息（压缩后写入redis），所有写操作在一个事务中一次往返提交；
+        redis中的消息超过热数据窗口时把最早的一批移入归档
+            参数:
+                messages: 按时间顺序排列的消息
+                activity_time: 实例的最后活动时间，传入时一并更新
+        """
+        encoded = [encode_message(message) for message in messages]
+        with UnitOfWork(self.redis_client) as uow:
+            # LPUSH 依次写入列表头部，最后一条消息位于头部
+            uow.lpush(self.key, *[payload for payload, _ in encoded])
+            uow.hincrby(self.stats_key, "raw_bytes", sum(raw_size for _, raw_size in encoded))
+            uow.hincrby(self.stats_key, "stored_bytes", sum(len(payload) for payload, _ in encoded))
+            if activity_time:
+                key_layout.set_activity(uow, self.session_id, activity_time)
+            if self.ttl:
+                # 历史消息的所有key使用相同的过期时间，避免只剩下统计或归档索引
+                for key in (self.key, self.archived_key, self.segments_key, self.stats_key):
+                    uow.expire(key, self.ttl)
+        length = uow.results[0]
+        # 按批归档，避免每条消息都触发一次归档
+        if length > settings.HISTORY_HOT_MESSAGES + settings.HISTORY_ARCHIVE_BATCH:
+            self._archive()
+
+    def _archive(self) -> None:
+        """
+        把热数据窗口之外最早的消息移入归档
+            1. 先把这批消息写入归档目录中的一个分段文件
+            2. 在同一个事务中登记分段索引、从列表中删除这批消息并更新已归档条数
+            其他会话同时写入或归档时事务放弃并删除刚写入的分段文件，下次写入时重新归档
+        """
+        segment = None
+        with self.redis_client.pipeline(transaction=True) as pipe:
+            try:
+                pipe.watch(self.key, self.archived_key)
+                archived = int(pipe.get(self.archived_key) or 0)
+                count = pipe.llen(self.key) - settings.HISTORY_HOT_MESSAGES
+                if count <= 0:
+                    return
+                # 列表尾部为最早的消息
+                items = list(reversed(pipe.lrange(self.key, -count, -1)))
+                segment = history_archive.new_segment(archived, count)
+                history_archive.write(segment, items)
+                pipe.multi()
+                pipe.zadd(self.segments_key, {segment: archived})
+                pipe.ltrim(self.key, 0, -(count + 1))
+                pipe.incrby(self.archived_key, count)
+                pipe.hincrby(self.stats_key, "archived_bytes", sum(len(item) for item in items))
+                if self.ttl:
+                    pipe.expire(self.segments_key, self.ttl)
+                pipe.execute()
+                logger.info("历史消息已归档 instance_id=%s 条数=%d", self.session_id, count)
+            except redis.WatchError:
+                history_archive.delete([segment])
+                logger.debug("历史消息归档冲突，稍后重试 instance_id=%s", self.session_id)
+
+    def count(self) -> int:
+        """历史消息总条数（已归档 + redis中）"""
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.get(self.archived_key)
+        pipe.llen(self.key)
+        archived, hot = pipe.execute()
+        return int(archived or 0) + hot
+
+    def get_range(self, start: int, stop: int) -> list[BaseMessage]:
+        """
+        按位置读取一段历史消息，自动拼接归档与redis中的消息
+            位置按时间顺序从0开始；消息只追加不修改，位置可作为消息的稳定标识。
+            新消息写入列表头部（LPUSH），redis中使用从列表尾部计数的下标，读取不受新消息影响
+            参数:
+                start: 起始位置（包含）
+                stop: 结束位置（不包含）
+            返回:
+                list[BaseMessage]: 按时间顺序排列的消息
+        """
+        if stop <= start:
+            return []
+        archived = int(self.redis_client.get(self.archived_key) or 0)
+        hot_items = []
+        for _ in range(3):
+            hot_start, hot_stop = max(start, archived) - archived, stop - archived
+            pipe = self.redis_client.pipeline()
+            pipe.get(self.archived_key)
+            if hot_stop > hot_start:
+                pipe.lrange(self.key, -hot_stop, -(hot_start + 1))
+            results = pipe.execute()
+            current = int(results[0] or 0)
+            if current == archived:
+                hot_items = list(reversed(results[1])) if len(results) > 1 else []
+                break
+            # 读取期间发生了归档，按新的已归档条数重新读取
+            archived = current
+        items = self._read_archive(start, min(stop, archived)) if start < archived else []
+        return messages_from_dict(items + [decode_payload(item) for item in hot_items])
+
+    def _read_archive(self, start: int, stop: int) -> list[dict]:
+        """
+        从归档分段中读取一段消息（分段写入后不再修改，按分段索引找到覆盖该范围的分段）
+            参数:
+                start: 起始位置（包含）
+                stop: 结束位置（不包含）
+            返回:
+                list[dict]: message_to_dict 格式的消息
+        """
+        pipe = self.redis_client.pipeline(transaction=False)
+        # 包含起始位置的分段 + 起始位置之后、结束位置之前开始的分段
+        pipe.zrevrangebyscore(self.segments_key, start, "-inf", start=0, num=1)
+        pipe.zrangebyscore(self.segments_key, f"({start}", f"({stop}")
+        first, rest = pipe.execute()
+        items = []
+        for segment in first + rest:
+            segment_start, _ = history_archive.segment_range(segment)
+            for offset, item in enumerate(history_archive.read(segment)):
+                if start <= segment_start + offset < stop:
+                    items.append(item)
+        return items
+
+    def clear(self) -> None:
+        """删除全部历史消息（包括归档分段文件）"""
+        segments = self.redis_client.zrange(self.segments_key, 0, -1)
+        self.redis_client.delete(self.key, self.archived_key, self.segments_key, self.stats_key)
+        history_archive.delete(segments)
+
+    def storage_stats(self) -> dict:
+        """
+        历史消息的存储统计
+            返回:
+                dict: messages（总条数）、archived_messages（已归档条数）、raw_bytes（未压缩的总字节数）、
+                    stored_bytes（redis中存储的字节数）、archived_bytes（归档移出redis释放的字节数）、
+                    saved_bytes（相比未压缩且不归档节省的redis字节数）
+        """
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.hgetall(self.stats_key)
+        pipe.get(self.archived_key)
+        pipe.llen(self.key)
+        stats, archived, hot = pipe.execute()
+        stats = {field.decode("utf-8"): int(value) for field, value in stats.items()}
+        raw_bytes = stats.get("raw_bytes", 0)
+        archived_bytes = stats.get("archived_bytes", 0)
+        # 旧数据没有计入 stored_bytes，归档后可能出现负数
+        redis_bytes = max(0, stats.get("stored_bytes", 0) - archived_bytes)
+        return {
+            "messages": int(archived or 0) + hot,
+            "archived_messages": int(archived or 0),
+            "raw_bytes": raw_bytes,
+            "stored_bytes": redis_bytes,
+            "archived_bytes": archived_bytes,
+            "saved_bytes": max(0, raw_bytes - redis_bytes),
+        }
+
+
+class ChatMessageHistory(ChatHistoryStore):
+    def __init__(self, max_clients: int | None = None) -> None:
+        # 历史消息客户端注册表：实例id -> 客户端，按最近使用顺序淘汰
+        self._clients: OrderedDict[str, PooledRedisChatMessageHistory] = OrderedDict()
+        self._max_clients = max_clients or settings.HISTORY_CLIENT_CACHE_SIZE
+        # 多个 Streamlit 会话在不同线程中并发访问
+        self._lock = threading.Lock()
 
     def get_chat_message_history_client(self, instance_id: str) -> RedisChatMessageHistory:
         """ 根据用户实例id进行获取该用户实例的历史消息客户端 \n
             return :RedisChatMessageHistory对象
         """
-        # 判断该实例id是否在历史消息客户列表中
-        if instance_id not in [item.session_id for item in self.chat_message_history_client_list]:
-            # 如果不在，则创建一个新的历史消息客户
-            chat_message_history_client = RedisChatMessageHistory(
-                session_id=instance_id,
-                url=settings.redis_url,
-            )
-            # 将新创建的历史消息客户添加到列表中
-            self.chat_message_history_client_list.append(chat_message_history_client)
-            # 返回
-            return chat_message_history_client
-        # 如果在，则返回该实例id对应的历史消息客户
-        chat_message_history_client: RedisChatMessageHistory = self.chat_message_history_client_list[
-                                [item.session_id for item in self.chat_message_history_client_list].index(instance_id)
-                            ]
-        # 返回
-        return chat_message_history_client
-
-    def add_user_ai_message(self, chat_message_history_client, user_message, ai_message, message_type, message_time):
-        """
-         
-        """
-        # 其他参数信息
-        additional_kwargs = {
-            "message_type": message_type,
-            "message_time": message_time,
-        }
-        # 添加用户消息
-        chat_message_history_client.add_message(
-            HumanMessage(content=user_message, additional_kwargs=additional_kwargs)
-        )
-        # 添加AI消息
-        chat_message_history_client.add_message(
-            AIMessage(content=ai_message, additional_kwargs=additional_kwargs)
-        )
-        print('app/server/redis_service.py: add_user_ai_message: 历史消息添加完成') 
+        with self._lock:
+            # 已存在则标记为最近使用并返回
+            client = self._clients.get(instance_id)
+            if client is not None:
+                self._clients.move_to_end(instance_id)
+                return client
+            # 不存在则创建一个新的历史消息客户端（共享连接池，不单独建立连接）
+            client = PooledRedisChatMessageHistory(session_id=instance_id, redis_client=redis_pool.get_client())
+            self._clients[instance_id] = client
+            # 超过上限时淘汰最久未使用的客户端（消息保存在redis中，淘汰后再次访问时重新创建即可）
+            while len(self._clients) > self._max_clients:
+                self._clients.popitem(last=False)
+            return client
 
 
-chat_message_history = ChatMessageHistory()
+redis_service, chat_message_history = _create_storage()
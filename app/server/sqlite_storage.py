@@ -0,0 +1,570 @@
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, messages_from_dict
+
+from app.server.history_store import decode_payload, encode_message
+from app.server.storage import ChatHistoryStore, StorageService
+from app.utils.log_util import get_logger
+from app.utils.serialization import InstanceRecord, PaperRecord, decode_record, dumps, encode_record, loads
+from config.settings import settings
+
+logger = get_logger("sqlite_storage")
+
+_SCHEMA = (
+    # 实例记录与最后活动时间（只有活动时间、尚无记录的行不视为实例）
+    "CREATE TABLE IF NOT EXISTS instances ("
+    "instance_id TEXT PRIMARY KEY, record BLOB, last_activity TEXT)",
+    # 论文元数据与派生数据，同一篇论文的数据在同一行中
+    "CREATE TABLE IF NOT EXISTS papers ("
+    "instance_id TEXT NOT NULL, paper_id TEXT NOT NULL, record BLOB, digest BLOB, structure BLOB, "
+    "adjacency BLOB, routes BLOB, PRIMARY KEY (instance_id, paper_id)) WITHOUT ROWID",
+    "CREATE TABLE IF NOT EXISTS paper_versions (instance_id TEXT PRIMARY KEY, version INTEGER NOT NULL)",
+    # token用量：day 为空字符串时是累计值，否则是当天汇总（YYYYMMDD）
+    "CREATE TABLE IF NOT EXISTS usage ("
+    "instance_id TEXT NOT NULL, day TEXT NOT NULL, field TEXT NOT NULL, value INTEGER NOT NULL, "
+    "PRIMARY KEY (instance_id, day, field)) WITHOUT ROWID",
+    # 历史消息按 (实例id, 位置) 保存压缩后的数据，与redis后端的消息格式一致
+    "CREATE TABLE IF NOT EXISTS messages ("
+    "instance_id TEXT NOT NULL, position INTEGER NOT NULL, payload BLOB NOT NULL, "
+    "PRIMARY KEY (instance_id, position)) WITHOUT ROWID",
+    "CREATE TABLE IF NOT EXISTS message_stats ("
+    "instance_id TEXT PRIMARY KEY, raw_bytes INTEGER NOT NULL, stored_bytes INTEGER NOT NULL)",
+)
+
+# 实例id变更或删除实例时需要一起处理的表（instances 与 papers 单独处理）
+_INSTANCE_TABLES = ("paper_versions", "usage", "messages", "message_stats")
+
+
+def _json_or_none(value: bytes | None):
+    """解析派生数据，为空或无法解析时返回None"""
+    if not value:
+        return None
+    try:
+        return loads(value)
+    except ValueError:
+        return None
+
+
+class SqliteStorageService(StorageService):
+    """
+    基于SQLite的存储后端（单机部署，不需要redis服务）
+        1. 所有数据保存在一个本地数据库文件中，读写都是进程内调用，没有网络往返
+        2. 每个线程使用独立的连接（WAL模式，读写互不阻塞），多步写入在一个事务中提交
+        3. 记录、派生数据与历史消息的编码格式与redis后端一致
+    """
+
+    def __init__(self, path: str | Path | None = None):
+        self.path = Path(path or settings.SQLITE_STORAGE_PATH)
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    def _connect(self) -> sqlite3.Connection:
+        """获取当前线程的数据库连接（首次使用时创建数据库文件与表）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # 自动提交模式，事务由 _transaction 显式开启
+            conn = sqlite3.connect(str(self.path), timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with self._schema_lock:
+                if not self._schema_ready:
+                    for statement in _SCHEMA:
+                        conn.execute(statement)
+                    self._schema_ready = True
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """写事务（BEGIN IMMEDIATE，多个进程同时写入时按顺序执行），异常时回滚"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    # ---------- 聊天实例 ----------
+    def add_instance(self, instance_id: str, instance: InstanceRecord | dict):
+        """
+        添加（或覆盖）一个聊天实例记录
+            参数:
+                instance_id: 聊天实例id
+                instance: 聊天实例记录（或实例字典，写入前校验）
+        """
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO instances (instance_id, record) VALUES (?, ?) "
+                "ON CONFLICT (instance_id) DO UPDATE SET record = excluded.record",
+                (instance_id, encode_record(instance, InstanceRecord)),
+            )
+
+    def _decode_instance(self, conn: sqlite3.Connection, instance_id: str, value: bytes) -> InstanceRecord | None:
+        """解码实例记录，旧格式的记录回写为当前版本"""
+        record, stale = decode_record(value, InstanceRecord)
+        if record is None:
+            logger.warning("解析实例失败 %s", instance_id)
+        elif stale:
+            conn.execute("UPDATE instances SET record = ? WHERE instance_id = ?", (encode_record(record), instance_id))
+        return record
+
+    def get_instance(self, instance_id: str) -> InstanceRecord | None:
+        """获取聊天实例记录"""
+        conn = self._connect()
+        row = conn.execute("SELECT record FROM instances WHERE instance_id = ?", (instance_id,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return self._decode_instance(conn, instance_id, row[0])
+
+    def remove_instance(self, instance_id: str):
+        """删除聊天实例记录、最后活动时间与所有依赖的数据（论文数据、版本号、用量、历史消息）"""
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM instances WHERE instance_id = ?", (instance_id,))
+            conn.execute("DELETE FROM papers WHERE instance_id = ?", (instance_id,))
+            for table in _INSTANCE_TABLES:
+                conn.execute(f"DELETE FROM {table} WHERE instance_id = ?", (instance_id,))
+        logger.info("实例已删除 %s", instance_id)
+
+    def touch_instance(self, instance_id: str, activity_time: str) -> None:
+        """
+        记录实例的最后活动时间
+            参数:
+                instance_id: 聊天实例id
+                activity_time: 活动时间
+        """
+        with self._transaction() as conn:
+            self._touch(conn, instance_id, activity_time)
+
+    @staticmethod
+    def _touch(conn: sqlite3.Connection, instance_id: str, activity_time: str) -> None:
+        conn.execute(
+            "INSERT INTO instances (instance_id, last_activity) VALUES (?, ?) "
+            "ON CONFLICT (instance_id) DO UPDATE SET last_activity = excluded.last_activity",
+            (instance_id, activity_time),
+        )
+
+    def list_instance_index(self) -> list[dict]:
+        """
+        获取轻量的实例索引（一次查询，消息数按主键索引取最大位置，不读取历史消息内容）
+            返回:
+                list[dict]: [{"id", "name", "created_at", "message_count", "last_activity"}]
+        """
+        conn = self._connect()
+        rows = conn.execute(
+            "SELECT i.instance_id, i.record, i.last_activity, "
+            "(SELECT COALESCE(MAX(m.position) + 1, 0) FROM messages m WHERE m.instance_id = i.instance_id) "
+            "FROM instances i WHERE i.record IS NOT NULL ORDER BY i.rowid"
+        ).fetchall()
+        index = []
+        for instance_id, value, last_activity, message_count in rows:
+            record = self._decode_instance(conn, instance_id, value)
+            if record is None:
+                continue
+            index.append({
+                "id": record.id or instance_id,
+                "name": record.name,
+                "created_at": record.created_at,
+                "message_count": message_count,
+                "last_activity": last_activity,
+            })
+        return index
+
+    def rename_instance(self, instance_id: str, new_id: str):
+        """
+        修改实例id：实例记录、论文数据、用量与历史消息在同一个事务中迁移
+            参数:
+                instance_id: 原实例id
+                new_id: 新实例id
+        """
+        with self._transaction() as conn:
+            if conn.execute(
+                "SELECT 1 FROM instances WHERE instance_id = ? AND record IS NOT NULL", (new_id,)
+            ).fetchone():
+                raise ValueError(f"Instance {new_id} already exists")
+            row = conn.execute("SELECT record FROM instances WHERE instance_id = ?", (instance_id,)).fetchone()
+            record, _ = decode_record(row[0] if row else None, InstanceRecord)
+            if record is None:
+                raise KeyError(f"Instance {instance_id} not found")
+            record.id = new_id
+            # 新id下可能残留只有活动时间的行
+            conn.execute("DELETE FROM instances WHERE instance_id = ?", (new_id,))
+            conn.execute(
+                "UPDATE instances SET instance_id = ?, record = ? WHERE instance_id = ?",
+                (new_id, encode_record(record), instance_id),
+            )
+            for paper_id, value in conn.execute(
+                "SELECT paper_id, record FROM papers WHERE instance_id = ?", (instance_id,)
+            ).fetchall():
+                paper, _ = decode_record(value, PaperRecord)
+                if paper is not None:
+                    paper.instance_id = new_id
+                    value = encode_record(paper)
+                conn.execute(
+                    "UPDATE papers SET instance_id = ?, record = ? WHERE instance_id = ? AND paper_id = ?",
+                    (new_id, value, instance_id, paper_id),
+                )
+            for table in _INSTANCE_TABLES:
+                conn.execute(f"UPDATE {table} SET instance_id = ? WHERE instance_id = ?", (new_id, instance_id))
+        logger.info("实例id已修改 %s -> %s", instance_id, new_id)
+
+    # ---------- 论文元数据 ----------
+    @staticmethod
+    def _bump_version(conn: sqlite3.Connection, instance_id: str) -> None:
+        """论文集发生变化，版本号自增"""
+        conn.execute(
+            "INSERT INTO paper_versions (instance_id, version) VALUES (?, 1) "
+            "ON CONFLICT (instance_id) DO UPDATE SET version = version + 1",
+            (instance_id,),
+        )
+
+    @staticmethod
+    def _set_paper_field(conn: sqlite3.Connection, instance_id: str, paper_id: str, field: str, value: bytes) -> None:
+        """写入论文的一项数据（论文行不存在时创建）"""
+        conn.execute(
+            f"INSERT INTO papers (instance_id, paper_id, {field}) VALUES (?, ?, ?) "
+            f"ON CONFLICT (instance_id, paper_id) DO UPDATE SET {field} = excluded.{field}",
+            (instance_id, paper_id, value),
+        )
+
+    def add_paper_metadata(self, instance_id: str, paper_id: str, metadata: dict) -> None:
+        """
+        添加论文元数据
+            参数:
+                instance_id: 聊天实例id
+                paper_id: 论文id
+                metadata: 论文元数据（写入前按 PaperRecord 校验）
+            返回: None
+        """
+        with self._transaction() as conn:
+            self._set_paper_field(conn, instance_id, paper_id, "record", encode_record(metadata, PaperRecord))
+            self._bump_version(conn, instance_id)
+
+    def complete_paper_ingest(self, instance_id: str, paper_id: str, metadata: dict, structure: dict, adjacency: dict) -> None:
+        """
+        论文导入完成：论文结构、片段邻接索引与状态为ready的元数据在同一个事务中写入
+            参数:
+                instance_id: 聊天实例id
+                paper_id: 论文id
+                metadata: 论文元数据
+                structure: 论文结构
+                adjacency: 片段邻接索引
+            返回: None
+        """
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO papers (instance_id, paper_id, record, structure, adjacency) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (instance_id, paper_id) DO UPDATE SET record = excluded.record, "
+                "structure = excluded.structure, adjacency = excluded.adjacency",
+                (instance_id, paper_id, encode_record(metadata, PaperRecord), dumps(structure), dumps(adjacency)),
+            )
+            self._bump_version(conn, instance_id)
+
+    def remove_paper_metadata(self, instance_id: str, paper_id: str) -> None:
+        """
+        删除论文元数据及其摘要、路由向量、结构与邻接索引
+            参数:
+                instance_id: 聊天实例id
+                paper_id: 论文id
+            返回: None
+        """
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM papers WHERE instance_id = ? AND paper_id = ?", (instance_id, paper_id))
+            self._bump_version(conn, instance_id)
+
+    def get_paper_set_version(self, instance_id: str) -> int:
+        """
+        获取该实例论文集的版本号
+            参数:
+                instance_id: 聊天实例id
+            返回:
+                int: 版本号，从未添加过论文时为0
+        """
+        row = self._connect().execute(
+            "SELECT version FROM paper_versions WHERE instance_id = ?", (instance_id,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def _paper_records(self, instance_id: str, paper_id: str | None = None) -> dict[str, dict]:
+        """读取并解码该实例的论文元数据（指定paper_id时只读取一篇），旧格式的记录回写为当前版本"""
+        conn = self._connect()
+        sql = "SELECT paper_id, record FROM papers WHERE instance_id = ? AND record IS NOT NULL"
+        params: tuple = (instance_id,)
+        if paper_id is not None:
+            sql += " AND paper_id = ?"
+            params += (paper_id,)
+        papers = {}
+        for pid, value in conn.execute(sql, params).fetchall():
+            record, stale = decode_record(value, PaperRecord)
+            if record is None:
+                continue
+            if stale:
+                conn.execute(
+                    "UPDATE papers SET record = ? WHERE instance_id = ? AND paper_id = ?",
+                    (encode_record(record), instance_id, pid),
+                )
+            papers[pid] = record.to_dict()
+        return papers
+
+    def get_paper_metadata(self, instance_id: str, paper_id: str) -> dict | None:
+        """获取论文元数据"""
+        return self._paper_records(instance_id, paper_id).get(paper_id)
+
+    def list_paper_metadata(self, instance_id: str) -> list[dict]:
+        """获取该实例下所有论文的元数据"""
+        return list(self._paper_records(instance_id).values())
+
+    def list_paper_ids(self, instance_id: str) -> list[str]:
+        """获取该实例下所有论文的id"""
+        rows = self._connect().execute(
+            "SELECT paper_id FROM papers WHERE instance_id = ? AND record IS NOT NULL", (instance_id,)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    # ---------- 论文派生数据 ----------
+    def _get_paper_field(self, instance_id: str, paper_id: str, field: str) -> bytes | None:
+        row = self._connect().execute(
+            f"SELECT {field} FROM papers WHERE instance_id = ? AND paper_id = ?", (instance_id, paper_id)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _list_paper_field(self, instance_id: str, field: str) -> list[tuple[str, bytes]]:
+        return self._connect().execute(
+            f"SELECT paper_id, {field} FROM papers WHERE instance_id = ? AND {field} IS NOT NULL", (instance_id,)
+        ).fetchall()
+
+    def set_paper_digest(self, instance_id: str, paper_id: str, digest: dict) -> None:
+        """存储论文的分层摘要（章节摘要 + 全文摘要）"""
+        with self._transaction() as conn:
+            self._set_paper_field(conn, instance_id, paper_id, "digest", dumps(digest))
+
+    def get_paper_digest(self, instance_id: str, paper_id: str) -> dict | None:
+        """获取论文的分层摘要，尚未生成时返回None"""
+        return _json_or_none(self._get_paper_field(instance_id, paper_id, "digest"))
+
+    def list_paper_digests(self, instance_id: str) -> dict:
+        """获取该实例下所有论文的分层摘要 {paper_id: 分层摘要}"""
+        digests = {}
+        for paper_id, value in self._list_paper_field(instance_id, "digest"):
+            digest = _json_or_none(value)
+            if digest is not None:
+                digests[paper_id] = digest
+        return digests
+
+    def set_paper_structure(self, instance_id: str, paper_id: str, structure: dict) -> None:
+        """存储论文结构（章节标题、图表标题、摘要与参考文献的分块范围）"""
+        with self._transaction() as conn:
+            self._set_paper_field(conn, instance_id, paper_id, "structure", dumps(structure))
+
+    def get_paper_structure(self, instance_id: str, paper_id: str) -> dict | None:
+        """获取论文结构，旧论文没有结构时返回None"""
+        return _json_or_none(self._get_paper_field(instance_id, paper_id, "structure"))
+
+    def set_chunk_adjacency(self, instance_id: str, paper_id: str, adjacency: dict) -> None:
+        """存储论文的片段邻接索引"""
+        with self._transaction() as conn:
+            self._set_paper_field(conn, instance_id, paper_id, "adjacency", dumps(adjacency))
+
+    def get_chunk_adjacency(self, instance_id: str, paper_ids: list[str]) -> dict[str, dict]:
+        """
+        批量获取多篇论文的片段邻接索引（一次查询）
+            参数:
+                instance_id: 聊天实例id
+                paper_ids: 论文id列表
+            返回:
+                dict[str, dict]: {paper_id: 邻接索引}，旧论文没有邻接索引时不包含在结果中
+        """
+        if not paper_ids:
+            return {}
+        placeholders = ", ".join("?" * len(paper_ids))
+        rows = self._connect().execute(
+            f"SELECT paper_id, adjacency FROM papers WHERE instance_id = ? AND paper_id IN ({placeholders})",
+            (instance_id, *paper_ids),
+        ).fetchall()
+        adjacency = {}
+        for paper_id, value in rows:
+            parsed = _json_or_none(value)
+            if parsed is not None:
+                adjacency[paper_id] = parsed
+        return adjacency
+
+    def set_paper_route_vectors(self, instance_id: str, paper_id: str, vectors: bytes) -> None:
+        """存储论文的路由向量（float32字节）"""
+        with self._transaction() as conn:
+            self._set_paper_field(conn, instance_id, paper_id, "routes", vectors)
+
+    def list_paper_route_vectors(self, instance_id: str) -> dict[str, bytes]:
+        """获取该实例下所有论文的路由向量 {paper_id: float32 向量字节}"""
+        return {paper_id: bytes(value) for paper_id, value in self._list_paper_field(instance_id, "routes")}
+
+    # ---------- token用量 ----------
+    def record_usage(self, instance_id: str, input_tokens: int, output_tokens: int, backend: str = "") -> None:
+        """
+        记录一次LLM调用的token用量（累计值 + 当天汇总，超过保留天数的汇总同时删除）
+            参数:
+                instance_id: 聊天实例id
+                input_tokens: 输入token数
+                output_tokens: 输出token数
+                backend: 模型后端名称
+            返回: None
+        """
+        if not instance_id:
+            return
+        now = datetime.now()
+        fields = {"input_tokens": input_tokens, "output_tokens": output_tokens, "requests": 1}
+        if backend:
+            fields[f"tokens:{backend}"] = input_tokens + output_tokens
+        rows = [(instance_id, day, field, value) for day in ("", now.strftime("%Y%m%d")) for field, value in fields.items()]
+        expired = (now - timedelta(days=settings.USAGE_ROLLUP_TTL_DAYS)).strftime("%Y%m%d")
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO usage (instance_id, day, field, value) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (instance_id, day, field) DO UPDATE SET value = value + excluded.value",
+                rows,
+            )
+            conn.execute("DELETE FROM usage WHERE instance_id = ? AND day != '' AND day < ?", (instance_id, expired))
+
+    def get_usage(self, instance_id: str, day: str | None = None) -> dict:
+        """
+        获取token用量
+            参数:
+                instance_id: 聊天实例id
+                day: 日期（YYYYMMDD），为None时返回累计用量
+            返回:
+                dict: {"input_tokens", "output_tokens", "requests", "tokens:<后端>"...}
+        """
+        usage = {"input_tokens": 0, "output_tokens": 0, "requests": 0}
+        rows = self._connect().execute(
+            "SELECT field, value FROM usage WHERE instance_id = ? AND day = ?", (instance_id, day or "")
+        ).fetchall()
+        usage.update(dict(rows))
+        return usage
+
+
+class SqliteChatMessageHistory(BaseChatMessageHistory):
+    """
+    SQLite后端的历史消息客户端
+        消息按位置保存在 messages 表中，位置即消息按时间顺序的序号；
+        一轮对话的消息、存储统计与实例的最后活动时间在一个事务中写入
+    """
+
+    def __init__(self, session_id: str, storage: SqliteStorageService):
+        self.session_id = session_id
+        self.storage = storage
+
+    @property
+    def messages(self) -> list[BaseMessage]:
+        """全部历史消息，按时间顺序排列"""
+        return self.get_range(0, self.count())
+
+    def add_message(self, message: BaseMessage) -> None:
+        """添加一条消息"""
+        self.add_messages([message])
+
+    def add_messages(self, messages: list[BaseMessage], activity_time: str | None = None) -> None:
+        """
+        添加一组消息（压缩后写入），所有写操作在一个事务中提交
+            参数:
+                messages: 按时间顺序排列的消息
+                activity_time: 实例的最后活动时间，传入时一并更新
+        """
+        encoded = [encode_message(message) for message in messages]
+        with self.storage._transaction() as conn:
+            start = conn.execute(
+                "SELECT COALESCE(MAX(position) + 1, 0) FROM messages WHERE instance_id = ?", (self.session_id,)
+            ).fetchone()[0]
+            conn.executemany(
+                "INSERT INTO messages (instance_id, position, payload) VALUES (?, ?, ?)",
+                [(self.session_id, start + offset, payload) for offset, (payload, _) in enumerate(encoded)],
+            )
+            conn.execute(
+                "INSERT INTO message_stats (instance_id, raw_bytes, stored_bytes) VALUES (?, ?, ?) "
+                "ON CONFLICT (instance_id) DO UPDATE SET raw_bytes = raw_bytes + excluded.raw_bytes, "
+                "stored_bytes = stored_bytes + excluded.stored_bytes",
+                (
+                    self.session_id,
+                    sum(raw_size for _, raw_size in encoded),
+                    sum(len(payload) for payload, _ in encoded),
+                ),
+            )
+            if activity_time:
+                self.storage._touch(conn, self.session_id, activity_time)
+
+    def count(self) -> int:
+        """历史消息总条数"""
+        return self.storage._connect().execute(
+            "SELECT COALESCE(MAX(position) + 1, 0) FROM messages WHERE instance_id = ?", (self.session_id,)
+        ).fetchone()[0]
+
+    def get_range(self, start: int, stop: int) -> list[BaseMessage]:
+        """
+        按位置读取一段历史消息
+            参数:
+                start: 起始位置（包含）
+                stop: 结束位置（不包含）
+            返回:
+                list[BaseMessage]: 按时间顺序排列的消息
+        """
+        if stop <= start:
+            return []
+        rows = self.storage._connect().execute(
+            "SELECT payload FROM messages WHERE instance_id = ? AND position >= ? AND position < ? ORDER BY position",
+            (self.session_id, start, stop),
+        ).fetchall()
+        return messages_from_dict([decode_payload(row[0]) for row in rows])
+
+    def clear(self) -> None:
+        """删除全部历史消息"""
+        with self.storage._transaction() as conn:
+            conn.execute("DELETE FROM messages WHERE instance_id = ?", (self.session_id,))
+            conn.execute("DELETE FROM message_stats WHERE instance_id = ?", (self.session_id,))
+
+    def storage_stats(self) -> dict:
+        """
+        历史消息的存储统计（字段与redis后端一致，sqlite后端没有归档）
+            返回:
+                dict: messages、archived_messages、raw_bytes、stored_bytes、archived_bytes、saved_bytes
+        """
+        row = self.storage._connect().execute(
+            "SELECT raw_bytes, stored_bytes FROM message_stats WHERE instance_id = ?", (self.session_id,)
+        ).fetchone()
+        raw_bytes, stored_bytes = row or (0, 0)
+        return {
+            "messages": self.count(),
+            "archived_messages": 0,
+            "raw_bytes": raw_bytes,
+            "stored_bytes": stored_bytes,
+            "archived_bytes": 0,
+            "saved_bytes": max(0, raw_bytes - stored_bytes),
+        }
+
+
+class SqliteChatHistoryStore(ChatHistoryStore):
+    def __init__(self, storage: SqliteStorageService, max_clients: int | None = None) -> None:
+        # 客户端不持有连接，只按最近使用顺序缓存以避免重复创建
+        self.storage = storage
+        self._clients: OrderedDict[str, SqliteChatMessageHistory] = OrderedDict()
+        self._max_clients = max_clients or settings.HISTORY_CLIENT_CACHE_SIZE
+        self._lock = threading.Lock()
+
+    def get_chat_message_history_client(self, instance_id: str) -> SqliteChatMessageHistory:
+        """根据实例id获取该实例的历史消息客户端"""
+        with self._lock:
+            client = self._clients.get(instance_id)
+            if client is not None:
+                self._clients.move_to_end(instance_id)
+                return client
+            client = SqliteChatMessageHistory(instance_id, self.storage)
+            self._clients[instance_id] = client
+            while len(self._clients) > self._max_clients:
+                self._clients.popitem(last=False)
+            return client
@@ -0,0 +1,194 @@
+from abc import ABC, abstractmethod
+from datetime import datetime
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+
+from app.utils.serialization import InstanceRecord
+
+# 可选的存储后端（settings.STORAGE_BACKEND）
+BACKEND_REDIS = "redis"
+BACKEND_SQLITE = "sqlite"
+
+
+class StorageService(ABC):
+    """
+    实例与论文数据的存储接口
+        redis后端（RedisService）：多进程部署，需要redis服务
+        sqlite后端（SqliteStorageService）：单机部署，数据保存在本地文件中，不需要redis服务与网络往返
+    """
+
+    # ---------- 聊天实例 ----------
+    @abstractmethod
+    def add_instance(self, instance_id: str, instance: InstanceRecord | dict):
+        """添加（或覆盖）一个聊天实例记录"""
+
+    @abstractmethod
+    def get_instance(self, instance_id: str) -> InstanceRecord | None:
+        """获取聊天实例记录"""
+
+    @abstractmethod
+    def remove_instance(self, instance_id: str):
+        """删除聊天实例记录与所有依赖的数据（历史消息、论文数据、用量等）"""
+
+    @abstractmethod
+    def touch_instance(self, instance_id: str, activity_time: str) -> None:
+        """记录实例的最后活动时间"""
+
+    @abstractmethod
+    def list_instance_index(self) -> list[dict]:
+        """轻量的实例索引：[{"id", "name", "created_at", "message_count", "last_activity"}]"""
+
+    @abstractmethod
+    def rename_instance(self, instance_id: str, new_id: str):
+        """修改实例id，实例记录与所有依赖的数据一起迁移"""
+
+    def exists_instance(self, instance_id: str) -> bool:
+        return self.get_instance(instance_id) is not None
+
+    def get_all_instances(self):
+        """
+        获取所有聊天实例，并进行解析为ChatInstance对象\n
+        return :ChatInstance对象列表
+        """
+        from app.models.chat import ChatInstance
+        return [ChatInstance.from_index(item) for item in self.list_instance_index()]
+
+    def get_all_instances_list(self) -> list[str]:
+        """获取所有实例id列表"""
+        return [item["id"] for item in self.list_instance_index()]
+
+    # ---------- 论文元数据 ----------
+    @abstractmethod
+    def add_paper_metadata(self, instance_id: str, paper_id: str, metadata: dict) -> None:
+        """写入论文元数据，论文集版本号自增"""
+
+    @abstractmethod
+    def complete_paper_ingest(self, instance_id: str, paper_id: str, metadata: dict, structure: dict, adjacency: dict) -> None:
+        """论文导入完成：结构、邻接索引与就绪状态的元数据原子写入"""
+
+    @abstractmethod
+    def remove_paper_metadata(self, instance_id: str, paper_id: str) -> None:
+        """删除论文元数据及其摘要、路由向量、结构与邻接索引"""
+
+    @abstractmethod
+    def get_paper_set_version(self, instance_id: str) -> int:
+        """论文集版本号，从未添加过论文时为0"""
+
+    @abstractmethod
+    def get_paper_metadata(self, instance_id: str, paper_id: str) -> dict | None:
+        """获取论文元数据（副本）"""
+
+    @abstractmethod
+    def list_paper_metadata(self, instance_id: str) -> list[dict]:
+        """获取该实例下所有论文的元数据（副本）"""
+
+    @abstractmethod
+    def list_paper_ids(self, instance_id: str) -> list[str]:
+        """获取该实例下所有论文的id"""
+
+    # ---------- 论文派生数据 ----------
+    @abstractmethod
+    def set_paper_digest(self, instance_id: str, paper_id: str, digest: dict) -> None:
+        """存储论文的分层摘要"""
+
+    @abstractmethod
+    def get_paper_digest(self, instance_id: str, paper_id: str) -> dict | None:
+        """获取论文的分层摘要"""
+
+    @abstractmethod
+    def list_paper_digests(self, instance_id: str) -> dict:
+        """获取该实例下所有论文的分层摘要 {paper_id: 分层摘要}"""
+
+    @abstractmethod
+    def set_paper_structure(self, instance_id: str, paper_id: str, structure: dict) -> None:
+        """存储论文结构"""
+
+    @abstractmethod
+    def get_paper_structure(self, instance_id: str, paper_id: str) -> dict | None:
+        """获取论文结构"""
+
+    @abstractmethod
+    def set_chunk_adjacency(self, instance_id: str, paper_id: str, adjacency: dict) -> None:
+        """存储论文的片段邻接索引"""
+
+    @abstractmethod
+    def get_chunk_adjacency(self, instance_id: str, paper_ids: list[str]) -> dict[str, dict]:
+        """批量获取多篇论文的片段邻接索引"""
+
+    @abstractmethod
+    def set_paper_route_vectors(self, instance_id: str, paper_id: str, vectors: bytes) -> None:
+        """存储论文的路由向量（float32字节）"""
+
+    @abstractmethod
+    def list_paper_route_vectors(self, instance_id: str) -> dict[str, bytes]:
+        """获取该实例下所有论文的路由向量"""
+
+    # ---------- token用量 ----------
+    @abstractmethod
+    def record_usage(self, instance_id: str, input_tokens: int, output_tokens: int, backend: str = "") -> None:
+        """记录一次LLM调用的token用量（累计值 + 当天汇总）"""
+
+    @abstractmethod
+    def get_usage(self, instance_id: str, day: str | None = None) -> dict:
+        """获取token用量，day为None时返回累计用量"""
+
+    def get_today_usage_tokens(self, instance_id: str) -> int:
+        """获取该实例当天已使用的token总数"""
+        usage = self.get_usage(instance_id, datetime.now().strftime("%Y%m%d"))
+        return usage["input_tokens"] + usage["output_tokens"]
+
+
+class ChatHistoryStore(ABC):
+    """
+    历史消息的存储接口
+        get_chat_message_history_client 返回的客户端需要提供：
+        add_message / add_messages / messages / count / get_range / clear / storage_stats
+    """
+
+    @abstractmethod
+    def get_chat_message_history_client(self, instance_id: str):
+        """根据实例id获取该实例的历史消息客户端"""
+
+    def count_messages(self, instance_id: str) -> int:
+        """获取实例的历史消息条数"""
+        return self.get_chat_message_history_client(instance_id).count()
+
+    def get_message_range(self, instance_id: str, start: int, stop: int) -> list[BaseMessage]:
+        """
+        按位置读取一段历史消息（位置按时间顺序从0开始）
+            参数:
+                instance_id: 聊天实例id
+                start: 起始位置（包含）
+                stop: 结束位置（不包含）
+            返回:
+                list[BaseMessage]: 按时间顺序排列的消息
+        """
+        return self.get_chat_message_history_client(instance_id).get_range(start, stop)
+
+    def get_recent_messages(self, instance_id: str, limit: int) -> list[BaseMessage]:
+        """获取实例最近的 limit 条历史消息"""
+        client = self.get_chat_message_history_client(instance_id)
+        total = client.count()
+        return client.get_range(max(0, total - limit), total)
+
+    def add_user_ai_message(self, chat_message_history_client, user_message, ai_message, message_type, message_time):
+        """
+        添加一轮对话：用户消息、AI消息与实例的最后活动时间一次写入
+            参数:
+                chat_message_history_client: 历史消息客户端
+                user_message: 用户消息
+                ai_message: AI回复
+                message_type: 消息类型
+                message_time: 消息时间
+        """
+        additional_kwargs = {
+            "message_type": message_type,
+            "message_time": message_time,
+        }
+        chat_message_history_client.add_messages(
+            [
+                HumanMessage(content=user_message, additional_kwargs=additional_kwargs),
+                AIMessage(content=ai_message, additional_kwargs=additional_kwargs),
+            ],
+            activity_time=message_time or datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        )
@@ -0,0 +1,120 @@
+import asyncio
+import re
+from typing import AsyncIterator, Awaitable, Callable, Hashable
+
+
+class _Flight:
+    """一次正在进行中的流式生成，以及它已产生的全部片段"""
+
+    def __init__(self):
+        self.chunks: list[str] = []
+        self.done = False
+        self.error: BaseException | None = None
+        self.changed = asyncio.Condition()
+        self.subscribers = 0
+        self.task: asyncio.Task | None = None
+        # 驱动方写入的附加信息（如本次生成产生的token用量），生成结束后交给合并进来的订阅者
+        self.meta: dict = {}
+
+
+class StreamCoalescer:
+    """
+    相同问题的流式回复合并（single-flight）
+        第一个请求负责驱动LLM流式生成，后续相同key的请求订阅同一个扇出缓冲区：
+        先重放已生成的片段，再继续接收新片段，用户感知到的仍是正常的流式输出。
+        所有方法都在 async_runner 的后台事件循环中执行，因此无需加锁。
+    """
+
+    def __init__(self):
+        self._flights: dict[Hashable, _Flight] = {}
+        # 统计指标
+        self.flights_total = 0
+        self.coalesced_total = 0
+
+    @staticmethod
+    def normalize_question(question: str) -> str:
+        """
+        问题归一化：转小写、合并空白、去掉结尾标点
+            参数:
+                question: 用户问题
+            返回:
+                str: 归一化后的问题
+        """
+        text = re.sub(r"\s+", " ", question.strip().lower())
+        return text.rstrip("?？。.!！~～ ")
+
+    async def stream(self, key: Hashable, factory: Callable[[dict], AsyncIterator[str]],
+                     on_shared: Callable[[dict], Awaitable[None]] | None = None) -> AsyncIterator[str]:
+        """
+        订阅key对应的流式生成，不存在时调用factory创建并驱动
+            参数:
+                key: 合并key（相同key的请求共享一次生成）
+                factory: 创建真实流式生成器的函数，参数为该次生成的附加信息字典（驱动方写入）
+                on_shared: 合并进已有生成的订阅者在生成成功结束后调用，参数为附加信息字典
+            返回:
+                AsyncIterator[str]: 流式响应内容
+        """
+        flight = self._flights.get(key)
+        joined = flight is not None
+        if flight is None:
+            flight = _Flight()
+            self._flights[key] = flight
+            flight.task = asyncio.create_task(self._drive(key, flight, factory(flight.meta)))
+            self.flights_total += 1
+        else:
+            self.coalesced_total += 1
+        flight.subscribers += 1
+        index = 0
+        try:
+            while True:
+                async with flight.changed:
+                    await flight.changed.wait_for(lambda: len(flight.chunks) > index or flight.done)
+                # 重放/转发尚未发送给该订阅者的片段
+                while index < len(flight.chunks):
+                    yield flight.chunks[index]
+                    index += 1
+                if flight.done and index >= len(flight.chunks):
+                    if flight.error is not None:
+                        raise flight.error
+                    if joined and on_shared is not None:
+                        await on_shared(flight.meta)
+                    return
+        finally:
+            flight.subscribers -= 1
+            # 所有订阅者都已离开：取消上游生成，后续相同请求重新发起
+            if flight.subscribers == 0 and not flight.done:
+                self._forget(key, flight)
+                flight.task.cancel()
+
+    def _forget(self, key: Hashable, flight: _Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    async def _drive(self, key: Hashable, flight: _Flight, agen: AsyncIterator[str]) -> None:
+        """驱动真实的流式生成，并将片段写入扇出缓冲区"""
+        try:
+            async for chunk in agen:
+                flight.chunks.append(chunk)
+                async with flight.changed:
+                    flight.changed.notify_all()
+        except asyncio.CancelledError:
+            flight.error = RuntimeError("stream cancelled")
+        except Exception as exc:
+            flight.error = exc
+        finally:
+            flight.done = True
+            # 生成结束后立即移除，只合并进行中的请求，不缓存已完成的回答
+            self._forget(key, flight)
+            async with flight.changed:
+                flight.changed.notify_all()
+
+    def stats(self) -> dict:
+        """获取合并统计：进行中数量、累计生成次数、累计被合并的请求数"""
+        return {
+            "in_flight": len(self._flights),
+            "flights_total": self.flights_total,
+            "coalesced_total": self.coalesced_total,
+        }
+
+
+stream_coalescer = StreamCoalescer()
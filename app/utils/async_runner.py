@@ -0,0 +1,90 @@
+import asyncio
+import queue
+import threading
+from typing import Any, AsyncIterator, Awaitable, Iterator
+
+
+class AsyncRunner:
+    """
+    后台事件循环运行器
+        进程内只启动一个常驻事件循环线程，所有异步LLM调用都在该循环上执行；
+        Streamlit 的会话线程通过 run / iterate 以同步方式使用异步接口
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """获取后台事件循环，首次访问时启动事件循环线程"""
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    self._thread = threading.Thread(
+                        target=self._run_loop,
+                        args=(loop,),
+                        name="async-runner",
+                        daemon=True,
+                    )
+                    self._thread.start()
+                    self._loop = loop
+        return self._loop
+
+    def _run_loop(self, loop: asyncio.AbstractEventLoop) -> None:
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+
+    def run(self, coro: Awaitable, timeout: float | None = None) -> Any:
+        """
+        在后台事件循环中执行协程，并同步等待结果
+            参数:
+                coro: 协程对象
+                timeout: 等待超时时间（秒）
+            返回:
+                协程的返回值
+        """
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        return future.result(timeout)
+
+    def iterate(self, agen: AsyncIterator) -> Iterator:
+        """
+        将异步生成器转换为同步生成器（供 st.write_stream 使用）
+            调用方提前结束迭代时，会取消后台的异步生成器，释放上游连接
+            参数:
+                agen: 异步生成器
+            返回:
+                Iterator: 同步生成器
+        """
+        items: queue.Queue = queue.Queue()
+
+        async def _pump():
+            try:
+                async for item in agen:
+                    items.put((False, item))
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                items.put((True, exc))
+            else:
+                items.put((True, None))
+            finally:
+                await agen.aclose()
+
+        future = asyncio.run_coroutine_threadsafe(_pump(), self.loop)
+        try:
+            while True:
+                done, value = items.get()
+                if done:
+                    if value is not None:
+                        raise value
+                    return
+                yield value
+        finally:
+            if not future.done():
+                future.cancel()
+
+
+async_runner = AsyncRunner()
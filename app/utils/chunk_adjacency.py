@@ -0,0 +1,98 @@
+import re
+
+# 句末标点（中英文）
+_SENTENCE_END = re.compile(r"[.!?。！？]['\"”’)）]?\s")
+_ENDING_CHARS = ".!?:;\"')]。！？：；”）"
+_CONTINUATION_CHARS = ",;:)]，；：）、"
+
+
+def chunk_id(paper_id: str, chunk: int) -> str:
+    """片段id：与向量库中的id一致（paper_id:分块号）"""
+    return f"{paper_id}:{chunk}"
+
+
+def build_adjacency(splits: list) -> dict:
+    """
+    导入时构建论文的片段邻接索引
+        参数:
+            splits: 按分块号排序的片段列表（同一篇论文，metadata 中有 start_index）
+        返回:
+            dict: {分块号: {"prev", "next", "page", "start", "end"}}，prev/next 为相邻片段id，
+                start/end 为片段在所在页中的字符偏移
+    """
+    adjacency = {}
+    for position, doc in enumerate(splits):
+        metadata = doc.metadata
+        paper_id = metadata.get("paper_id")
+        chunk = metadata.get("chunk", position)
+        start = metadata.get("start_index")
+        adjacency[str(chunk)] = {
+            "prev": chunk_id(paper_id, splits[position - 1].metadata.get("chunk")) if position > 0 else None,
+            "next": chunk_id(paper_id, splits[position + 1].metadata.get("chunk")) if position + 1 < len(splits) else None,
+            "page": metadata.get("page"),
+            "start": start,
+            "end": start + len(doc.page_content) if isinstance(start, int) else None,
+        }
+    return adjacency
+
+
+def starts_mid_sentence(text: str) -> bool:
+    """片段是否从句子中间开始（小写字母或逗号等接续符号开头）"""
+    text = text.lstrip()
+    return bool(text) and (text[0].islower() or text[0] in _CONTINUATION_CHARS)
+
+
+def ends_mid_sentence(text: str) -> bool:
+    """片段是否在句子中间结束"""
+    text = text.rstrip()
+    return bool(text) and text[-1] not in _ENDING_CHARS
+
+
+def _unique_part(entry: dict, text: str, other: dict, before: bool) -> str:
+    """去掉相邻片段与当前片段的重叠部分（同一页且有字符偏移时）"""
+    if entry.get("page") != other.get("page") or entry.get("start") is None or other.get("start") is None:
+        return text
+    if before:
+        cut = entry["start"] - other["start"]
+        return text[:cut] if 0 < cut <= len(text) else text
+    overlap = other["end"] - entry["start"] if other.get("end") is not None else 0
+    return text[overlap:] if 0 < overlap < len(text) else text
+
+
+def leading_context(prev_text: str, prev_entry: dict, entry: dict, max_chars: int) -> str:
+    """
+    取前一片段末尾、从句子开头起的一段文字，补全当前片段开头被截断的句子
+        参数:
+            prev_text: 前一片段文本
+            prev_entry: 前一片段的邻接信息
+            entry: 当前片段的邻接信息
+            max_chars: 最多补充的字符数
+        返回:
+            str: 补充的文字
+    """
+    text = _unique_part(entry, prev_text, prev_entry, before=True)[-max_chars:]
+    match = _SENTENCE_END.search(text)
+    if match:
+        return text[match.end():]
+    space = text.find(" ")
+    return text[space + 1:] if space >= 0 else text
+
+
+def trailing_context(next_text: str, next_entry: dict, entry: dict, max_chars: int) -> str:
+    """
+    取后一片段开头、到句子结尾为止的一段文字，补全当前片段结尾被截断的句子
+        参数:
+            next_text: 后一片段文本
+            next_entry: 后一片段的邻接信息
+            entry: 当前片段的邻接信息
+            max_chars: 最多补充的字符数
+        返回:
+            str: 补充的文字
+    """
+    # 后一片段的开头与当前片段结尾重叠，按当前片段的结束偏移去掉重叠部分
+    text = _unique_part(next_entry, next_text, entry, before=False)[:max_chars]
+    ends = list(_SENTENCE_END.finditer(text + " "))
+    if ends:
+        return text[:ends[0].end()].rstrip()
+    space = text.rfind(" ")
+    return text[:space] if space > 0 else text
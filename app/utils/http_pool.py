@@ -0,0 +1,60 @@
+import threading
+
+import httpx
+
+from config.settings import settings
+
+
+class HttpPool:
+    """
+    进程级共享的HTTP连接池
+        所有 ChatOpenAI 客户端共用同一个同步/异步 httpx 客户端，
+        多个 Streamlit 会话的请求复用少量保活连接，而不是每个客户端各自建立连接
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._client: httpx.Client | None = None
+        self._async_client: httpx.AsyncClient | None = None
+
+    def _limits(self) -> httpx.Limits:
+        """
+        构建连接池限制参数
+            返回：
+                httpx.Limits: 最大连接数、最大保活连接数、保活过期时间
+        """
+        return httpx.Limits(
+            max_connections=settings.HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+        )
+
+    def get_client(self) -> httpx.Client:
+        """
+        获取共享的同步HTTP客户端（首次调用时创建）
+        """
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = httpx.Client(
+                        limits=self._limits(),
+                        timeout=settings.HTTP_TIMEOUT,
+                    )
+        return self._client
+
+    def get_async_client(self) -> httpx.AsyncClient:
+        """
+        获取共享的异步HTTP客户端（首次调用时创建）
+            注意：异步客户端只能在 async_runner 的后台事件循环中使用
+        """
+        if self._async_client is None:
+            with self._lock:
+                if self._async_client is None:
+                    self._async_client = httpx.AsyncClient(
+                        limits=self._limits(),
+                        timeout=settings.HTTP_TIMEOUT,
+                    )
+        return self._async_client
+
+
+http_pool = HttpPool()
@@ -1,36 +1,175 @@
-import datetime
-from time import sleep 
+import atexit
+import logging
+import logging.handlers
+import queue
+import random
+import threading
+from time import sleep
 import time
 
+from config.settings import settings
+
+
+# ======================================================== 日志系统 ========================================================
+
+_setup_lock = threading.Lock()
+_listener: logging.handlers.QueueListener | None = None
+
+# 应用日志的根logger名称，所有模块的logger都挂在它下面
+ROOT_LOGGER_NAME = "paper_ai"
+
+
+def setup_logging() -> None:
+    """
+    初始化日志系统（只执行一次）
+        1. 业务线程只把日志记录放入内存队列（QueueHandler），不做任何IO
+        2. 后台线程（QueueListener）负责格式化并写入控制台与日志文件
+        3. 日志级别由 settings.LOG_LEVEL 控制
+    """
+    global _listener
+    if _listener is not None:
+        return
+    with _setup_lock:
+        if _listener is not None:
+            return
+        formatter = logging.Formatter(
+            "%(asctime)s %(levelname)s [%(name)s] %(message)s",
+            datefmt="%Y-%m-%d %H:%M:%S",
+        )
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(formatter)
+        file_handler = logging.handlers.RotatingFileHandler(
+            settings.LOG_FILE,
+            maxBytes=settings.LOG_FILE_MAX_BYTES,
+            backupCount=settings.LOG_FILE_BACKUP_COUNT,
+            encoding="utf-8",
+        )
+        file_handler.setFormatter(formatter)
+
+        log_queue: queue.Queue = queue.Queue(-1)
+        root_logger = logging.getLogger(ROOT_LOGGER_NAME)
+        root_logger.setLevel(settings.LOG_LEVEL)
+        root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        root_logger.propagate = False
+
+        listener = logging.handlers.QueueListener(
+            log_queue, console_handler, file_handler, respect_handler_level=True
+        )
+        listener.start()
+        # 进程退出前把队列中剩余的日志写完
+        atexit.register(listener.stop)
+        _listener = listener
+
+
+def get_file_logger(name: str, path, max_bytes: int, backup_count: int) -> logging.Logger:
+    """
+    获取只写入单独文件的logger（原样写入消息，用于链路追踪等结构化记录）
+        与应用日志相同：调用方只把记录放入内存队列，由后台线程写入按大小轮转的文件
+        参数:
+            name: logger名称（不挂在应用根logger下，不输出到控制台与应用日志）
+            path: 文件路径
+            max_bytes: 单个文件的最大字节数
+            backup_count: 保留的历史文件数
+        返回:
+            logging.Logger: logger对象
+    """
+    logger = logging.getLogger(name)
+    with _setup_lock:
+        if logger.handlers:
+            return logger
+        file_handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+        )
+        file_handler.setFormatter(logging.Formatter("%(message)s"))
+        record_queue: queue.Queue = queue.Queue(-1)
+        logger.setLevel(logging.INFO)
+        logger.addHandler(logging.handlers.QueueHandler(record_queue))
+        logger.propagate = False
+        listener = logging.handlers.QueueListener(record_queue, file_handler)
+        listener.start()
+        atexit.register(listener.stop)
+    return logger
+
+
+def get_logger(name: str) -> logging.Logger:
+    """
+    获取模块logger
+        参数:
+            name: 模块名称，例如 ai_service
+        返回:
+            logging.Logger: 挂在应用根logger下的logger
+    """
+    setup_logging()
+    return logging.getLogger(f"{ROOT_LOGGER_NAME}.{name}")
+
+
+class Truncated:
+    """
+    延迟格式化的截断文本
+        只有日志真正输出时才会调用 str()，并截断到 limit 个字符，避免大段文本的格式化开销
+    """
+
+    __slots__ = ("value", "limit")
+
+    def __init__(self, value, limit: int | None = None):
+        self.value = value
+        self.limit = limit or settings.LOG_PAYLOAD_MAX_CHARS
+
+    def __str__(self) -> str:
+        text = str(self.value)
+        if len(text) <= self.limit:
+            return text
+        return f"{text[:self.limit]}...(共{len(text)}字符)"
+
+    __repr__ = __str__
+
+
+def debug_payload(logger: logging.Logger, msg: str, *args) -> None:
+    """
+    采样输出大段调试载荷（检索文档、上下文、提示词等）
+        1. 未开启DEBUG级别时直接返回，不做任何格式化
+        2. 按 settings.LOG_PAYLOAD_SAMPLE_RATE 采样
+        3. 参数延迟截断后再输出
+        参数:
+            logger: logger对象
+            msg: %格式的日志模板
+            args: 日志参数
+    """
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    if random.random() >= settings.LOG_PAYLOAD_SAMPLE_RATE:
+        return
+    logger.debug(msg, *(Truncated(arg) for arg in args))
+
+
 def time_decorator(func):
     """
     装饰器：记录函数调用时间
     """
+    logger = get_logger("timer")
+
     def wrapper(*args, **kwargs):
         # 记录调用信息
         start_time =time.time()
-        call_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        print(f"【日志】开始时间：{call_time} - 函数 {func.__name__} 被调用，参数：args={args}, kwargs={kwargs}")
-        
+        logger.debug("函数 %s 被调用，参数：args=%s, kwargs=%s", func.__name__, Truncated(args), Truncated(kwargs))
+
         # 调用原函数
         result = func(*args, **kwargs)
 
-        call_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-        # 记录返回结果
-        # print(f"【日志】函数 {func.__name__} 返回值：{result}")
+        # 记录执行时长
         end_time =time.time()
-        print(f'【日志】结束时间：{call_time} 执行时长：{(end_time-start_time)}秒',)
-          
+        logger.info("函数 %s 执行时长：%.3f秒", func.__name__, end_time - start_time)
+
         return result
     return wrapper
 
 @time_decorator
 def test1():
     #睡眠5s
-    print('开始')
+    logger = get_logger("timer")
+    logger.info('开始')
     sleep(5)
-    print('结束')
+    logger.info('结束')
 
 
 if __name__ == '__main__':
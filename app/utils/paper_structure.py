@@ -0,0 +1,195 @@
+import re
+
+# 常见的论文一级标题（英文），可带编号
+_NAMED_HEADING = re.compile(
+    r"^(?:(\d+(?:\.\d+)*)\.?\s+)?(abstract|introduction|background|related work|preliminaries|"
+    r"method(?:s|ology)?|approach|experiments?|experimental setup|evaluation|results?|discussion|"
+    r"limitations?|conclusions?(?: and future work)?|future work|references|bibliography|"
+    r"acknowledg(?:e)?ments?|appendix(?:\s+[A-Z])?)\s*$",
+    re.IGNORECASE,
+)
+# 带编号的标题："3 Method"、"3.2 Training Details"
+_NUMBERED_HEADING = re.compile(r"^(\d{1,2}(?:\.\d{1,2}){0,3})\.?\s+([A-Z][A-Za-z0-9\-,:&()/\s]{2,80})$")
+# 中文标题："3.2 训练细节"
+_CHINESE_HEADING = re.compile(r"^(\d{1,2}(?:\.\d{1,2}){0,3})\s*([\u4e00-\u9fff][^\s]{1,20})$")
+# 参考文献、摘要章节
+_REFERENCES_TITLE = re.compile(r"references|bibliography|\u53c2\u8003\u6587\u732e", re.IGNORECASE)
+_ABSTRACT_TITLE = re.compile(r"abstract|\u6458\u8981", re.IGNORECASE)
+# 图表标题：行首的 "Figure 2:"、"Fig. 3."、"Table 1"、"图2"、"表1"
+_CAPTION = re.compile(
+    r"^(fig(?:ure)?\.?|table|\u56fe|\u8868)\s*(\d{1,3})\s*([.:：]?)",
+    re.IGNORECASE,
+)
+
+# 问题中的结构引用
+_PAGE_REF = re.compile(r"\bpage\s+(\d{1,4})\b|\bp\.\s*(\d{1,4})\b|\u7b2c\s*(\d{1,4})\s*\u9875", re.IGNORECASE)
+_SECTION_REF = re.compile(
+    r"\b(?:section|sec\.|§)\s*(\d{1,2}(?:\.\d{1,2}){0,3})\b|"
+    r"\u7b2c\s*(\d{1,2}(?:\.\d{1,2}){0,3})\s*[\u8282\u7ae0]|"
+    r"(\d{1,2}(?:\.\d{1,2}){1,3})\s*[\u8282\u5c0f]",
+    re.IGNORECASE,
+)
+_CAPTION_REF = re.compile(r"\b(fig(?:ure)?\.?|table|tab\.)\s*(\d{1,3})\b|([\u56fe\u8868])\s*(\d{1,3})", re.IGNORECASE)
+
+KIND_ABSTRACT = "abstract"
+KIND_BODY = "body"
+KIND_REFERENCES = "references"
+
+
+def _caption_label(kind: str, number: str) -> str:
+    """统一图表标签：figure 2 / table 1"""
+    kind = kind.lower()
+    if kind.startswith("fig") or kind == "图":
+        return f"figure {int(number)}"
+    return f"table {int(number)}"
+
+
+def _match_heading(line: str) -> tuple[str, str] | None:
+    """识别标题行，返回 (编号, 标题)，编号可能为空"""
+    text = line.strip()
+    if not 3 <= len(text) <= 90 or text.endswith((".", ",", ";")):
+        return None
+    match = _NAMED_HEADING.match(text)
+    if match:
+        return match.group(1) or "", match.group(2)
+    for pattern in (_NUMBERED_HEADING, _CHINESE_HEADING):
+        match = pattern.match(text)
+        if match and len(match.group(2).split()) <= 12:
+            return match.group(1), match.group(2).strip()
+    return None
+
+
+def extract_structure(splits: list) -> dict:
+    """
+    导入时提取论文结构，并在片段元数据中写入所属章节（section）与章节类型（section_kind）
+        1. 章节标题：编号、标题、起止分块号、起始页
+        2. 摘要与参考文献的分块范围（参考文献不参与普通检索）
+        3. 图表标题：标签（figure 2 / table 1）、所在分块与页码
+        参数:
+            splits: 按分块号排序的片段列表（同一篇论文）
+        返回:
+            dict: {"sections", "captions", "abstract", "references", "chunk_pages"}，
+                页码与片段元数据一致（从0开始）
+    """
+    sections: list[dict] = []
+    captions: dict[str, dict] = {}
+    seen_headings: set[tuple[str, str]] = set()
+    chunk_pages: list = []
+    kind = KIND_BODY
+    current = None
+    for doc in splits:
+        chunk = doc.metadata.get("chunk", len(chunk_pages))
+        page = doc.metadata.get("page")
+        chunk_pages.append(page)
+        # 片段中是否有参考文献之外的正文（正文与参考文献混合的片段仍参与检索）
+        has_body = False
+        for line in doc.page_content.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            heading = _match_heading(line)
+            # 片段之间有重叠，同一标题只记录第一次出现的位置
+            if heading and heading not in seen_headings:
+                seen_headings.add(heading)
+                number, title = heading
+                if current is not None:
+                    # 标题之前的文字仍属于上一章节
+                    current["chunk_end"] = chunk
+                current = {"no": number, "title": title, "chunk_start": chunk, "chunk_end": chunk, "page": page}
+                sections.append(current)
+                if _REFERENCES_TITLE.search(title):
+                    kind = KIND_REFERENCES
+                elif _ABSTRACT_TITLE.search(title):
+                    kind = KIND_ABSTRACT
+                else:
+                    kind = KIND_BODY
+                continue
+            # 参考文献中出现的 "Table 1" 等不是图表标题
+            if kind != KIND_REFERENCES:
+                has_body = True
+                match = _CAPTION.match(line)
+                if match:
+                    label = _caption_label(match.group(1), match.group(2))
+                    formal = bool(match.group(3))
+                    # 带冒号/句点的标题行优先，正文行首的 "Table 2 shows" 只在没有标题行时使用
+                    existing = captions.get(label)
+                    if existing is None or (formal and not existing["formal"]):
+                        captions[label] = {
+                            "label": label, "text": line[:160], "chunk": chunk, "page": page, "formal": formal,
+                        }
+        if current is not None:
+            current["chunk_end"] = chunk
+        doc.metadata["section"] = current["title"] if current else ""
+        doc.metadata["section_kind"] = KIND_BODY if kind == KIND_REFERENCES and has_body else kind
+
+    def _range(pattern) -> list[int] | None:
+        matched = [s for s in sections if pattern.search(s["title"])]
+        return [matched[0]["chunk_start"], matched[0]["chunk_end"]] if matched else None
+
+    return {
+        "sections": sections,
+        "captions": sorted(captions.values(), key=lambda c: c["chunk"]),
+        "abstract": _range(_ABSTRACT_TITLE),
+        "references": _range(_REFERENCES_TITLE),
+        "chunk_pages": chunk_pages,
+    }
+
+
+def parse_structure_query(question: str) -> dict | None:
+    """
+    解析问题中对页码、章节、图表的明确引用
+        参数:
+            question: 用户问题
+        返回:
+            dict | None: {"page": 页码（从1开始）或None, "section": 章节编号或None, "caption": 图表标签或None}，
+                没有明确引用时返回None
+    """
+    question = question or ""
+    ref = {"page": None, "section": None, "caption": None}
+    match = _PAGE_REF.search(question)
+    if match:
+        ref["page"] = int(next(g for g in match.groups() if g))
+    match = _SECTION_REF.search(question)
+    if match:
+        ref["section"] = next(g for g in match.groups() if g)
+    match = _CAPTION_REF.search(question)
+    if match:
+        if match.group(1):
+            kind = "table" if match.group(1).lower().startswith("tab") else "figure"
+            ref["caption"] = _caption_label(kind, match.group(2))
+        else:
+            ref["caption"] = _caption_label(match.group(3), match.group(4))
+    return ref if any(ref.values()) else None
+
+
+def resolve_chunks(structure: dict, ref: dict, max_chunks: int) -> list[int]:
+    """
+    根据论文结构把页码/章节/图表引用解析为分块号
+        优先级：图表 > 章节 > 页码；图表或章节同时指定页码时，优先取该页上的结果
+        参数:
+            structure: extract_structure 的结果
+            ref: parse_structure_query 的结果
+            max_chunks: 最多返回的分块数
+        返回:
+            list[int]: 按顺序排列的分块号，无法解析时为空列表
+    """
+    chunk_pages = structure.get("chunk_pages") or []
+    page = ref["page"] - 1 if ref.get("page") else None
+    chunks: list[int] = []
+    if ref.get("caption"):
+        matched = [c for c in structure.get("captions", []) if c["label"] == ref["caption"]]
+        if page is not None and any(c["page"] == page for c in matched):
+            matched = [c for c in matched if c["page"] == page]
+        for caption in matched:
+            # 表格内容常在标题后的片段中
+            chunks.extend([caption["chunk"], caption["chunk"] + 1])
+    elif ref.get("section"):
+        number = ref["section"]
+        for section in structure.get("sections", []):
+            if section["no"] == number or section["no"].startswith(number + "."):
+                chunks.extend(range(section["chunk_start"], section["chunk_end"] + 1))
+    elif page is not None:
+        chunks = [chunk for chunk, chunk_page in enumerate(chunk_pages) if chunk_page == page]
+    valid = range(len(chunk_pages)) if chunk_pages else None
+    ordered = sorted({c for c in chunks if valid is None or c in valid})
+    return ordered[:max_chunks]
@@ -0,0 +1,150 @@
+import re
+
+from pypdf import PdfReader
+
+from app.utils.log_util import get_logger
+
+logger = get_logger("pdf_metadata")
+
+# 常见的无意义标题（生成工具写入的默认值）
+_GENERIC_TITLE_PATTERNS = [
+    r"^untitled",
+    r"^microsoft (word|powerpoint)",
+    r"\.(pdf|docx?|tex|dvi)$",
+    r"^arxiv:",
+    r"^doi:",
+    r"^proceedings of",
+    r"^preprint",
+]
+
+
+def _is_valid_title(title: str | None) -> bool:
+    """
+    判断候选标题是否可用
+        参数:
+            title: 候选标题
+        返回:
+            bool: 长度合理、包含文字、且不是生成工具写入的默认值
+    """
+    if not title:
+        return False
+    text = title.strip()
+    if not 8 <= len(text) <= 300:
+        return False
+    if not re.search(r"[A-Za-z\u4e00-\u9fff]{3,}", text):
+        return False
+    lowered = text.lower()
+    return not any(re.search(pattern, lowered) for pattern in _GENERIC_TITLE_PATTERNS)
+
+
+def _clean_title(title: str) -> str:
+    """合并标题中的换行与多余空白"""
+    return re.sub(r"\s+", " ", title).strip(" .,:;-")
+
+
+def _title_from_info(reader: PdfReader) -> str | None:
+    """从PDF文档信息字典 /Info 中读取标题"""
+    try:
+        info = reader.metadata
+        return info.title if info else None
+    except Exception:
+        return None
+
+
+def _title_from_xmp(reader: PdfReader) -> str | None:
+    """从PDF的XMP元数据（dc:title）中读取标题"""
+    try:
+        xmp = reader.xmp_metadata
+        if xmp is None or not xmp.dc_title:
+            return None
+        titles = xmp.dc_title
+        return titles.get("x-default") or next(iter(titles.values()), None)
+    except Exception:
+        return None
+
+
+def _title_from_layout(reader: PdfReader) -> str | None:
+    """
+    根据首页排版推断标题：取页面上半部分字号最大的文本行
+        返回:
+            str | None: 字号最大的文本行（多行标题会合并）
+    """
+    if not reader.pages:
+        return None
+    page = reader.pages[0]
+    fragments: list[tuple[float, float, str]] = []
+
+    def _visitor(text, cm, tm, font_dict, font_size):
+        if not text or not text.strip():
+            return
+        # 实际字号 = Tf字号 × 文本矩阵缩放 × 变换矩阵缩放
+        size = float(font_size or 0) * (abs(float(tm[3])) or 1.0) * (abs(float(cm[3])) or 1.0)
+        y = float(tm[5]) * (abs(float(cm[3])) or 1.0) + float(cm[5])
+        fragments.append((round(size, 1), y, text))
+
+    try:
+        page.extract_text(visitor_text=_visitor)
+    except Exception:
+        return None
+    if not fragments:
+        return None
+
+    # 只看页面上半部分，避免页脚/正文中的大号字干扰
+    try:
+        page_height = float(page.mediabox.height)
+        top_fragments = [f for f in fragments if f[1] >= page_height * 0.4] or fragments
+    except Exception:
+        top_fragments = fragments
+    max_size = max(size for size, _, _ in top_fragments)
+    if max_size <= 0:
+        return None
+    title_parts = [text for size, _, text in top_fragments if abs(size - max_size) < 0.5]
+    return " ".join(part.strip() for part in title_parts)
+
+
+def extract_abstract_sentence(first_page_text: str, max_chars: int = 300) -> str:
+    """
+    从首页文本中提取摘要的第一句话，作为一句话摘要
+        参数:
+            first_page_text: 首页文本
+            max_chars: 最大长度
+        返回:
+            str: 摘要第一句，未找到摘要时返回空字符串
+    """
+    text = first_page_text or ""
+    match = re.search(
+        r"(?:\babstract\b|摘\s*要)[\s:：.—-]*(.+?)(?:\n\s*\n|\b(?:1\.?|I\.?)?\s*introduction\b|\bkeywords\b|\bindex terms\b|关键词|$)",
+        text,
+        flags=re.IGNORECASE | re.DOTALL,
+    )
+    if not match:
+        return ""
+    abstract = re.sub(r"\s+", " ", match.group(1)).strip()
+    sentence = re.split(r"(?<=[.!?。！？])\s", abstract, maxsplit=1)[0]
+    return sentence[:max_chars].strip()
+
+
+def extract_local_metadata(file_path: str, first_page_text: str = "") -> dict:
+    """
+    不调用LLM，从PDF本身解析标题与一句话摘要
+        1. 依次尝试 /Info 标题、XMP dc:title、首页字号最大的文本行
+        2. 从首页文本中提取摘要第一句
+        参数:
+            file_path: PDF文件路径
+            first_page_text: 首页文本
+        返回:
+            dict: {"title": 标题或None, "title_source": 标题来源, "summary": 摘要或空字符串}
+    """
+    result = {"title": None, "title_source": None, "summary": extract_abstract_sentence(first_page_text)}
+    try:
+        reader = PdfReader(file_path)
+    except Exception as exc:
+        logger.debug("无法读取PDF元数据 %s: %s", file_path, exc)
+        return result
+    for source, getter in (("info", _title_from_info), ("xmp", _title_from_xmp), ("layout", _title_from_layout)):
+        candidate = getter(reader)
+        if candidate and _is_valid_title(_clean_title(candidate)):
+            result["title"] = _clean_title(candidate)
+            result["title_source"] = source
+            break
+    return result
@@ -0,0 +1,89 @@
+import threading
+
+import redis
+from redis.cluster import RedisCluster
+
+from config.settings import settings
+
+
+class UnitOfWork:
+    """
+    redis写操作的工作单元：把一组相关的写操作放入同一个MULTI事务，一次往返提交
+        with redis_pool.unit_of_work() as uow:
+            uow.hset(...)
+            uow.incr(...)
+        uow.results  # 各命令的执行结果
+        with 代码块中发生异常时放弃所有写操作，不会留下只写了一半的状态
+        集群模式下事务中的所有key必须位于同一个slot（带hash tag的key布局保证同一实例的key满足这一点）
+    """
+
+    def __init__(self, client: redis.Redis | RedisCluster):
+        self._pipe = client.pipeline(transaction=True)
+        self.results: list | None = None
+
+    def __getattr__(self, name):
+        # 命令方法（hset、lpush等）直接排入事务
+        return getattr(self._pipe, name)
+
+    def __enter__(self) -> "UnitOfWork":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        try:
+            if exc_type is None:
+                self.results = self._pipe.execute()
+        finally:
+            self._pipe.reset()
+
+
+class RedisPool:
+    """
+    进程级共享的redis连接池
+        RedisService 与所有历史消息客户端共用同一个连接池，
+        多个 Streamlit 会话的命令复用少量连接；连接池耗尽时等待空闲连接，而不是无限制地新建连接
+        settings.REDIS_CLUSTER 开启时使用集群客户端（每个节点一个连接池，命令按key的slot路由到对应节点）
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pool: redis.ConnectionPool | None = None
+        self._client: redis.Redis | RedisCluster | None = None
+
+    def get_pool(self) -> redis.ConnectionPool:
+        """
+        获取共享的连接池（首次调用时创建）
+        """
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = redis.BlockingConnectionPool(
+                        max_connections=settings.REDIS_MAX_CONNECTIONS,
+                        timeout=settings.REDIS_POOL_TIMEOUT,
+                        **settings.redis_config,
+                    )
+        return self._pool
+
+    def get_client(self) -> redis.Redis | RedisCluster:
+        """
+        获取使用共享连接池的redis客户端（客户端本身线程安全，所有使用方共用同一个）
+        """
+        if self._client is None:
+            if settings.REDIS_CLUSTER:
+                with self._lock:
+                    if self._client is None:
+                        # 集群只有db 0；redis_config 中的节点作为启动节点，其余节点从集群拓扑中发现
+                        config = {key: value for key, value in settings.redis_config.items() if key != "db"}
+                        self._client = RedisCluster(max_connections=settings.REDIS_MAX_CONNECTIONS, **config)
+                return self._client
+            pool = self.get_pool()
+            with self._lock:
+                if self._client is None:
+                    self._client = redis.Redis(connection_pool=pool)
+        return self._client
+
+    def unit_of_work(self) -> UnitOfWork:
+        """创建一个工作单元，在 with 代码块结束时以一个事务提交其中的写操作"""
+        return UnitOfWork(self.get_client())
+
+
+redis_pool = RedisPool()
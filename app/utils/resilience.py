@@ -0,0 +1,407 @@
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import AsyncIterator, Awaitable, Callable
+
+from app.utils.log_util import get_logger
+from config.settings import settings
+
+logger = get_logger("resilience")
+
+
+class CircuitOpenError(RuntimeError):
+    """熔断器处于打开状态，调用被直接拒绝"""
+
+
+class DeadlineExceeded(TimeoutError):
+    """调用超过截止时间"""
+
+
+class CircuitBreaker:
+    """
+    熔断器
+        closed：正常放行，连续失败达到阈值后打开
+        open：直接拒绝调用，经过 reset_timeout 秒后进入 half_open
+        half_open：只放行一个探测调用，成功则关闭，失败则重新打开
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        """判断是否放行本次调用"""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = self.HALF_OPEN
+                self._probing = False
+            # half_open：只放行一个探测调用
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info("熔断器 %s 恢复", self.name)
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def release_probe(self) -> None:
+        """
+        释放探测名额但不计为失败：探测调用被取消（CancelledError、GeneratorExit 等）时调用，
+        否则 half_open 状态下后续调用都会被拒绝
+        """
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.warning("熔断器 %s 打开，连续失败 %d 次", self.name, self._failures)
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class ResiliencePolicy:
+    """
+    一类外部调用（LLM、向量化）的容错策略
+        1. 每次尝试都有截止时间（timeout，从开始执行时计算，同步调用通过 remaining_timeout() 传给底层客户端）
+        2. 幂等调用失败后按指数退避 + 随机抖动重试
+        3. 可选对冲请求：首个请求超过近期 p95 耗时仍未返回时，再发一个相同请求，取先返回的结果
+        4. 熔断器：上游持续失败时直接拒绝，快速降级
+    """
+
+    def __init__(self,
+                 name: str,
+                 timeout: float,
+                 max_attempts: int | None = None,
+                 hedge: bool = False,
+                 idempotent: bool = True):
+        self.name = name
+        self.timeout = timeout
+        self.max_attempts = max_attempts or settings.RETRY_MAX_ATTEMPTS
+        self.hedge = hedge and settings.HEDGE_ENABLED
+        self.idempotent = idempotent
+        self.breaker = CircuitBreaker(name, settings.BREAKER_FAILURE_THRESHOLD, settings.BREAKER_RESET_TIMEOUT)
+        self._latencies: deque = deque(maxlen=200)
+        # 最近调用的成功/失败记录，用于计算错误率
+        self._outcomes: deque = deque(maxlen=50)
+        self._lock = threading.Lock()
+
+    # ---------------------------------------------------------------- 统计
+    def _observe(self, seconds: float) -> None:
+        with self._lock:
+            self._latencies.append(seconds)
+            self._outcomes.append(True)
+
+    def _observe_failure(self) -> None:
+        self.breaker.record_failure()
+        with self._lock:
+            self._outcomes.append(False)
+
+    def latency_p95(self) -> float | None:
+        """近期成功调用耗时的p95（秒），没有样本时返回None"""
+        with self._lock:
+            values = sorted(self._latencies)
+        if not values:
+            return None
+        return values[min(len(values) - 1, int(0.95 * len(values)))]
+
+    def error_rate(self) -> float:
+        """近期调用的错误率"""
+        with self._lock:
+            outcomes = list(self._outcomes)
+        if not outcomes:
+            return 0.0
+        return outcomes.count(False) / len(outcomes)
+
+    def stats(self) -> dict:
+        """获取策略统计：熔断状态、p95耗时、错误率、样本数"""
+        p95 = self.latency_p95()
+        return {
+            "name": self.name,
+            "breaker": self.breaker.state,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "error_rate": round(self.error_rate(), 3),
+            "samples": len(self._latencies),
+        }
+
+    def hedge_delay(self) -> float:
+        """对冲延迟：近期成功调用耗时的p95，样本不足时使用超时时间的一半"""
+        with self._lock:
+            values = sorted(self._latencies)
+        if len(values) < 20:
+            return self.timeout / 2
+        p95 = values[min(len(values) - 1, int(0.95 * len(values)))]
+        return max(settings.HEDGE_MIN_DELAY, p95)
+
+    def _backoff(self, attempt: int) -> float:
+        """第attempt次失败后的等待时间：指数退避 + 全抖动"""
+        delay = min(settings.RETRY_MAX_DELAY, settings.RETRY_BASE_DELAY * (2 ** attempt))
+        return random.uniform(0, delay)
+
+    def _check_breaker(self) -> None:
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"{self.name} 熔断中，暂时不可用")
+
+    # ---------------------------------------------------------------- 同步调用
+    def call(self, fn: Callable, *args, **kwargs):
+        """
+        同步调用（在线程中执行，带截止时间、重试、对冲与熔断）
+            参数:
+                fn: 被调用的函数
+                args/kwargs: 函数参数
+            返回:
+                函数返回值，所有尝试都失败时抛出最后一次的异常
+        """
+        attempts = self.max_attempts if self.idempotent else 1
+        last_exc: BaseException | None = None
+        for attempt in range(attempts):
+            self._check_breaker()
+            started = time.monotonic()
+            try:
+                result = self._call_once(fn, args, kwargs)
+            except CircuitOpenError:
+                raise
+            except Exception as exc:
+                last_exc = exc
+                self._observe_failure()
+                logger.warning("%s 第%d次调用失败：%s", self.name, attempt + 1, exc)
+                if attempt + 1 < attempts:
+                    time.sleep(self._backoff(attempt))
+                continue
+            except BaseException:
+                self.breaker.release_probe()
+                raise
+            self.breaker.record_success()
+            self._observe(time.monotonic() - started)
+            return result
+        raise last_exc
+
+    def _run(self, started: threading.Event, deadline: float | None, fn: Callable, args, kwargs):
+        """在工作线程中执行一次调用，截止时间从线程开始执行时计算，并通过 remaining_timeout() 传给底层客户端"""
+        _call_state.deadline = deadline if deadline is not None else time.monotonic() + self.timeout
+        started.set()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _call_state.deadline = None
+
+    def _call_once(self, fn: Callable, args, kwargs):
+        started = threading.Event()
+        futures = [_executor.submit(self._run, started, None, fn, args, kwargs)]
+        # 在线程池中排队的时间不计入截止时间
+        started.wait()
+        deadline = time.monotonic() + self.timeout
+        if self.hedge:
+            done, _ = wait(futures, timeout=min(self.hedge_delay(), max(0.0, deadline - time.monotonic())))
+            if not done:
+                logger.debug("%s 发出对冲请求", self.name)
+                # 对冲请求与首个请求共用同一个截止时间
+                futures.append(_executor.submit(self._run, threading.Event(), deadline, fn, args, kwargs))
+        while futures:
+            done, pending = wait(futures, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                raise DeadlineExceeded(f"{self.name} 超过 {self.timeout}s 未返回")
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    return future.result()
+            futures = list(pending)
+            if not futures:
+                raise next(iter(done)).exception()
+
+    # ---------------------------------------------------------------- 异步调用
+    async def acall(self, factory: Callable[[], Awaitable]):
+        """
+        异步调用（带截止时间、重试、对冲与熔断）
+            参数:
+                factory: 每次尝试都创建一个新的协程
+            返回:
+                协程返回值，所有尝试都失败时抛出最后一次的异常
+        """
+        attempts = self.max_attempts if self.idempotent else 1
+        last_exc: BaseException | None = None
+        for attempt in range(attempts):
+            self._check_breaker()
+            started = time.monotonic()
+            try:
+                result = await self._acall_once(factory)
+            except CircuitOpenError:
+                raise
+            except Exception as exc:
+                last_exc = exc
+                self._observe_failure()
+                logger.warning("%s 第%d次调用失败：%s", self.name, attempt + 1, exc)
+                if attempt + 1 < attempts:
+                    await asyncio.sleep(self._backoff(attempt))
+                continue
+            except BaseException:
+                # 调用被取消（例如页面重新运行）时释放探测名额
+                self.breaker.release_probe()
+                raise
+            self.breaker.record_success()
+            self._observe(time.monotonic() - started)
+            return result
+        raise last_exc
+
+    async def _acall_once(self, factory: Callable[[], Awaitable]):
+        tasks = [asyncio.ensure_future(factory())]
+        deadline = time.monotonic() + self.timeout
+        try:
+            if self.hedge:
+                done, _ = await asyncio.wait(tasks, timeout=min(self.hedge_delay(), self.timeout))
+                if not done:
+                    logger.debug("%s 发出对冲请求", self.name)
+                    tasks.append(asyncio.ensure_future(factory()))
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=max(0.0, deadline - time.monotonic()), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    raise DeadlineExceeded(f"{self.name} 超过 {self.timeout}s 未返回")
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                if not pending:
+                    raise next(iter(done)).exception()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def astream(self,
+                      factory: Callable[[], AsyncIterator],
+                      first_chunk_timeout: float,
+                      idle_timeout: float) -> AsyncIterator:
+        """
+        流式调用（带首块超时、块间空闲超时、重试与熔断）
+            只有在尚未输出任何数据块之前失败才会重试，已输出部分内容后失败直接抛出，避免重复输出
+            参数:
+                factory: 每次尝试都创建一个新的异步迭代器
+                first_chunk_timeout: 等待第一个数据块的超时时间
+                idle_timeout: 两个数据块之间的最大间隔
+            返回:
+                AsyncIterator: 数据块
+        """
+        attempts = self.max_attempts if self.idempotent else 1
+        last_exc: BaseException | None = None
+        for attempt in range(attempts):
+            self._check_breaker()
+            started = time.monotonic()
+            emitted = False
+            stream = factory().__aiter__()
+            try:
+                while True:
+                    timeout = idle_timeout if emitted else first_chunk_timeout
+                    try:
+                        chunk = await asyncio.wait_for(stream.__anext__(), timeout)
+                    except StopAsyncIteration:
+                        break
+                    except asyncio.TimeoutError:
+                        raise DeadlineExceeded(
+                            f"{self.name} {'数据块间隔' if emitted else '首个数据块'}超过 {timeout}s"
+                        ) from None
+                    if not emitted:
+                        self._observe(time.monotonic() - started)
+                        emitted = True
+                    yield chunk
+            except Exception as exc:
+                last_exc = exc
+                self._observe_failure()
+                logger.warning("%s 第%d次流式调用失败：%s", self.name, attempt + 1, exc)
+                if emitted or attempt + 1 >= attempts:
+                    raise
+                await asyncio.sleep(self._backoff(attempt))
+                continue
+            except BaseException:
+                # 流被取消或提前关闭（CancelledError、GeneratorExit）时释放探测名额
+                self.breaker.release_probe()
+                raise
+            finally:
+                aclose = getattr(stream, "aclose", None)
+                if aclose is not None:
+                    await aclose()
+            self.breaker.record_success()
+            return
+        raise last_exc
+
+
+# 同步调用（含对冲请求）使用的线程池
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="resilience")
+# 工作线程中当前调用的截止时间
+_call_state = threading.local()
+
+
+def remaining_timeout(default: float | None = None) -> float | None:
+    """
+    获取当前同步容错调用剩余的时间，底层客户端把它作为请求超时，超过截止时间的请求在客户端内结束，
+    不会在调用方放弃等待后继续占用线程池
+        参数:
+            default: 不在容错调用中时返回的值
+        返回:
+            剩余秒数（至少0.1秒），或 default
+    """
+    deadline = getattr(_call_state, "deadline", None)
+    if deadline is None:
+        return default
+    return max(0.1, deadline - time.monotonic())
+
+_policies: dict[str, ResiliencePolicy] = {}
+_policies_lock = threading.Lock()
+
+
+def get_policy(name: str, **kwargs) -> ResiliencePolicy:
+    """
+    获取（或创建）指定名称的容错策略，同名策略共享熔断器与耗时统计
+        参数:
+            name: 策略名称，例如 chat、chat_stream、embedding
+            kwargs: 首次创建时传给 ResiliencePolicy 的参数
+        返回:
+            ResiliencePolicy: 容错策略
+    """
+    with _policies_lock:
+        policy = _policies.get(name)
+        if policy is None:
+            policy = ResiliencePolicy(name, **kwargs)
+            _policies[name] = policy
+        return policy
+
+
+def breaker_states() -> dict[str, str]:
+    """获取所有熔断器的状态，供界面展示降级模式"""
+    with _policies_lock:
+        policies = list(_policies.values())
+    return {policy.name: policy.breaker.state for policy in policies}
@@ -0,0 +1,131 @@
+import ast
+import json
+from typing import Any, Type, TypeVar
+
+from pydantic import BaseModel, ConfigDict, ValidationError
+
+from app.utils.log_util import get_logger
+
+logger = get_logger("serialization")
+
+try:
+    import orjson
+except ImportError:  # 可选依赖，未安装时使用标准库json
+    orjson = None
+
+# 记录格式的版本号，记录中以 "v" 字段保存；旧数据（没有 "v" 字段）视为版本0
+SCHEMA_VERSION = 1
+VERSION_FIELD = "v"
+
+RecordT = TypeVar("RecordT", bound="Record")
+
+
+def dumps(obj: Any) -> bytes:
+    """序列化为UTF-8编码的JSON（优先使用orjson）"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+def loads(value: bytes | str) -> Any:
+    """反序列化JSON（优先使用orjson）"""
+    if orjson is not None:
+        return orjson.loads(value)
+    return json.loads(value)
+
+
+class Record(BaseModel):
+    """redis中存储的记录基类：未声明的字段原样保留，便于兼容新增字段"""
+    model_config = ConfigDict(extra="allow")
+
+    def to_dict(self) -> dict:
+        return self.model_dump()
+
+
+class InstanceRecord(Record):
+    """聊天实例记录（历史消息单独保存在消息列表中，不在记录里）"""
+    id: str
+    name: str = "新聊天"
+    created_at: str | None = None
+    files: list = []
+
+
+class PaperRecord(Record):
+    """论文元数据记录"""
+    paper_id: str
+    instance_id: str | None = None
+    file_id: str | None = None
+    file_name: str | None = None
+    paper_title: str | None = None
+    page_count: int | None = None
+    summary: str | None = None
+    source_url: str | None = None
+    path: str | None = None
+    created_at: str | None = None
+    title_source: str | None = None
+    status: str | None = None
+
+
+def _migrate_v0(data: dict) -> dict:
+    """版本0 -> 1：去掉实例记录中的历史消息（历史消息保存在消息列表中）"""
+    data.pop("messages", None)
+    return data
+
+
+# 逐版本升级记录，键为升级前的版本号
+_MIGRATIONS = {
+    0: _migrate_v0,
+}
+
+
+def _parse(value: bytes | str) -> dict:
+    """解析原始数据；旧数据可能是 str(dict) 写入的Python字面量"""
+    try:
+        data = loads(value)
+    except ValueError:
+        if isinstance(value, bytes):
+            value = value.decode("utf-8")
+        data = ast.literal_eval(value)
+    if not isinstance(data, dict):
+        raise ValueError(f"记录不是字典：{type(data).__name__}")
+    return data
+
+
+def encode_record(record: Record | dict, model: Type[RecordT] | None = None) -> bytes:
+    """
+    编码记录（带版本号）
+        参数:
+            record: 记录对象，或需要先按 model 校验的字典
+            model: record 为字典时使用的记录类型
+        返回:
+            bytes: 编码后的数据
+    """
+    if isinstance(record, dict):
+        record = model.model_validate(record)
+    data = record.to_dict()
+    data[VERSION_FIELD] = SCHEMA_VERSION
+    return dumps(data)
+
+
+def decode_record(value: bytes | str | None, model: Type[RecordT]) -> tuple[RecordT | None, bool]:
+    """
+    解码记录，旧版本记录逐版本升级
+        参数:
+            value: redis中读取的原始数据
+            model: 记录类型
+        返回:
+            tuple[Record | None, bool]: 记录（无法解析或校验失败时为None）与是否需要回写为当前版本
+    """
+    if not value:
+        return None, False
+    try:
+        data = _parse(value)
+        version = data.pop(VERSION_FIELD, 0)
+        stale = version != SCHEMA_VERSION
+        while version < SCHEMA_VERSION:
+            data = _MIGRATIONS[version](data)
+            version += 1
+        return model.model_validate(data), stale
+    except (ValueError, SyntaxError, ValidationError) as exc:
+        logger.warning("解析%s失败: %s", model.__name__, exc)
+        return None, False
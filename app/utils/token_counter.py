@@ -0,0 +1,166 @@
+import threading
+import time
+
+from app.utils.log_util import get_logger
+from config.settings import settings
+
+logger = get_logger("token_counter")
+
+try:
+    import tiktoken
+except ImportError:  # 可选依赖，未安装时使用估算
+    tiktoken = None
+
+# 每条消息的格式开销（role、分隔符等）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_encoding = None
+_encoding_lock = threading.Lock()
+_encoding_loading = False
+# 上次加载失败的时间，间隔 TOKENIZER_RETRY_DELAY 秒后才再次尝试
+_encoding_failed_at: float | None = None
+
+
+def _load_encoding() -> None:
+    """在后台线程中加载tiktoken编码（首次加载可能需要下载词表）"""
+    global _encoding, _encoding_loading, _encoding_failed_at
+    try:
+        encoding = tiktoken.get_encoding("cl100k_base")
+    except Exception as exc:
+        logger.info("tiktoken 编码不可用，%ss 后重试，期间使用估算计数：%s", settings.TOKENIZER_RETRY_DELAY, exc)
+        with _encoding_lock:
+            _encoding_failed_at = time.monotonic()
+            _encoding_loading = False
+        return
+    with _encoding_lock:
+        _encoding = encoding
+        _encoding_failed_at = None
+        _encoding_loading = False
+
+
+def warm_up() -> None:
+    """
+    在后台线程中预加载tiktoken编码（服务启动时调用），不阻塞调用方；
+    已加载、正在加载、或距上次失败不足 TOKENIZER_RETRY_DELAY 秒时不做任何事
+    """
+    global _encoding_loading
+    if _encoding is not None or tiktoken is None:
+        return
+    with _encoding_lock:
+        if _encoding is not None or _encoding_loading:
+            return
+        if _encoding_failed_at is not None and time.monotonic() - _encoding_failed_at < settings.TOKENIZER_RETRY_DELAY:
+            return
+        _encoding_loading = True
+    threading.Thread(target=_load_encoding, name="tiktoken-warm-up", daemon=True).start()
+
+
+def _get_encoding():
+    """获取tiktoken编码，尚未加载完成时返回None（调用方使用估算），并在需要时触发后台加载"""
+    if _encoding is None:
+        warm_up()
+    return _encoding
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    估算文本的token数（中文按每字1个token，其他字符按每4个字符1个token）
+        参数:
+            text: 文本
+        返回:
+            int: 估算的token数
+    """
+    text = text or ""
+    cjk = sum(1 for ch in text if "\u4e00" <= ch <= "\u9fff")
+    return cjk + (len(text) - cjk) // 4
+
+
+def count_tokens(text: str) -> int:
+    """
+    计算文本的token数：优先使用本地tokenizer（tiktoken），不可用时估算
+        参数:
+            text: 文本
+        返回:
+            int: token数
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages) -> int:
+    """
+    计算提示消息列表的token数
+        参数:
+            messages: 消息列表（消息对象或字符串）
+        返回:
+            int: token数
+    """
+    return sum(
+        count_tokens(str(getattr(msg, "content", msg) or "")) + MESSAGE_OVERHEAD_TOKENS
+        for msg in messages
+    )
+
+
+def usage_from_message(message, prompt_messages, completion_text: str | None = None) -> dict:
+    """
+    获取一次调用的token用量：优先使用模型返回的 usage_metadata，没有时用本地计数
+        参数:
+            message: 模型返回的消息（或最后一个数据块）
+            prompt_messages: 提示消息列表
+            completion_text: 输出文本（流式调用时为拼接后的全部内容）
+        返回:
+            dict: {"input_tokens", "output_tokens", "source"}，source 为 provider 或 local
+    """
+    usage = getattr(message, "usage_metadata", None) if message is not None else None
+    if usage and usage.get("input_tokens") is not None:
+        return {
+            "input_tokens": int(usage.get("input_tokens") or 0),
+            "output_tokens": int(usage.get("output_tokens") or 0),
+            "source": "provider",
+        }
+    if completion_text is None:
+        completion_text = str(getattr(message, "content", "") or "")
+    return {
+        "input_tokens": count_message_tokens(prompt_messages),
+        "output_tokens": count_tokens(completion_text),
+        "source": "local",
+    }
+
+
+def fit_to_budget(budget: int,
+                  fixed_tokens: int,
+                  chunk_tokens: list[int],
+                  history_tokens: list[int],
+                  min_chunks: int = 1) -> tuple[int, int]:
+    """
+    在token预算内决定保留多少检索片段与历史消息
+        裁剪顺序：
+            1. 排名最低的片段（列表末尾），直到只剩 min_chunks 个
+            2. 最早的历史消息（列表开头）
+            3. 剩余的片段，直到只剩1个
+        参数:
+            budget: 提示词token预算
+            fixed_tokens: 不可裁剪部分（系统提示词、问题等）的token数
+            chunk_tokens: 按排名排列的各片段token数
+            history_tokens: 按时间排列的各历史消息token数
+            min_chunks: 第一轮裁剪后至少保留的片段数
+        返回:
+            tuple[int, int]: (保留的片段数, 历史消息从第几条开始保留)
+    """
+    keep_chunks = len(chunk_tokens)
+    history_start = 0
+    total = fixed_tokens + sum(chunk_tokens) + sum(history_tokens)
+    while total > budget and keep_chunks > min_chunks:
+        keep_chunks -= 1
+        total -= chunk_tokens[keep_chunks]
+    while total > budget and history_start < len(history_tokens):
+        total -= history_tokens[history_start]
+        history_start += 1
+    while total > budget and keep_chunks > 1:
+        keep_chunks -= 1
+        total -= chunk_tokens[keep_chunks]
+    return keep_chunks, history_start
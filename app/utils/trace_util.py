@@ -0,0 +1,140 @@
+import json
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+from app.utils.log_util import get_file_logger
+from config.settings import settings
+
+
+class RequestTrace:
+    """
+    一次问答请求的链路追踪
+        记录每个阶段的耗时（span），所有span都带有 trace_id、instance_id、paper_id 等标签
+    """
+
+    def __init__(self, tracer: "Tracer", name: str, **tags):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = uuid.uuid4().hex
+        self.tags = tags
+        self.started = time.perf_counter()
+        self.finished = False
+
+    @contextmanager
+    def span(self, stage: str, **extra):
+        """
+        记录一个阶段的耗时
+            参数:
+                stage: 阶段名称，例如 history、condense、vector_search
+                extra: 附加标签
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, (time.perf_counter() - start) * 1000, **extra)
+
+    def record(self, stage: str, value: float, unit: str = "ms", **extra) -> None:
+        """
+        直接记录一个阶段的数值（耗时毫秒，或 tokens/s 等速率）
+            参数:
+                stage: 阶段名称
+                value: 数值
+                unit: 单位，默认毫秒
+                extra: 附加标签
+        """
+        self.tracer.export({
+            "ts": datetime.now().isoformat(timespec="milliseconds"),
+            "trace_id": self.trace_id,
+            "trace": self.name,
+            "stage": stage,
+            "value": round(value, 3),
+            "unit": unit,
+            **self.tags,
+            **extra,
+        })
+
+    def elapsed_ms(self) -> float:
+        """从请求开始到现在的耗时（毫秒）"""
+        return (time.perf_counter() - self.started) * 1000
+
+    def finish(self) -> None:
+        """结束追踪，记录请求总耗时（重复调用只记录一次）"""
+        if self.finished:
+            return
+        self.finished = True
+        self.record("total", self.elapsed_ms())
+
+
+class Tracer:
+    """
+    链路追踪导出与聚合
+        1. 每个span以一行JSON写入 settings.TRACE_FILE：记录放入内存队列，由后台线程写入按大小轮转的文件，
+           导出不在事件循环线程上做磁盘IO
+        2. 在内存中按阶段保留最近 window 个数值，用于计算 p50/p95/p99
+    """
+
+    def __init__(self, export_path: Path | None, window: int = 1000):
+        self.export_path = export_path
+        self._exporter = None
+        if export_path is not None:
+            # 同一文件只创建一个写入线程
+            self._exporter = get_file_logger(
+                f"paper_ai_trace:{Path(export_path).resolve()}", export_path,
+                settings.TRACE_FILE_MAX_BYTES, settings.TRACE_FILE_BACKUP_COUNT,
+            )
+        self._lock = threading.Lock()
+        self._values: dict[str, deque] = defaultdict(lambda: deque(maxlen=window))
+        self._units: dict[str, str] = {}
+
+    def start(self, name: str, **tags) -> RequestTrace:
+        """
+        开始一次请求追踪
+            参数:
+                name: 追踪名称，例如 question
+                tags: 标签，例如 instance_id、paper_id
+            返回:
+                RequestTrace: 追踪对象
+        """
+        return RequestTrace(self, name, **tags)
+
+    def export(self, record: dict) -> None:
+        """导出一条span记录，并计入阶段聚合"""
+        with self._lock:
+            self._values[record["stage"]].append(record["value"])
+            self._units[record["stage"]] = record.get("unit", "ms")
+        if self._exporter is not None:
+            self._exporter.info(json.dumps(record, ensure_ascii=False, default=str))
+
+    @staticmethod
+    def _percentile(values: list, q: float) -> float:
+        index = min(len(values) - 1, int(round(q * (len(values) - 1))))
+        return values[index]
+
+    def stage_percentiles(self) -> dict:
+        """
+        按阶段聚合最近的数值
+            返回:
+                dict: {阶段: {"count", "unit", "p50", "p95", "p99"}}
+        """
+        with self._lock:
+            snapshot = {stage: sorted(values) for stage, values in self._values.items() if values}
+            units = dict(self._units)
+        return {
+            stage: {
+                "count": len(values),
+                "unit": units.get(stage, "ms"),
+                "p50": round(self._percentile(values, 0.50), 1),
+                "p95": round(self._percentile(values, 0.95), 1),
+                "p99": round(self._percentile(values, 0.99), 1),
+            }
+            for stage, values in snapshot.items()
+        }
+
+
+tracer = Tracer(settings.TRACE_FILE if settings.TRACE_ENABLED else None)
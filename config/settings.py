@@ -36,6 +36,10 @@ class Settings:
         # 向量数据库集合名称
         self.CHROMADB_COLLECTION_NAME = "ollama_embeddings_test"
 
+        # 存储后端：redis（多进程部署）或 sqlite（单机部署，不需要redis服务）
+        self.STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "redis")
+        self.SQLITE_STORAGE_PATH = self.BASE_DIR / "database/storage.db"  # sqlite后端的数据库文件
+
         # redis配置
         self.redis_config = {
                                         'host': 'localhost',
@@ -43,6 +47,25 @@ class Settings:
                                         'db': 0
                                         } 
         self.redis_url = 'redis://:@localhost:6380'
+        # redis连接池配置（进程内所有redis使用方共享同一个连接池）
+        self.REDIS_MAX_CONNECTIONS = 50  # 最大连接数
+        self.REDIS_POOL_TIMEOUT = 5  # 连接池耗尽时等待空闲连接的超时时间（秒）
+        # redis集群配置（redis_config 中的地址作为集群的启动节点）
+        self.REDIS_CLUSTER = os.getenv("REDIS_CLUSTER", "false").lower() == "true"  # 是否使用集群客户端
+        # 是否使用带hash tag的key布局（同一实例的key位于同一个slot），集群模式下必须开启
+        self.REDIS_HASH_TAGS = self.REDIS_CLUSTER or os.getenv("REDIS_HASH_TAGS", "false").lower() == "true"
+        self.REDIS_INSTANCE_INDEX_SHARDS = 16  # 带hash tag的布局下实例索引拆分的分片数
+        self.HISTORY_CLIENT_CACHE_SIZE = 1024  # 历史消息客户端最多缓存的实例数（按最近使用淘汰）
+        # 元数据进程内缓存配置（实例记录、论文元数据、论文集版本号）
+        self.METADATA_CACHE_ENABLED = True  # 是否启用
+        self.METADATA_CACHE_TTL = 300  # 缓存项最长有效期（秒），失效消息丢失时的兜底
+        self.METADATA_INVALIDATION_CHANNEL = "metadata_invalidate"  # redis不支持客户端缓存跟踪时使用的失效消息频道
+        self.CHAT_HISTORY_PAGE_TURNS = 10  # 聊天页面每页显示的对话轮数（更早的消息点击"加载更早的消息"后读取）
+        # 历史消息分层存储配置（redis中只保留最近的消息，更早的消息压缩后写入归档目录中的分段文件）
+        self.HISTORY_HOT_MESSAGES = 200  # 每个实例在redis中保留的消息条数
+        self.HISTORY_ARCHIVE_BATCH = 100  # 超出保留条数达到该数量时批量归档
+        self.HISTORY_COMPRESS_LEVEL = 6  # 消息压缩级别（zlib，1-9）
+        self.HISTORY_ARCHIVE_DIR = self.BASE_DIR / "database/history_archive"  # 历史消息归档目录，多主机部署时必须位于共享数据卷上
 
 
         # 对话LLM模型配置
@@ -52,6 +75,109 @@ class Settings:
         # 向量化LLM模型配置
         self.EMBEDDINGS_LLM_MODEL = "text-embedding-v4"
 
+        # HTTP连接池配置（进程内所有LLM客户端共享同一个连接池）
+        self.HTTP_MAX_CONNECTIONS = 20  # 最大连接数
+        self.HTTP_MAX_KEEPALIVE_CONNECTIONS = 10  # 最大保活连接数
+        self.HTTP_KEEPALIVE_EXPIRY = 30  # 保活连接过期时间（秒）
+        self.HTTP_TIMEOUT = 60  # 请求超时时间（秒）
+
+        # LLM调度配置（所有LLM调用的准入控制）
+        self.LLM_MAX_CONCURRENCY = 8  # 同时执行的LLM调用上限
+        self.LLM_TOKENS_PER_MINUTE = 120000  # 每分钟token预算，0 表示不限制
+
+        # 模型路由配置：辅助调用与用户问答使用独立的调度配额，远程服务变慢时切换到本地Ollama
+        self.LLM_AUX_MAX_CONCURRENCY = 4  # 辅助调用（精简问题、解析标题、分层摘要）并发上限
+        self.LLM_AUX_TOKENS_PER_MINUTE = 40000  # 辅助调用每分钟token预算，0 表示不限制
+        self.REASONER_ENABLED = True  # 复杂问题是否使用推理模型
+        self.REASONER_MAX_CONCURRENCY = 2  # 推理模型并发上限
+        self.LOCAL_LLM_ENABLED = True  # 是否启用本地Ollama作为备用模型
+        self.LOCAL_LLM_MAX_CONCURRENCY = 2  # 本地模型并发上限
+        self.ROUTER_SLOW_THRESHOLD = 8  # 远程模型p95耗时超过该值（秒）时优先使用本地模型
+        self.ROUTER_MAX_ERROR_RATE = 0.5  # 错误率超过该值的模型排到最后
+
+        # token预算与用量配置
+        self.CONTEXT_TOKEN_BUDGET = 6000  # 单次问答提示词（系统提示词+历史+片段+问题）的token上限
+        self.CONTEXT_MIN_CHUNKS = 2  # 裁剪历史消息之前至少保留的检索片段数
+        self.TOKENIZER_RETRY_DELAY = 300  # tiktoken 词表加载失败后再次尝试的间隔（秒），加载期间使用估算计数
+
+        # 检索与上下文打包配置
+        self.RETRIEVAL_K = 5  # 检索器返回的片段数
+        self.RETRIEVAL_CANDIDATE_K = 12  # 问答时召回的候选片段数，由上下文打包器按预算筛选
+        self.CONTEXT_PACK_TOKENS = 2500  # 检索片段在提示词中的token预算
+        self.CONTEXT_CHUNK_MAX_TOKENS = 250  # 单个片段裁剪后的最大token数
+
+        # 论文路由配置（论文较多时先选出相关论文，再只在这些论文中检索片段）
+        self.PAPER_ROUTING_ENABLED = True  # 是否启用两阶段论文路由
+        self.PAPER_ROUTING_TOP_M = 8  # 第一阶段选出的论文数，论文数不超过该值时直接检索全部论文
+
+        # 论文结构配置（明确引用页码/章节/图表的问题直接按结构读取片段）
+        self.STRUCTURE_LOOKUP_ENABLED = True  # 是否启用结构直查
+        self.STRUCTURE_LOOKUP_MAX_CHUNKS = 6  # 结构直查最多读取的片段数
+
+        # 相邻片段扩展配置（检索命中的片段在句子中间被切开时，补全前后的句子）
+        self.NEIGHBOUR_EXPANSION_ENABLED = True  # 是否启用相邻片段扩展
+        self.NEIGHBOUR_EXPANSION_SOURCES = 4  # 对排名前几的片段进行扩展
+        self.NEIGHBOUR_EXPANSION_MAX_CHARS = 400  # 每侧最多补充的字符数
+
+        # 追问上下文缓存配置（追问时复用上一轮的检索片段）
+        self.FOLLOWUP_CACHE_ENABLED = True  # 是否启用追问缓存
+        self.FOLLOWUP_CACHE_TTL = 900  # 缓存有效期（秒）
+        self.FOLLOWUP_CACHE_MAX_INSTANCES = 256  # 最多缓存的聊天实例数
+        self.FOLLOWUP_CACHE_MAX_CHUNKS = 16  # 每个实例最多缓存的片段数
+        self.FOLLOWUP_REUSE_COVERAGE = 0.6  # 追问内容词被上一轮片段覆盖的比例达到该值时直接复用
+        self.FOLLOWUP_EXTEND_COVERAGE = 0.3  # 覆盖比例达到该值时复用并补充相邻片段，低于该值时重新检索
+        self.FOLLOWUP_NEIGHBOUR_SOURCES = 3  # 补充相邻片段时，取上一轮排名靠前的几个片段的前后片段
+
+        # 多论文问答配置
+        self.RETRIEVAL_WORKERS = 8  # 多论文并行检索的线程数
+        self.MULTI_PAPER_MIN_QUOTA = 3  # 多论文检索时每篇论文至少召回的候选片段数
+        self.COMPARE_MAP_REDUCE = True  # 对比类问题是否先逐篇回答再汇总对比
+        self.COMPARE_MAP_MAX_TOKENS = 500  # 逐篇回答的最大输出token数
+        self.ANSWER_MAX_OUTPUT_TOKENS = 1500  # 问答回复预留的输出token数
+        self.USAGE_DAILY_TOKEN_LIMIT = 0  # 每个聊天实例每天的token上限，0 表示不限制
+        self.USAGE_ROLLUP_TTL_DAYS = 90  # 按天汇总的用量保留天数
+
+        # 容错配置：截止时间、重试、对冲请求与熔断
+        self.LLM_TIMEOUT = 30  # 非流式LLM调用的截止时间（秒）
+        self.LLM_STREAM_FIRST_TOKEN_TIMEOUT = 20  # 流式回复等待首个数据块的超时（秒）
+        self.LLM_STREAM_IDLE_TIMEOUT = 30  # 流式回复两个数据块之间的最大间隔（秒）
+        self.EMBEDDING_TIMEOUT = 10  # 查询向量化的截止时间（秒）
+        self.EMBEDDING_INDEX_TIMEOUT = 300  # 论文片段批量向量化入库的截止时间（秒）
+        self.RETRY_MAX_ATTEMPTS = 3  # 幂等调用的最大尝试次数
+        self.RETRY_BASE_DELAY = 0.5  # 重试退避的基础等待时间（秒）
+        self.RETRY_MAX_DELAY = 4  # 重试退避的最大等待时间（秒）
+        self.HEDGE_ENABLED = True  # 是否对查询向量化发出对冲请求
+        self.HEDGE_MIN_DELAY = 0.2  # 对冲请求的最小等待时间（秒）
+        self.BREAKER_FAILURE_THRESHOLD = 5  # 连续失败多少次后熔断
+        self.BREAKER_RESET_TIMEOUT = 30  # 熔断后多少秒进行探测恢复
+
+        # 相同问题的进行中请求合并（同一实例、论文集版本与历史消息，且不需要结合历史精简的问题）
+        self.COALESCE_ENABLED = True
+
+        # 链路追踪配置：问答各阶段耗时以JSON行格式导出
+        self.LOG_DIR = self.BASE_DIR / "database/logs"  # 日志目录
+        self.TRACE_ENABLED = True
+        self.TRACE_FILE = self.LOG_DIR / "trace.jsonl"
+        self.TRACE_FILE_MAX_BYTES = 20 * 1024 * 1024  # 单个追踪文件最大20MB，超过后轮转
+        self.TRACE_FILE_BACKUP_COUNT = 3  # 保留的历史追踪文件数
+
+        # 日志配置
+        self.LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()  # 日志级别，生产环境不输出DEBUG载荷
+        self.LOG_FILE = self.LOG_DIR / "app.log"
+        self.LOG_FILE_MAX_BYTES = 10 * 1024 * 1024  # 单个日志文件最大10MB
+        self.LOG_FILE_BACKUP_COUNT = 5  # 保留的历史日志文件数
+        self.LOG_PAYLOAD_MAX_CHARS = 2000  # 调试载荷（文档、提示词等）最多输出的字符数
+        self.LOG_PAYLOAD_SAMPLE_RATE = 0.1  # 调试载荷的采样率
+
+        # 论文导入配置：向量化与元数据解析并行执行
+        self.INGEST_WORKERS = 4  # 导入线程池大小
+
+        # 论文分层摘要配置：导入时按章节生成摘要，再归纳为全文摘要，概述类问题直接使用
+        self.DIGEST_ENABLED = True
+        self.DIGEST_WORKERS = 4  # 章节摘要并行数（实际并发仍受LLM调度器限制）
+        self.DIGEST_SECTION_MAX_CHARS = 6000  # 单个章节送入LLM的最大字符数
+        self.DIGEST_MAX_SECTIONS = 12  # 章节数上限，超过时合并相邻章节
+
 
         
         # 创建必要的目录
@@ -60,6 +186,7 @@ class Settings:
     def _create_directories(self):
         """创建必要的目录"""
         self.UPLOAD_DIR.mkdir(exist_ok=True) 
+        self.LOG_DIR.mkdir(parents=True, exist_ok=True)
     
     def get_server_config(self) -> Dict[str, Any]:
         """获取服务器配置"""
@@ -11,9 +11,20 @@ from app.models.chat import ChatInstance
 from app.server.chat_service import ai_service, chat_manager
 # 导入 Redis 聊天历史与元数据工具
 from app.server.redis_service import chat_message_history, redis_service
+# 导入 LLM 调度器用于展示排队指标
+from app.server.llm_scheduler import llm_scheduler
+# 导入熔断器状态用于展示降级模式
+from app.utils.resilience import breaker_states
+# 导入链路追踪用于展示各阶段耗时分位数
+from app.utils.trace_util import tracer
 from langchain_core.messages import AIMessage
 # 导入文件上传工具
 from app.utils.file_uploader import file_uploader
+from app.utils.log_util import get_logger
+# 导入配置用于展示token用量上限
+from config.settings import settings
+
+logger = get_logger("streamlit_app")
 
 
 # 定义兼容不同版本 Streamlit 的重运行函数
@@ -29,7 +40,7 @@ def _rerun():
 
 
 # 从持久化存储加载聊天实例
-def _load_instances() -> list[ChatInstance]:
+def _load_instances(refresh: bool = True) -> list[ChatInstance]:
     """
     从后端存储加载所有聊天实例，确保至少存在一个默认实例。
     
@@ -45,18 +56,14 @@ def _load_instances() -> list[ChatInstance]:
     Raises:
         Exception: 当从 Redis 加载失败时显示错误信息，但会继续执行并返回默认实例
     """  
-    # 尝试从后端重新加载实例
+    # 读取全部实例（轻量实例索引，不加载历史消息；refresh=False 时复用本次运行已加载的索引）
     try:
-        # 强制从存储刷新实例
-        chat_manager.load_instances()
+        instances = chat_manager.get_all_instances(refresh=refresh)
     # 捕获加载异常
     except Exception as exc:
         # 向页面报告错误
         st.error(f"streamlit_app.py/_load_instances 加载聊天实例失败: {exc}")
-
-
-    # 读取全部实例
-    instances = chat_manager.get_all_instances()
+        instances = []
 
     # 若无实例则创建默认实例
     if not instances:
@@ -162,12 +169,15 @@ def _render_sidebar(instances: list[ChatInstance]) -> str:
     # 遍历实例生成展示标签
     for inst in instances:
         label_map[inst.id] = f"{inst.name} ({inst.id[:6]})"
+        # 显示实例索引中的对话轮数（不需要加载历史消息）
+        if inst.message_count:
+            label_map[inst.id] += f" · {inst.message_count // 2}轮"
 
 
     # 若没有实例则返回空字符串
     if not instance_ids:
         # 返回空 ID 给调用方,退出函数
-        print('streamlit_app.py/_render_sidebar 无实例异常！')
+        logger.warning("侧边栏渲染时无聊天实例")
         return ""
     
     # ========== 处理实例选择器功能，解决特殊异常情况导致无聊天实例时处理 ==========
@@ -205,6 +215,51 @@ def _render_sidebar(instances: list[ChatInstance]) -> str:
     # 将选择结果同步到当前实例 ID
     st.session_state.current_instance_id = selected_id
 
+    # ========== 展示 LLM 调度器状态（执行中/排队数量） ==========
+    scheduler_stats = llm_scheduler.stats()
+    st.sidebar.caption(
+        f"LLM 并发 {scheduler_stats['active']}/{scheduler_stats['max_concurrency']}，"
+        f"排队 {scheduler_stats['queued_total']}，"
+        f"P95 等待 {scheduler_stats['wait_p95_ms']} ms"
+    )
+    # ========== 展示当前实例当天的token用量 ==========
+    if selected_id:
+        try:
+            today_tokens = redis_service.get_today_usage_tokens(selected_id)
+            limit = settings.USAGE_DAILY_TOKEN_LIMIT
+            st.sidebar.caption(f"今日token用量 {today_tokens}" + (f" / {limit}" if limit else ""))
+        except Exception as exc:
+            logger.warning("获取token用量失败：%s", exc)
+        # ========== 展示当前实例历史消息的存储情况（压缩与归档节省的redis内存） ==========
+        try:
+            storage = chat_message_history.get_chat_message_history_client(selected_id).storage_stats()
+            if storage["raw_bytes"]:
+                st.sidebar.caption(
+                    f"历史消息 {storage['messages']} 条（已归档 {storage['archived_messages']} 条），"
+                    f"存储占用 {storage['stored_bytes'] / 1024:.1f} KB，节省 {storage['saved_bytes'] / 1024:.1f} KB"
+                )
+        except Exception as exc:
+            logger.warning("获取历史消息存储统计失败：%s", exc)
+    # ========== 熔断器打开时提示降级模式 ==========
+    degraded = [name for name, state in breaker_states().items() if state != "closed"]
+    if degraded:
+        st.sidebar.warning(f"降级模式：{'、'.join(degraded)} 服务异常，已暂停调用，稍后自动恢复")
+    # ========== 展示模型路由各后端状态 ==========
+    with st.sidebar.expander("模型路由"):
+        st.table([
+            {"后端": item["backend"], "熔断": item["breaker"], "P95(ms)": item["p95_ms"],
+             "错误率": item["error_rate"], "执行中": item["active"], "排队": item["queued"]}
+            for item in ai_service.router.stats()
+        ])
+    # ========== 展示问答各阶段耗时分位数 ==========
+    stage_stats = tracer.stage_percentiles()
+    if stage_stats:
+        with st.sidebar.expander("问答各阶段耗时"):
+            st.table([
+                {"阶段": stage, "单位": item["unit"], "次数": item["count"],
+                 "P50": item["p50"], "P95": item["p95"], "P99": item["p99"]}
+                for stage, item in stage_stats.items()
+            ])
 
 
     # 返回选中的实例 ID
@@ -221,7 +276,6 @@ def _handle_file_upload(instance: ChatInstance,
         1.在当前聊天实例内处理上传文件
         2.上传后写入实例与历史
     """
-    print('\n==========开始文件上传==========\n')
     # 未选择文件则直接返回
     if uploaded_file is None:
         # 无文件时不处理
@@ -373,21 +427,56 @@ def _handle_paper_source(instance: ChatInstance, source_text: str, triggered: bo
     return meta.get("paper_id")
 
 
-# 渲染选中实例的历史消息
+# "加载更早的消息"按钮回调
+def _load_earlier_messages(limit_key: str, page_size: int) -> None:
+    """点击"加载更早的消息"按钮的回调：多显示一页消息"""
+    st.session_state[limit_key] = st.session_state.get(limit_key, page_size) + page_size
+
+
+# 获取当前实例的消息渲染缓存
+def _message_cache(instance_id: str) -> dict:
+    """
+    获取消息渲染缓存 {消息位置: (角色, markdown内容, 时间)}，切换实例时清空。\n
+    历史消息只追加不修改，消息位置可作为消息的稳定标识，已缓存的消息不再从 Redis 读取。
+    """
+    cache = st.session_state.get("message_render_cache")
+    if cache is None or cache["instance_id"] != instance_id:
+        cache = {"instance_id": instance_id, "items": {}}
+        st.session_state["message_render_cache"] = cache
+    return cache["items"]
+
+
+# 渲染选中的实例的历史消息
 def _render_messages(instance_id: str) -> None:
     """
     ### 功能：
-        渲染选中的实例的历史消息，包含用户与助手的交互记录。\n
+        分页渲染选中的实例的历史消息，包含用户与助手的交互记录。\n
+        只显示最近 CHAT_HISTORY_PAGE_TURNS 轮对话，更早的消息通过"加载更早的消息"按页读取（Redis 范围读取）；
+        已渲染过的消息按位置缓存，每次重运行只读取新增的消息，渲染耗时不随对话长度增长。\n
         如果实例不存在历史消息，则显示欢迎语。
     """
-
-
-    # 尝试从 Redis 加载聊天历史
+    # 每页的消息条数（每轮对话包含用户与助手两条消息）
+    page_size = settings.CHAT_HISTORY_PAGE_TURNS * 2
+    # 当前实例显示的消息条数
+    limit_key = f"history_limit_{instance_id}"
+    limit = st.session_state.setdefault(limit_key, page_size)
+    cache = _message_cache(instance_id)
+
+    # 尝试从 Redis 加载需要显示且尚未缓存的消息
     try:
-        # 获取对应实例的历史客户端
-        history_client = chat_message_history.get_chat_message_history_client(instance_id)
-        # 拉取历史消息列表
-        messages = history_client.messages
+        # 消息总数
+        total = chat_message_history.count_messages(instance_id)
+        # 显示的第一条消息的位置
+        first = max(0, total - limit)
+        missing = [position for position in range(first, total) if position not in cache]
+        if missing:
+            # 一次范围读取缺失的消息
+            messages = chat_message_history.get_message_range(instance_id, missing[0], missing[-1] + 1)
+            for position, msg in enumerate(messages, start=missing[0]):
+                # 根据消息类型决定角色 如果时human则为user 否则为assistant
+                role = "user" if msg.type == "human" else "assistant"
+                message_time = msg.additional_kwargs.get("message_time") if hasattr(msg, "additional_kwargs") else None
+                cache[position] = (role, msg.content, message_time)
     # 捕获加载错误
     except Exception as exc:
         # 显示加载失败错误
@@ -396,28 +485,32 @@ def _render_messages(instance_id: str) -> None:
         return
     
     # 没有消息时显示欢迎语
-    if not messages:
+    if not total:
         # 以助手身份显示欢迎信息
         with st.chat_message("assistant"):
             # 渲染欢迎文本
             st.markdown("你好！我是一个论文智能助手，你可以上传/导入论文向我咨询论文相关问题。")
         # 结束渲染
         return
+
+    # 还有更早的消息时显示加载按钮
+    if first > 0:
+        st.button(
+            f"加载更早的消息（还有 {first} 条）",
+            key=f"load_earlier_{instance_id}",
+            on_click=_load_earlier_messages,
+            args=(limit_key, page_size),
+        )
     
     # 将历史消息进行渲染
-    for msg in messages:
-        # 根据消息类型决定角色 如果时human则为user 否则为assistant
-        role = "user" if msg.type == "human" else "assistant"
+    for position in range(first, total):
+        if position not in cache:
+            continue
+        role, content, message_time = cache[position]
         # 使用消息角色渲染气泡
         with st.chat_message(role):
             # 显示消息内容
-            st.markdown(msg.content)
-            # 初始化消息时间
-            message_time = None
-            # 检查是否存在扩展字段
-            if hasattr(msg, "additional_kwargs"):
-                # 从扩展字段取出时间
-                message_time = msg.additional_kwargs.get("message_time")
+            st.markdown(content)
             # 若有时间则显示
             if message_time:
                 # 显示时间戳
@@ -446,8 +539,8 @@ def main():
     # 渲染侧边栏（新建聊天按钮，聊天实例单选列表）并获取选中 ID
     selected_id = _render_sidebar(instances)
 
-    # 重新加载实例确保包含新建实例
-    instances = _load_instances()
+    # 侧边栏新建/删除的实例已同步到 chat_manager，不需要再读取redis
+    instances = _load_instances(refresh=False)
 
 
     # 使用最新的当前实例 ID 修正选择
@@ -599,6 +692,9 @@ def main():
             args=(current_instance.id,),
         )
     selected_paper_key = f"selected_paper_{current_instance.id}"
+    # 多论文模式：开关与选中的论文列表
+    multi_paper_key = f"multi_paper_mode_{current_instance.id}"
+    selected_papers_key = f"selected_papers_{current_instance.id}"
     if st.session_state.get(source_trigger_key):
         st.session_state[source_trigger_key] = False
         source_text = st.session_state.get(source_payload_key, "")
@@ -627,15 +723,31 @@ def main():
                 paper_label_map[pid] = f"{title} (页数 {pages})"
             else:
                 paper_label_map[pid] = title
+            # 向量化尚未完成的论文
+            if p.get("status") == "indexing":
+                paper_label_map[pid] += "（索引中）"
         if paper_ids:
             if st.session_state.get(selected_paper_key) not in paper_ids:
                 st.session_state[selected_paper_key] = paper_ids[-1]
-            st.radio(
-                "选择论文",
-                options=paper_ids,
-                key=selected_paper_key,
-                format_func=lambda pid: paper_label_map.get(pid, pid),
-            )
+            # 两篇及以上论文时可开启多论文模式（跨论文检索、对比问答）
+            if len(paper_ids) > 1:
+                st.checkbox("多论文模式", key=multi_paper_key)
+            if len(paper_ids) > 1 and st.session_state.get(multi_paper_key):
+                selected_papers = [pid for pid in st.session_state.get(selected_papers_key, []) if pid in paper_ids]
+                st.session_state[selected_papers_key] = selected_papers or list(paper_ids)
+                st.multiselect(
+                    "选择论文（可多选）",
+                    options=paper_ids,
+                    key=selected_papers_key,
+                    format_func=lambda pid: paper_label_map.get(pid, pid),
+                )
+            else:
+                st.radio(
+                    "选择论文",
+                    options=paper_ids,
+                    key=selected_paper_key,
+                    format_func=lambda pid: paper_label_map.get(pid, pid),
+                )
     # 若触发发送则处理
     if st.session_state.get(send_trigger_key):
         # 重置触发器
@@ -661,16 +773,24 @@ def main():
                         try:
                             # 获取询问的论文id
                             selected_paper_id = st.session_state.get(selected_paper_key)
+                            # 多论文模式下选中的论文id列表
+                            selected_paper_ids = None
+                            if st.session_state.get(multi_paper_key):
+                                selected_paper_ids = st.session_state.get(selected_papers_key) or None
                             # 判断是否支持流式输出
                             if hasattr(ai_service, "get_response_stream"):
                                 # 流式输出并获取完整响应
                                 response = st.write_stream(
-                                    ai_service.get_response_stream(payload, selected_id, selected_paper_id)
+                                    ai_service.get_response_stream(
+                                        payload, selected_id, selected_paper_id, selected_paper_ids
+                                    )
                                 )
                             # 不支持流式则使用普通输出
                             else:
                                 # 获取 AI 回复
-                                response = ai_service.get_response(payload, selected_id, selected_paper_id)
+                                response = ai_service.get_response(
+                                    payload, selected_id, selected_paper_id, selected_paper_ids
+                                )
                                 # 渲染 AI 回复
                                 st.markdown(response)
                         # 捕获 AI 错误
@@ -0,0 +1,65 @@
+# 把旧布局的key迁移为带hash tag的布局（在单机redis上执行，每个实例的key在一个事务中改名）
+#   旧布局：instances_table、instance_activity 两个hash，实例数据的key为 前缀+实例id
+#   新布局：实例索引拆分为 instances_table:<分片>，实例数据的key为 前缀+{实例id}，最后活动时间为 instance_activity:{实例id}
+# 迁移后设置环境变量 REDIS_HASH_TAGS=true；迁移到集群时用 redis-cli --cluster import 导入后设置 REDIS_CLUSTER=true
+# 运行：python test/redis键布局迁移.py [--dry-run]
+
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# 以旧布局启动服务
+os.environ["REDIS_HASH_TAGS"] = "false"
+
+from app.server.key_layout import ACTIVITY_TABLE, INSTANCES_TABLE, KeyLayout
+from app.server.redis_service import RedisService
+
+legacy, tagged = KeyLayout(hash_tags=False), KeyLayout(hash_tags=True)
+
+
+def instance_keys(service, layout, instance_id):
+    """按指定布局计算实例的所有数据key（不含最后活动时间）"""
+    service.layout = layout
+    keys = service._instance_keys(instance_id)
+    if layout.hash_tags:
+        keys = keys[:-1]
+    return keys + [service._paper_table(instance_id)]
+
+
+def migrate(dry_run=False):
+    service = RedisService()
+    client = service.redis_client
+    records = client.hgetall(INSTANCES_TABLE)
+    activity = client.hgetall(ACTIVITY_TABLE)
+    print(f"旧布局实例数：{len(records)}")
+    for raw_id, value in records.items():
+        instance_id = raw_id.decode("utf-8")
+        moves = [
+            (old, new)
+            for old, new in zip(instance_keys(service, legacy, instance_id), instance_keys(service, tagged, instance_id))
+            if client.exists(old)
+        ]
+        # 按天汇总的token用量：usage:<id>:<YYYYMMDD>
+        usage_key = legacy.instance_key(service.usage_prefix, instance_id)
+        for key in client.scan_iter(match=f"{usage_key}:*"):
+            suffix = key.decode("utf-8")[len(usage_key):]
+            if re.fullmatch(r":\d{8}", suffix):
+                moves.append((key, tagged.instance_key(service.usage_prefix, instance_id) + suffix))
+        print(f"{instance_id}: 改名 {len(moves)} 个key")
+        if dry_run:
+            continue
+        with client.pipeline(transaction=True) as pipe:
+            for old, new in moves:
+                pipe.rename(old, new)
+            pipe.hset(tagged.index_key(instance_id), instance_id, value)
+            if raw_id in activity:
+                pipe.set(tagged.activity_key(instance_id), activity[raw_id])
+            pipe.hdel(INSTANCES_TABLE, instance_id)
+            pipe.hdel(ACTIVITY_TABLE, instance_id)
+            pipe.execute()
+    print("迁移完成" if not dry_run else "试运行完成，未修改数据")
+
+
+if __name__ == "__main__":
+    migrate(dry_run="--dry-run" in sys.argv)
@@ -0,0 +1,77 @@
+# redis集群模式测试（带hash tag的key布局 + 实例索引分片 + 集群客户端）
+#   1. 检查同一实例的所有key位于同一个slot，实例索引分片分散到不同节点
+#   2. 对本地集群执行完整流程：创建实例、写入对话、导入论文、读取索引、修改实例id、删除实例
+# 先启动本地集群：cd docker && docker-compose -f docker-compose.cluster.yml up -d
+# 运行：python test/redis集群键布局测试.py（集群端口默认7001，可通过环境变量 REDIS_CLUSTER_PORT 修改）
+
+import os
+import sys
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# 必须在导入服务之前开启集群模式（服务在导入时创建redis客户端）
+os.environ["REDIS_CLUSTER"] = "true"
+
+from redis.cluster import key_slot
+from redis.exceptions import RedisClusterException, RedisError
+
+from config.settings import settings
+
+settings.redis_config["port"] = int(os.getenv("REDIS_CLUSTER_PORT", "7001"))
+
+
+def check_layout(service):
+    instance_id = "layout-check"
+    keys = service._instance_keys(instance_id) + [service._paper_table(instance_id)]
+    slots = {key_slot(key.encode("utf-8")) for key in keys}
+    assert len(slots) == 1, f"同一实例的key位于多个slot：{slots}"
+    shard_slots = {key_slot(key.encode("utf-8")) for key in service.layout.index_keys()}
+    print(f"实例的 {len(keys)} 个key位于同一个slot {slots.pop()}；"
+          f"{len(shard_slots)} 个实例索引分片分布在 {len(shard_slots)} 个slot上")
+
+
+def run(service, history):
+    from app.utils.serialization import InstanceRecord
+
+    instance_id, new_id = f"cluster-{uuid.uuid4().hex[:8]}", f"cluster-{uuid.uuid4().hex[:8]}"
+    client = service.redis_client
+    nodes = {client.get_node_from_key(key).name for key in service.layout.index_keys()}
+    print(f"集群节点数：{len(client.get_nodes())}，实例索引分片分布在 {len(nodes)} 个节点上")
+
+    service.add_instance(instance_id, InstanceRecord(id=instance_id, created_at="2024-01-01 00:00:00"))
+    history_client = history.get_chat_message_history_client(instance_id)
+    for i in range(3):
+        history.add_user_ai_message(history_client, f"问题{i}", f"回答{i}", "text", None)
+    service.add_paper_metadata(instance_id, "paper-1", {"paper_id": "paper-1", "instance_id": instance_id})
+    service.complete_paper_ingest(
+        instance_id, "paper-1", {"paper_id": "paper-1", "instance_id": instance_id, "status": "ready"},
+        {"sections": []}, {"0": {"prev": None, "next": None}},
+    )
+    service.record_usage(instance_id, 10, 20)
+    item = next(item for item in service.list_instance_index() if item["id"] == instance_id)
+    assert item["message_count"] == 6 and item["last_activity"], item
+    print(f"写入完成：{item}")
+
+    service.rename_instance(instance_id, new_id)
+    assert service.get_instance(instance_id) is None
+    assert history.count_messages(new_id) == 6
+    assert service.get_paper_metadata(new_id, "paper-1")["instance_id"] == new_id
+    assert service.get_usage(new_id)["output_tokens"] == 20
+    print(f"实例id已修改：{instance_id} -> {new_id}")
+
+    history.get_chat_message_history_client(new_id).clear()
+    service.remove_paper_metadata(new_id, "paper-1")
+    service.remove_instance(new_id)
+    assert not service.exists_instance(new_id)
+    print("集群模式测试通过")
+
+
+if __name__ == "__main__":
+    try:
+        from app.server.redis_service import ChatMessageHistory, RedisService
+        service = RedisService()
+    except (RedisClusterException, RedisError) as exc:
+        print(f"无法连接redis集群，请先启动本地集群：{exc}")
+        sys.exit(1)
+    check_layout(service)
+    run(service, ChatMessageHistory())
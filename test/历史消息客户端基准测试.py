@@ -0,0 +1,80 @@
+# 历史消息客户端注册表的微基准测试（不需要启动redis，客户端在执行命令前不会建立连接）
+#   旧实现：客户端保存在列表中，每次查找都要生成两次 session_id 列表，O(n)
+#   新实现：OrderedDict 注册表 + 最近使用淘汰，O(1)，所有客户端共享同一个连接池
+# 运行：python test/历史消息客户端基准测试.py
+
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_community.chat_message_histories import RedisChatMessageHistory
+
+from app.server.redis_service import ChatMessageHistory
+from config.settings import settings
+
+INSTANCES = 10_000
+LOOKUPS = 20_000
+THREADS = 8
+
+
+class ListChatMessageHistory:
+    """旧实现（列表 + 线性查找），仅用于对比"""
+
+    def __init__(self):
+        self.chat_message_history_client_list = []
+
+    def get_chat_message_history_client(self, instance_id):
+        if instance_id not in [item.session_id for item in self.chat_message_history_client_list]:
+            client = RedisChatMessageHistory(session_id=instance_id, url=settings.redis_url)
+            self.chat_message_history_client_list.append(client)
+            return client
+        return self.chat_message_history_client_list[
+            [item.session_id for item in self.chat_message_history_client_list].index(instance_id)
+        ]
+
+
+def bench(name, registry, instance_ids, lookups):
+    started = time.perf_counter()
+    for instance_id in instance_ids:
+        registry.get_chat_message_history_client(instance_id)
+    created = time.perf_counter()
+    for instance_id in lookups:
+        registry.get_chat_message_history_client(instance_id)
+    finished = time.perf_counter()
+    print(f"{name}: 创建 {len(instance_ids)} 个客户端 {created - started:.3f}s，"
+          f"查找 {len(lookups)} 次 {finished - created:.3f}s（平均 {(finished - created) / len(lookups) * 1e6:.1f}us）")
+
+
+def bench_threads(registry, lookups):
+    """多线程并发查找（模拟多个 Streamlit 会话）"""
+    chunks = [lookups[i::THREADS] for i in range(THREADS)]
+
+    def worker(chunk):
+        for instance_id in chunk:
+            registry.get_chat_message_history_client(instance_id)
+
+    threads = [threading.Thread(target=worker, args=(chunk,)) for chunk in chunks]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(f"新实现 {THREADS} 线程并发查找 {len(lookups)} 次：{time.perf_counter() - started:.3f}s")
+
+
+if __name__ == "__main__":
+    instance_ids = [f"instance-{i}" for i in range(INSTANCES)]
+    lookups = [random.choice(instance_ids) for _ in range(LOOKUPS)]
+
+    registry = ChatMessageHistory(max_clients=INSTANCES)
+    bench("新实现（OrderedDict）", registry, instance_ids, lookups)
+    bench_threads(registry, lookups)
+    clients = {id(registry.get_chat_message_history_client(i).redis_client) for i in instance_ids[:100]}
+    print(f"新实现客户端使用的redis客户端数：{len(clients)}")
+
+    # 旧实现在10k实例下非常慢，只查找少量次数
+    bench("旧实现（列表）", ListChatMessageHistory(), instance_ids, lookups[:500])
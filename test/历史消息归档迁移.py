@@ -0,0 +1,67 @@
+# 把旧版本写入本机SQLite（database/history_archive.db）的归档历史消息迁移到共享归档目录的分段文件
+#   旧归档：messages 表，按 (实例id, 位置) 保存压缩后的消息，只有写入它的主机能读取
+#   新归档：HISTORY_ARCHIVE_DIR 中的分段文件 + redis中的分段索引 message_segments:<实例id>（带hash tag时为 message_segments:{实例id}）
+# 每台写过归档的主机都需要执行一次；已登记分段的位置会跳过，重复执行不会产生重复数据
+# 运行：python test/历史消息归档迁移.py [归档数据库路径] [--dry-run]
+
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.server.history_store import history_archive
+from app.server.key_layout import key_layout
+from app.server.redis_service import HISTORY_SEGMENTS_PREFIX
+from app.utils.redis_pool import redis_pool
+from config.settings import settings
+
+
+def covered_positions(client, segments_key):
+    """已登记的分段覆盖的位置"""
+    positions = set()
+    for segment in client.zrange(segments_key, 0, -1):
+        start, count = history_archive.segment_range(segment)
+        positions.update(range(start, start + count))
+    return positions
+
+
+def migrate(path, dry_run=False):
+    if not os.path.exists(path):
+        print(f"没有找到归档数据库：{path}")
+        return
+    conn = sqlite3.connect(path)
+    client = redis_pool.get_client()
+    instance_ids = [row[0] for row in conn.execute("SELECT DISTINCT instance_id FROM messages")]
+    print(f"归档数据库中的实例数：{len(instance_ids)}")
+    for instance_id in instance_ids:
+        segments_key = key_layout.instance_key(HISTORY_SEGMENTS_PREFIX, instance_id)
+        covered = covered_positions(client, segments_key)
+        rows = [
+            (position, payload)
+            for position, payload in conn.execute(
+                "SELECT position, payload FROM messages WHERE instance_id = ? ORDER BY position", (instance_id,)
+            )
+            if position not in covered
+        ]
+        # 按连续的位置切分为分段，每段最多 HISTORY_ARCHIVE_BATCH 条
+        runs = []
+        for position, payload in rows:
+            if runs and runs[-1][0] + len(runs[-1][1]) == position and len(runs[-1][1]) < settings.HISTORY_ARCHIVE_BATCH:
+                runs[-1][1].append(payload)
+            else:
+                runs.append((position, [payload]))
+        print(f"{instance_id}: 迁移 {len(rows)} 条消息，{len(runs)} 个分段")
+        if dry_run:
+            continue
+        for start, payloads in runs:
+            segment = history_archive.new_segment(start, len(payloads))
+            history_archive.write(segment, payloads)
+            client.zadd(segments_key, {segment: start})
+    conn.close()
+    print("迁移完成" if not dry_run else "试运行完成，未修改数据")
+
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if arg != "--dry-run"]
+    migrate(args[0] if args else str(settings.BASE_DIR / "database/history_archive.db"), dry_run="--dry-run" in sys.argv)
@@ -0,0 +1,60 @@
+# 存储后端基准测试：比较 redis 与 sqlite 后端每轮对话的存储耗时
+#   每轮：写入一轮对话（用户消息 + AI消息 + 最后活动时间）、读取最近的历史消息、读取论文集版本号与论文元数据
+#   redis 不可用时跳过 redis 后端；sqlite 后端使用临时数据库文件
+# 运行：python test/存储后端基准测试.py
+
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import redis
+
+from app.server.redis_service import ChatMessageHistory, RedisService
+from app.server.sqlite_storage import SqliteChatHistoryStore, SqliteStorageService
+from app.utils.redis_pool import redis_pool
+from app.utils.serialization import InstanceRecord
+
+TURNS = 500
+PAPERS = 5
+HISTORY_LIMIT = 20
+
+
+def bench(name, storage, history):
+    instance_id = f"bench-{uuid.uuid4().hex[:8]}"
+    storage.add_instance(instance_id, InstanceRecord(id=instance_id, created_at="2024-01-01 00:00:00"))
+    for i in range(PAPERS):
+        storage.add_paper_metadata(instance_id, f"paper-{i}", {"paper_id": f"paper-{i}", "instance_id": instance_id})
+    client = history.get_chat_message_history_client(instance_id)
+    timings = []
+    try:
+        for i in range(TURNS):
+            started = time.perf_counter()
+            history.add_user_ai_message(client, f"问题{i}" * 20, f"回答{i}" * 80, "text", None)
+            history.get_recent_messages(instance_id, HISTORY_LIMIT)
+            storage.get_paper_set_version(instance_id)
+            storage.list_paper_metadata(instance_id)
+            timings.append(time.perf_counter() - started)
+    finally:
+        client.clear()
+        for i in range(PAPERS):
+            storage.remove_paper_metadata(instance_id, f"paper-{i}")
+        storage.remove_instance(instance_id)
+    timings.sort()
+    print(f"{name}: {TURNS} 轮，平均 {sum(timings) / TURNS * 1000:.2f}ms，"
+          f"p50 {timings[TURNS // 2] * 1000:.2f}ms，p99 {timings[int(TURNS * 0.99)] * 1000:.2f}ms")
+
+
+if __name__ == "__main__":
+    try:
+        redis_pool.get_client().ping()
+        bench("redis 后端", RedisService(), ChatMessageHistory())
+    except redis.RedisError as exc:
+        print(f"redis 不可用，跳过 redis 后端：{exc}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = SqliteStorageService(os.path.join(tmp, "storage.db"))
+        bench("sqlite 后端", storage, SqliteChatHistoryStore(storage))